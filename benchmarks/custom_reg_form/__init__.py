@@ -0,0 +1,4 @@
+"""
+Sustituto mínimo de custom_reg_form para correr benchmarks fuera de Open edX.
+Solo se usa si el paquete real no está instalado (benchmarks/ va al final de sys.path).
+"""
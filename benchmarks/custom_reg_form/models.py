@@ -0,0 +1,7 @@
+from django.conf import settings
+from django.db import models
+
+
+class ExtraInfo(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, null=True, on_delete=models.CASCADE)
+    curp = models.CharField(max_length=18, blank=True, null=True)
@@ -0,0 +1,155 @@
+"""
+Utilidades comunes de los benchmarks: Django mínimo sobre SQLite, requests con
+sesión, apuntar LlaveMXOAuth2 a un stub y resumir latencias.
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+ENDPOINT_ATTRS = {
+    "ACCESS_TOKEN_URL": "obtenerToken",
+    "USER_DATA_URL": "datosUsuario",
+    "ROLES_URL": "getRolesUsuarioLogueado",
+    "LOGOUT_URL": "cerrarSesion",
+}
+
+
+def setup_django(db_path=None, **overrides):
+    """
+    Configura Django con SQLite, social_django y oauth2_llavemx y aplica migraciones.
+    Si custom_reg_form no está instalado se usa el sustituto de benchmarks/.
+    """
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    # Al final: el custom_reg_form real, si existe, tiene prioridad.
+    if BENCH_DIR not in sys.path:
+        sys.path.append(BENCH_DIR)
+
+    import django
+    from django.conf import settings
+
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="llavemx-bench-"), "db.sqlite3")
+
+    config = {
+        "SECRET_KEY": "llavemx-bench",
+        "DEBUG": False,
+        "ALLOWED_HOSTS": ["*"],
+        "USE_TZ": True,
+        "DEFAULT_AUTO_FIELD": "django.db.models.AutoField",
+        "LOGGING_CONFIG": None,
+        "INSTALLED_APPS": [
+            "django.contrib.contenttypes",
+            "django.contrib.auth",
+            "django.contrib.sessions",
+            "social_django",
+            "custom_reg_form",
+            "oauth2_llavemx.apps.OAuth2LlaveMXConfig",
+        ],
+        "DATABASES": {
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": db_path,
+                "OPTIONS": {"timeout": 30},
+            }
+        },
+        "CACHES": {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+        "AUTHENTICATION_BACKENDS": ["oauth2_llavemx.llavemx_oauth.LlaveMXOAuth2"],
+        "SOCIAL_AUTH_PIPELINE": [
+            "social_core.pipeline.social_auth.social_details",
+            "social_core.pipeline.social_auth.social_uid",
+            "social_core.pipeline.social_auth.auth_allowed",
+            "social_core.pipeline.social_auth.social_user",
+            "social_core.pipeline.user.get_username",
+            "social_core.pipeline.user.create_user",
+            "social_core.pipeline.social_auth.associate_user",
+            "social_core.pipeline.social_auth.load_extra_data",
+            "social_core.pipeline.user.user_details",
+        ],
+        "SOCIAL_AUTH_LLAVEMX_KEY": "bench-client",
+        "SOCIAL_AUTH_LLAVEMX_SECRET": "bench-secret",
+        "SOCIAL_AUTH_LLAVEMX_WS_USER": "bench",
+        "SOCIAL_AUTH_LLAVEMX_WS_PASSWORD": "bench",
+    }
+    config.update(overrides)
+    settings.configure(**config)
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+    return db_path
+
+
+def use_database(db_path, fresh=False):
+    """
+    Cambia la base SQLite de la conexión default (ya configurada) y la migra.
+    Con fresh=True se borra el archivo antes.
+    """
+    from django.core.management import call_command
+    from django.db import connections
+
+    connections.close_all()
+    if fresh and os.path.exists(db_path):
+        os.remove(db_path)
+    connections["default"].settings_dict["NAME"] = db_path
+    call_command("migrate", verbosity=0)
+    return db_path
+
+
+def point_backend_at(stub):
+    """Hace que LlaveMXOAuth2 hable con el stub local en lugar de LlaveMX."""
+    from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+    for attr, name in ENDPOINT_ATTRS.items():
+        setattr(LlaveMXOAuth2, attr, stub.url(name))
+
+
+def make_request(path="/", data=None, session=None, cookies=None):
+    """Request GET con sesión de base de datos, como la vería una vista del LMS."""
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.test import RequestFactory
+
+    request = RequestFactory().get(path, data or {})
+    request.session = session if session is not None else SessionStore()
+    if cookies:
+        request.COOKIES.update(cookies)
+    return request
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(samples):
+    """Resumen (en ms) de una lista de duraciones en segundos."""
+    values = sorted(s * 1000.0 for s in samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values), 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3),
+    }
+
+
+def print_table(title, rows, columns):
+    print(f"\n{title}")
+    widths = [max(len(str(c)), *(len(str(r.get(c, ""))) for r in rows)) for c in columns]
+    print("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(w) for c, w in zip(columns, widths)))
@@ -0,0 +1,239 @@
+"""
+Servidor local que imita los WS de LlaveMX para benchmarks.
+
+Endpoints (mismas rutas que producción, bajo /ws/rest/oauth/):
+- obtenerToken, datosUsuario, getRolesUsuarioLogueado, cerrarSesion
+
+Configurable por endpoint: latencia (ms), jitter (ms) y tasa de error (HTTP 503).
+El code recibido en obtenerToken tiene la forma "code-<usuario>-<nonce>", de modo
+que el mismo usuario sintético puede volver a iniciar sesión (usuarios recurrentes).
+obtenerToken también acepta grantType=refresh_token (refreshToken de un solo uso).
+
+Uso directo:
+    python -m benchmarks.llavemx_stub --port 8099 --latency 80 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = {
+    "obtenerToken": "token",
+    "datosUsuario": "user_data",
+    "getRolesUsuarioLogueado": "roles",
+    "cerrarSesion": "logout",
+}
+
+PAYLOAD_SHAPES = ("full", "minimal", "no_curp", "huge_names")
+
+
+def parse_per_endpoint(value, cast=float):
+    """
+    "80" -> mismo valor para todos; "token=120,user_data=60" -> por endpoint.
+    """
+    if isinstance(value, dict):
+        return value
+    if value is None or value == "":
+        return {}
+    if "=" not in str(value):
+        return {name: cast(value) for name in ENDPOINTS.values()}
+    result = {}
+    for item in str(value).split(","):
+        name, _, raw = item.partition("=")
+        result[name.strip()] = cast(raw)
+    return result
+
+
+def synthetic_user(index, shape="full"):
+    """Respuesta de /datosUsuario para el usuario sintético `index`."""
+    curp = f"BENC{index:06d}HDFXXX{index % 100:02d}"[:18]
+    data = {
+        "idUsuario": 100000 + index,
+        "login": f"bench{index}",
+        "correo": f"bench{index}@example.mx",
+    }
+    if shape == "minimal":
+        return data
+
+    nombre = "Ana María"
+    primer = "Pérez"
+    if shape == "huge_names":
+        nombre = "Ana " * 2500
+        primer = "Pérez " * 2500
+
+    data.update({
+        "nombre": nombre,
+        "primerApellido": primer,
+        "segundoApellido": "López",
+        "telVigente": "5555555555",
+        "fechaNacimiento": "01/01/1990",
+        "sexo": "M",
+        "correoVerificado": True,
+        "telefonoVerificado": False,
+        "estadoNacimiento": "CDMX",
+        "domicilio": {"alcaldiaMunicipio": "Benito Juárez"},
+    })
+    if shape != "no_curp":
+        data["curp"] = curp
+    return data
+
+
+class StubConfig:
+
+    def __init__(self, latency_ms=None, jitter_ms=None, error_rate=None, shape="full"):
+        self.latency_ms = parse_per_endpoint(latency_ms)
+        self.jitter_ms = parse_per_endpoint(jitter_ms)
+        self.error_rate = parse_per_endpoint(error_rate)
+        self.shape = shape
+        self.hits = {name: 0 for name in ENDPOINTS.values()}
+        self.errors = {name: 0 for name in ENDPOINTS.values()}
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def count(self, endpoint, error=False):
+        with self._lock:
+            self.hits[endpoint] += 1
+            if error:
+                self.errors[endpoint] += 1
+
+    def issue_token(self, code):
+        # code-<usuario>-<nonce>; cualquier otra cosa es el usuario 0.
+        parts = (code or "").split("-")
+        index = int(parts[1]) if len(parts) > 2 and parts[1].isdigit() else 0
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._tokens[token] = index
+        return token
+
+    def refresh(self, refresh_token):
+        # refreshToken = "r-<accessToken>"; el token anterior deja de ser válido.
+        old = (refresh_token or "")[2:]
+        with self._lock:
+            index = self._tokens.pop(old, None)
+            if index is None:
+                return None
+            token = secrets.token_urlsafe(24)
+            self._tokens[token] = index
+        return token
+
+    def user_for(self, token):
+        with self._lock:
+            return self._tokens.get(token)
+
+
+def make_handler(config):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers y body van en escrituras separadas: sin esto Nagle + delayed
+        # ACK agregan ~40 ms artificiales a cada respuesta keep-alive.
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+
+            endpoint = ENDPOINTS.get(self.path.rsplit("/", 1)[-1].split("?")[0])
+            if endpoint is None:
+                self._reply(404, {"error": "not_found"})
+                return
+
+            delay = config.latency_ms.get(endpoint, 0) + random.uniform(0, config.jitter_ms.get(endpoint, 0))
+            if delay:
+                time.sleep(delay / 1000.0)
+
+            if random.random() < config.error_rate.get(endpoint, 0):
+                config.count(endpoint, error=True)
+                self._reply(503, {"error": "server_error", "errorDescription": "stub"})
+                return
+
+            config.count(endpoint)
+
+            if endpoint == "token":
+                payload = json.loads(raw or b"{}")
+                if payload.get("grantType") == "refresh_token":
+                    token = config.refresh(payload.get("refreshToken"))
+                    if token is None:
+                        self._reply(400, {"error": "invalid_grant", "errorDescription": "stub"})
+                        return
+                else:
+                    token = config.issue_token(payload.get("code"))
+                self._reply(200, {"accessToken": token, "refreshToken": f"r-{token}", "expiresIn": 900})
+                return
+
+            index = config.user_for(self.headers.get("accessToken"))
+            if index is None:
+                self._reply(200, {"error": "invalid_token", "errorDescription": "stub"})
+                return
+
+            if endpoint == "user_data":
+                self._reply(200, synthetic_user(index, config.shape))
+            elif endpoint == "roles":
+                self._reply(200, [{"idRol": 1, "nombre": "ALUMNO"}])
+            else:
+                self._reply(200, {"estatus": "OK"})
+
+        do_GET = _handle
+        do_POST = _handle
+
+    return Handler
+
+
+class LlaveMXStub:
+    """Servidor stub en un hilo daemon. base_url queda listo tras start()."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StubConfig()
+        self.server = ThreadingHTTPServer((host, port), make_handler(self.config))
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_port}/ws/rest/oauth"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, name):
+        return f"{self.base_url}/{name}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", default="0", help="ms, global o por endpoint (token=120,user_data=60)")
+    parser.add_argument("--jitter", default="0")
+    parser.add_argument("--error-rate", default="0")
+    parser.add_argument("--payload", choices=PAYLOAD_SHAPES, default="full")
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.payload)
+    stub = LlaveMXStub(config, port=args.port)
+    print(f"LlaveMX stub escuchando en {stub.base_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
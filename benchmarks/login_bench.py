@@ -0,0 +1,185 @@
+"""
+Benchmark end-to-end de un login LlaveMX contra un stub local.
+
+Cada login recorre auth_url -> callback (auth_complete: canje de code,
+datosUsuario, pipeline completo con asociación por CURP) y opcionalmente
+revoke_token, con la concurrencia indicada. Reporta p50/p95/p99 por fase y el
+throughput total.
+
+Ejemplos:
+    python -m benchmarks.login_bench --logins 500 --concurrency 20 --latency 80
+    python -m benchmarks.login_bench --latency token=150,user_data=60 --error-rate 0.02 \\
+        --users 50 --roles --logout --json /tmp/login-bench.json
+
+Los ajustes SOCIAL_AUTH_LLAVEMX_* adicionales se pasan con --setting NOMBRE=valor_json.
+"""
+
+import argparse
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks import harness
+from benchmarks.llavemx_stub import PAYLOAD_SHAPES, LlaveMXStub, StubConfig
+
+PHASES = ["auth_url", "token", "user_data", "pipeline", "callback", "logout", "total"]
+REDIRECT_URI = "/auth/complete/llavemx/"
+
+
+def timed_backend_class():
+    from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+    class TimedLlaveMXOAuth2(LlaveMXOAuth2):
+        """Mide las fases remotas sin alterar el comportamiento del backend."""
+
+        timings = None
+
+        def request_access_token(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().request_access_token(*args, **kwargs)
+            finally:
+                self.timings["token"] = time.perf_counter() - start
+
+        def user_data(self, access_token, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().user_data(access_token, *args, **kwargs)
+            finally:
+                self.timings["user_data"] = time.perf_counter() - start
+
+    return TimedLlaveMXOAuth2
+
+
+class LoginRunner:
+
+    def __init__(self, backend_class, users, logout):
+        self.backend_class = backend_class
+        self.users = users
+        self.logout = logout
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _backend(self, request, timings):
+        from social_django.utils import load_strategy
+
+        backend = self.backend_class(strategy=load_strategy(request), redirect_uri=REDIRECT_URI)
+        backend.timings = timings
+        return backend
+
+    def run_one(self, _):
+        from django.db import connection
+
+        timings = {}
+        started = time.perf_counter()
+        try:
+            # 1) Click en el botón LlaveMX
+            request = harness.make_request("/auth/login/llavemx/")
+            t0 = time.perf_counter()
+            url = self._backend(request, timings).auth_url()
+            timings["auth_url"] = time.perf_counter() - t0
+            request.session.save()
+
+            # 2) Callback de LlaveMX con code + state
+            state = parse_qs(urlsplit(url).query)["state"][0]
+            code = f"code-{random.randrange(self.users)}-{secrets.token_hex(4)}"
+            callback = harness.make_request(REDIRECT_URI, {"code": code, "state": state}, session=request.session)
+            backend = self._backend(callback, timings)
+            t0 = time.perf_counter()
+            user = backend.complete()
+            timings["callback"] = time.perf_counter() - t0
+            timings["pipeline"] = timings["callback"] - timings.get("token", 0) - timings.get("user_data", 0)
+            if user is None or not hasattr(user, "pk"):
+                raise RuntimeError(f"login sin usuario: {user!r}")
+
+            # 3) Logout remoto
+            if self.logout:
+                social = user.social_auth.get(provider="llavemx")
+                t0 = time.perf_counter()
+                backend.revoke_token(social.extra_data.get("access_token"), social.uid)
+                timings["logout"] = time.perf_counter() - t0
+
+            timings["total"] = time.perf_counter() - started
+            with self._lock:
+                for phase, value in timings.items():
+                    self.samples[phase].append(value)
+        except Exception as e:
+            with self._lock:
+                self.errors[type(e).__name__] += 1
+        finally:
+            connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=1000, help="Usuarios sintéticos distintos (menos = más recurrentes).")
+    parser.add_argument("--latency", default="50", help="ms, global o por endpoint (token=120,user_data=60)")
+    parser.add_argument("--jitter", default="10")
+    parser.add_argument("--error-rate", default="0")
+    parser.add_argument("--payload", choices=PAYLOAD_SHAPES, default="full")
+    parser.add_argument("--roles", action="store_true", help="Activa SOCIAL_AUTH_LLAVEMX_FETCH_ROLES.")
+    parser.add_argument("--logout", action="store_true", help="Mide también revoke_token.")
+    parser.add_argument("--setting", action="append", default=[], help="NOMBRE=valor_json (sin prefijo).")
+    parser.add_argument("--json", help="Escribe el resultado en este archivo.")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    overrides = {"SOCIAL_AUTH_LLAVEMX_FETCH_ROLES": args.roles}
+    for item in args.setting:
+        name, _, raw = item.partition("=")
+        overrides[f"SOCIAL_AUTH_LLAVEMX_{name}"] = json.loads(raw)
+    harness.setup_django(**overrides)
+
+    stub = LlaveMXStub(StubConfig(args.latency, args.jitter, args.error_rate, args.payload)).start()
+    harness.point_backend_at(stub)
+
+    runner = LoginRunner(timed_backend_class(), args.users, args.logout)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(runner.run_one, range(args.logins)))
+    wall = time.perf_counter() - started
+    stub.stop()
+
+    ok = len(runner.samples["total"])
+    result = {
+        "config": vars(args),
+        "wall_s": round(wall, 3),
+        "logins_ok": ok,
+        "logins_failed": sum(runner.errors.values()),
+        "throughput_per_s": round(ok / wall, 2) if wall else 0,
+        "errors": dict(runner.errors),
+        "upstream_hits": dict(stub.config.hits),
+        "upstream_errors": dict(stub.config.errors),
+        "phases": {phase: harness.summarize(runner.samples[phase]) for phase in PHASES if runner.samples[phase]},
+    }
+
+    rows = [dict(phase=phase, **stats) for phase, stats in result["phases"].items()]
+    harness.print_table(
+        f"LlaveMX login: {ok} ok / {result['logins_failed']} errores en {result['wall_s']}s "
+        f"({result['throughput_per_s']} logins/s, concurrencia {args.concurrency})",
+        rows,
+        ["phase", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"],
+    )
+    print(f"\nLlamadas al stub: {result['upstream_hits']}  errores del stub: {result['upstream_errors']}")
+    if result["errors"]:
+        print(f"Logins fallidos por tipo: {result['errors']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    main()
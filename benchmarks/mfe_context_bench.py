@@ -0,0 +1,130 @@
+"""
+Costo por request del parche de contexto MFE (get_auth_context / get_mfe_context).
+
+Compara, para cada escenario, la función original sin parche, el wrapper que
+siempre consulta la sesión (sin LlaveMXDetailsFlagMiddleware) y el wrapper con
+señal barata. Cada iteración usa un SessionStore nuevo, como un request real:
+la carga de la sesión (consulta a la base) solo ocurre si el wrapper la toca.
+
+Escenarios:
+- anon_sin_cookie:   visitante nuevo, sin cookie de sesión
+- anon_con_sesion:   visitante con sesión en base pero sin LlaveMX
+- llavemx_sesion:    details en la sesión (DETAILS_STORAGE = "session")
+- llavemx_cache:     details en el cache, solo la llave en sesión
+
+Ejemplo:
+    python -m benchmarks.mfe_context_bench --iterations 5000 --json /tmp/mfe.json
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks import harness
+from benchmarks.llavemx_stub import synthetic_user
+
+VARIANTS = ["sin_parche", "siempre_sesion", "senal_barata"]
+
+
+def core_context(request, *args, **kwargs):
+    """Imitación del contexto del core cuando el pipeline no trae details."""
+    return {"pipeline_user_details": {}, "currentProvider": None}
+
+
+def build_scenarios():
+    from django.conf import settings
+    from django.contrib.sessions.backends.db import SessionStore
+
+    from oauth2_llavemx.cache import get_cache, make_key
+    from oauth2_llavemx.details import DETAILS_COOKIE, SESSION_KEY, SESSION_REF_KEY, compact_details
+    from oauth2_llavemx.fields import get_field_schema
+
+    details = get_field_schema().user_details(synthetic_user(7, "full"))
+
+    def saved_session(**data):
+        session = SessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+
+    anon_key = saved_session(next_url="/dashboard")
+    session_key = saved_session(**{SESSION_KEY: details})
+    get_cache().set(make_key("details", "bench-ref"), compact_details(details), 3600)
+    cache_key = saved_session(**{SESSION_REF_KEY: "bench-ref"})
+
+    cookie = settings.SESSION_COOKIE_NAME
+    return {
+        "anon_sin_cookie": (None, {}),
+        "anon_con_sesion": (anon_key, {cookie: anon_key}),
+        "llavemx_sesion": (session_key, {cookie: session_key, DETAILS_COOKIE: "1"}),
+        "llavemx_cache": (cache_key, {cookie: cache_key, DETAILS_COOKIE: "1"}),
+    }
+
+
+def run_variant(fn, session_key, cookies, iterations):
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.db import connection
+
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    samples = []
+    found = 0
+    with connection.execute_wrapper(count):
+        for _ in range(iterations):
+            request = harness.make_request("/login", session=SessionStore(session_key), cookies=cookies)
+            start = time.perf_counter()
+            context = fn(request)
+            samples.append(time.perf_counter() - start)
+            found += bool(context["pipeline_user_details"])
+
+    # summarize() reporta ms; escalamos a µs porque estos tiempos son muy cortos.
+    stats = harness.summarize([sample * 1000 for sample in samples])
+    stats = {key.replace("_ms", "_us"): value for key, value in stats.items()}
+    stats["queries_per_req"] = round(queries[0] / iterations, 3)
+    stats["details_found"] = found == iterations
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", help="Escribe el resultado en este archivo.")
+    args = parser.parse_args(argv)
+
+    harness.setup_django()
+
+    from oauth2_llavemx.details import with_details_fallback
+
+    variants = {
+        "sin_parche": core_context,
+        "siempre_sesion": with_details_fallback(core_context, gated=False),
+        "senal_barata": with_details_fallback(core_context, gated=True),
+    }
+
+    result = {"config": vars(args), "scenarios": {}}
+    rows = []
+    for scenario, (session_key, cookies) in build_scenarios().items():
+        result["scenarios"][scenario] = {}
+        for variant in VARIANTS:
+            stats = run_variant(variants[variant], session_key, cookies, args.iterations)
+            result["scenarios"][scenario][variant] = stats
+            rows.append(dict(scenario=scenario, variant=variant, **stats))
+
+    harness.print_table(
+        f"Parche de contexto MFE: {args.iterations} requests por variante",
+        rows,
+        ["scenario", "variant", "mean_us", "p50_us", "p99_us", "queries_per_req", "details_found"],
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+"""
+Microbenchmarks de las funciones calientes del backend y del pipeline.
+
+Mide, sin red, el trabajo de CPU y de base por login en:
+- LlaveMXOAuth2.get_user_details() y _valid_user_response(),
+- LlaveMXOAuth2.validate_state() (state en sesión y firmado),
+- pipeline.associate_by_curp() y pipeline.preserve_llavemx_details(),
+- details.with_details_fallback() (el wrapper del contexto MFE; el detalle
+  por escenario está en mfe_context_bench).
+
+Payloads realistas y adversos: perfil completo, mínimo, sin CURP, nombres
+enormes, CURP sucia (minúsculas/espacios), genérica, duplicada entre cuentas
+activas, activa + inactiva, solo inactivas e inexistente.
+
+Los casos que tocan la base corren sobre SQLite con fixtures sintéticos de
+usuarios / ExtraInfo / CurpIndex de cada tamaño de --rows (deterministas; se
+guardan en --fixtures-dir y se reutilizan). --seed fija qué filas consulta
+cada caso. Por caso se reporta p50/p95/p99 en µs, consultas por llamada y
+asignaciones de memoria por llamada (tracemalloc, en una pasada aparte para
+no sesgar los tiempos).
+
+--json escribe una línea base legible por máquina; --compare la contrasta
+con otra y termina con código 1 si algún caso es más lento que la tolerancia
+o hace más consultas.
+
+Ejemplos:
+    python -m benchmarks.micro_bench --rows 10000 --json /tmp/micro.json
+    python -m benchmarks.micro_bench --rows 10000,100000,1000000 \\
+        --fixtures-dir /var/tmp/llavemx-micro --json baseline-3.2.1.json
+    python -m benchmarks.micro_bench --rows 10000 --compare baseline-3.2.1.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+from benchmarks import harness
+from benchmarks.llavemx_stub import synthetic_user
+
+FIXTURE_VERSION = 1
+BATCH_SIZE = 5000
+# Cuántos objetivos distintos se rotan por caso de base (evita medir una sola fila caliente).
+TARGETS_PER_CASE = 256
+
+# Caso: nombre, si depende del tamaño de la base, y builder(context) -> call(i).
+Case = namedtuple("Case", ["name", "db", "build"])
+
+
+# -------------------------------------------------------------
+# Fixtures
+# -------------------------------------------------------------
+def fixture_curp(index):
+    """
+    CURP del usuario `index` del fixture. Por cada bloque de 100 usuarios:
+    - 1 comparte la CURP de 0 (dos cuentas activas: ambigua),
+    - 3 comparte la de 2 y está inactiva (activa + inactiva),
+    - 5 y 6 comparten CURP y ambas están inactivas,
+    - 7 tiene la CURP genérica, 8 no tiene CURP.
+    """
+    slot = index % 100
+    if slot in (1, 3, 6):
+        index -= 1
+    elif slot == 7:
+        return "XEXX010101HDFXXX04"
+    elif slot == 8:
+        return None
+    return f"MB{index:08d}HDFXXX{index % 100:02d}"
+
+
+def fixture_active(index):
+    return index % 100 not in (3, 5, 6)
+
+
+def use_fixture(rows, fixtures_dir):
+    """Apunta la conexión a la base del tamaño `rows`, construyéndola si falta."""
+    from django.contrib.auth import get_user_model
+
+    path = os.path.join(fixtures_dir, f"micro-{rows}-v{FIXTURE_VERSION}.sqlite3")
+    harness.use_database(path)
+    if get_user_model().objects.count() != rows:
+        # Incompleto o de otro tamaño: se rehace desde cero.
+        harness.use_database(path, fresh=True)
+        started = time.perf_counter()
+        build_fixture(rows)
+        print(f"Fixture de {rows} filas generado en {time.perf_counter() - started:.1f}s: {path}")
+    return path
+
+
+def build_fixture(rows):
+    from custom_reg_form.models import ExtraInfo
+    from django.contrib.auth import get_user_model
+    from django.db import connection, transaction
+
+    from oauth2_llavemx.models import CurpIndex
+
+    User = get_user_model()
+
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA journal_mode = MEMORY")
+
+    # bulk_create no dispara señales: CurpIndex se llena aquí mismo.
+    for start in range(0, rows, BATCH_SIZE):
+        indexes = range(start, min(start + BATCH_SIZE, rows))
+        with transaction.atomic():
+            users = User.objects.bulk_create(
+                User(
+                    id=index + 1,
+                    username=f"micro{index}",
+                    email=f"micro{index}@example.mx",
+                    password="!",
+                    is_active=fixture_active(index),
+                )
+                for index in indexes
+            )
+            infos = ExtraInfo.objects.bulk_create(
+                ExtraInfo(id=user.id, user_id=user.id, curp=fixture_curp(index))
+                for index, user in zip(indexes, users)
+            )
+            CurpIndex.objects.bulk_create(
+                CurpIndex(extra_info_id=info.id, curp=info.curp, user_id=info.user_id)
+                for info in infos
+                if info.curp
+            )
+
+
+def fixture_targets(rows, slot, rng):
+    """Índices del fixture con el patrón `slot`, repartidos por toda la tabla."""
+    blocks = max(rows // 100, 1)
+    return [rng.randrange(blocks) * 100 + slot for _ in range(TARGETS_PER_CASE)]
+
+
+# -------------------------------------------------------------
+# Casos
+# -------------------------------------------------------------
+def make_backend(request=None):
+    from social_django.utils import load_strategy
+
+    from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+    request = request or harness.make_request("/auth/complete/llavemx/")
+    return LlaveMXOAuth2(strategy=load_strategy(request), redirect_uri="/auth/complete/llavemx/")
+
+
+def payload_case(method, shape, mutate=None):
+    def build(context):
+        backend = make_backend()
+        payload = synthetic_user(7, shape)
+        if mutate:
+            mutate(payload)
+        fn = getattr(backend, method)
+        return lambda i: fn(payload)
+    return build
+
+
+def session_state_case(valid):
+    def build(context):
+        from social_core.exceptions import AuthFailed
+
+        backend = make_backend()
+        backend.strategy.session_set("llavemx_state", "s" * 43)
+        backend.data = {"code": "c", "state": "s" * 43 if valid else "x" * 43}
+
+        def call(i):
+            try:
+                backend.validate_state()
+            except AuthFailed:
+                pass
+        return call
+    return build
+
+
+def signed_state_case(variant):
+    def build(context):
+        from django.middleware.csrf import CsrfViewMiddleware
+        from social_core.exceptions import AuthFailed
+
+        from oauth2_llavemx.state import make_state
+
+        request = harness.make_request("/auth/complete/llavemx/")
+        CsrfViewMiddleware(lambda r: None).process_request(request)
+        backend = make_backend(request)
+        # Un state nuevo por llamada: el nonce es de un solo uso.
+        states = [make_state(request) for _ in range(context["calls"])]
+        if variant == "tampered":
+            states = [state[:-1] + ("0" if state[-1] != "0" else "1") for state in states]
+        elif variant == "replay":
+            backend.data = {"code": "first", "state": states[0]}
+            backend.validate_state()
+            states = [states[0]] * len(states)
+
+        def call(i):
+            backend.data = {"code": f"code-{i}", "state": states[i % len(states)]}
+            try:
+                backend.validate_state()
+            except AuthFailed:
+                pass
+        return call
+    return build
+
+
+def associate_case(slot=None, curp=None, shape="full", dirty=False):
+    def build(context):
+        from oauth2_llavemx.pipeline import associate_by_curp
+
+        backend = make_backend()
+        if slot is None:
+            payloads = [backend.get_user_details({**synthetic_user(7, shape), "curp": curp})]
+        else:
+            payloads = []
+            for index in fixture_targets(context["rows"], slot, context["rng"]):
+                target = fixture_curp(index)
+                if dirty:
+                    target = f"  {target.lower()} "
+                payloads.append(backend.get_user_details({**synthetic_user(index, shape), "curp": target}))
+        return lambda i: associate_by_curp(backend, payloads[i % len(payloads)], user=None)
+    return build
+
+
+def preserve_case(shape, storage):
+    def build(context):
+        from django.test import override_settings
+
+        from oauth2_llavemx.pipeline import preserve_llavemx_details
+
+        with override_settings(SOCIAL_AUTH_LLAVEMX_DETAILS_STORAGE=storage):
+            backend = make_backend()
+            details = backend.get_user_details(synthetic_user(7, shape))
+            # El setting queda resuelto en el sitio del backend antes de salir del override.
+            backend.setting("DETAILS_STORAGE", "session")
+        return lambda i: preserve_llavemx_details(backend, details)
+    return build
+
+
+def fallback_case(variant):
+    def build(context):
+        from django.contrib.sessions.backends.db import SessionStore
+
+        from oauth2_llavemx.details import DETAILS_COOKIE, SESSION_KEY, with_details_fallback
+        from oauth2_llavemx.fields import get_field_schema
+
+        details = get_field_schema().user_details(synthetic_user(7, "full"))
+        pipeline_details = details if variant == "pipeline" else {}
+
+        def core_context(request, *args, **kwargs):
+            return {"pipeline_user_details": dict(pipeline_details), "currentProvider": None}
+
+        wrapped = with_details_fallback(core_context)
+        session = SessionStore()
+        session[SESSION_KEY] = details
+        session.save()
+        key = session.session_key
+        cookies = {DETAILS_COOKIE: "1"} if variant == "session" else {}
+
+        def call(i):
+            # Sesión nueva por llamada, como un request real.
+            return wrapped(harness.make_request("/login", session=SessionStore(key), cookies=cookies))
+        return call
+    return build
+
+
+CASES = [
+    Case("get_user_details/full", False, payload_case("get_user_details", "full")),
+    Case("get_user_details/minimal", False, payload_case("get_user_details", "minimal")),
+    Case("get_user_details/no_curp", False, payload_case("get_user_details", "no_curp")),
+    Case("get_user_details/huge_names", False, payload_case("get_user_details", "huge_names")),
+    Case("valid_user_response/full", False, payload_case("_valid_user_response", "full")),
+    Case("valid_user_response/huge_names", False, payload_case("_valid_user_response", "huge_names")),
+    Case("valid_user_response/invalid", False, payload_case("_valid_user_response", "full", lambda p: p.pop("idUsuario"))),
+    Case("validate_state/session_ok", False, session_state_case(True)),
+    Case("validate_state/session_mismatch", False, session_state_case(False)),
+    Case("validate_state/signed_ok", False, signed_state_case("ok")),
+    Case("validate_state/signed_tampered", False, signed_state_case("tampered")),
+    Case("validate_state/signed_replay", False, signed_state_case("replay")),
+    Case("preserve_details/session_full", False, preserve_case("full", "session")),
+    Case("preserve_details/session_huge_names", False, preserve_case("huge_names", "session")),
+    Case("preserve_details/cache_full", False, preserve_case("full", "cache")),
+    Case("details_fallback/pipeline", False, fallback_case("pipeline")),
+    Case("details_fallback/session", True, fallback_case("session")),
+    Case("details_fallback/anonymous", False, fallback_case("anonymous")),
+    Case("associate_by_curp/unique", True, associate_case(slot=10)),
+    Case("associate_by_curp/dirty_curp", True, associate_case(slot=10, dirty=True)),
+    Case("associate_by_curp/huge_names", True, associate_case(slot=10, shape="huge_names")),
+    Case("associate_by_curp/duplicate_active", True, associate_case(slot=0)),
+    Case("associate_by_curp/active_inactive", True, associate_case(slot=2)),
+    Case("associate_by_curp/inactive_only", True, associate_case(slot=5)),
+    Case("associate_by_curp/not_found", True, associate_case(curp="ZZZZ000000HDFXXX00")),
+    Case("associate_by_curp/generic", True, associate_case(curp="XEXX010101HDFXXX04")),
+    Case("associate_by_curp/missing_curp", True, associate_case(shape="no_curp")),
+    Case("associate_by_curp/huge_curp", True, associate_case(curp="x" * 100000)),
+]
+
+
+# -------------------------------------------------------------
+# Medición
+# -------------------------------------------------------------
+def measure(case, context, iterations, warmup, alloc_iterations):
+    from django.db import connection
+
+    calls = warmup + iterations + alloc_iterations
+    call = case.build(dict(context, calls=calls))
+
+    for i in range(warmup):
+        call(i)
+
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    samples = []
+    gc.collect()
+    gc.disable()
+    try:
+        with connection.execute_wrapper(count):
+            for i in range(warmup, warmup + iterations):
+                start = time.perf_counter()
+                call(i)
+                samples.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+    # Asignaciones en una pasada aparte: tracemalloc multiplica los tiempos.
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for i in range(warmup + iterations, calls):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            call(i)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+
+    # summarize() reporta ms; escalamos a µs porque estos tiempos son muy cortos.
+    stats = harness.summarize([sample * 1000 for sample in samples])
+    stats = {key.replace("_ms", "_us"): value for key, value in stats.items()}
+    stats["queries_per_call"] = round(queries[0] / iterations, 3)
+    if peaks:
+        stats["alloc_peak_kb"] = round(sum(peaks) / len(peaks) / 1024, 2)
+        stats["alloc_retained_kb"] = round(sum(retained) / len(retained) / 1024, 2)
+    return stats
+
+
+def environment():
+    import django
+    import sqlite3
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=harness.REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "commit": commit,
+        "fixture_version": FIXTURE_VERSION,
+    }
+
+
+# -------------------------------------------------------------
+# Comparación con una línea base
+# -------------------------------------------------------------
+def flatten(result):
+    flat = {}
+    for name, stats in result["cpu"].items():
+        flat[(name, "-")] = stats
+    for rows, cases in result["db"].items():
+        for name, stats in cases.items():
+            flat[(name, rows)] = stats
+    return flat
+
+
+def compare(baseline, result, tolerance):
+    old, new = flatten(baseline), flatten(result)
+    rows, regressions = [], 0
+    for key, stats in new.items():
+        before = old.get(key)
+        if before is None:
+            continue
+        delta = (stats["p50_us"] - before["p50_us"]) / before["p50_us"] if before["p50_us"] else 0.0
+        status = "ok"
+        if stats["queries_per_call"] > before["queries_per_call"]:
+            status = "consultas"
+        elif delta > tolerance:
+            status = "lento"
+        regressions += status != "ok"
+        rows.append({
+            "case": key[0],
+            "rows": key[1],
+            "base_p50_us": before["p50_us"],
+            "p50_us": stats["p50_us"],
+            "delta_pct": round(delta * 100, 1),
+            "base_queries": before["queries_per_call"],
+            "queries": stats["queries_per_call"],
+            "status": status,
+        })
+    harness.print_table(
+        f"Comparación contra la línea base (tolerancia {tolerance:.0%} en p50)",
+        rows,
+        ["case", "rows", "base_p50_us", "p50_us", "delta_pct", "base_queries", "queries", "status"],
+    )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000", help="Tamaños del fixture separados por coma (10000,100000,1000000).")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--alloc-iterations", type=int, default=200, help="Llamadas medidas con tracemalloc (0 = sin asignaciones).")
+    parser.add_argument("--only", help="Solo los casos cuyo nombre contiene este texto.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--fixtures-dir", default=os.path.join(tempfile.gettempdir(), "llavemx-micro"))
+    parser.add_argument("--json", help="Escribe el resultado (línea base) en este archivo.")
+    parser.add_argument("--compare", help="Línea base JSON contra la cual comparar.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Aumento máximo aceptado del p50 (fracción).")
+    args = parser.parse_args(argv)
+
+    sizes = [int(value) for value in args.rows.split(",") if value.strip()]
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+    harness.setup_django(
+        db_path=os.path.join(args.fixtures_dir, "micro-base.sqlite3"),
+        MIDDLEWARE=["django.middleware.csrf.CsrfViewMiddleware"],
+    )
+
+    import logging
+
+    # El costo del logging no es parte de lo que se mide (ver audit.py).
+    logging.disable(logging.CRITICAL)
+
+    cases = [case for case in CASES if not args.only or args.only in case.name]
+    result = {"environment": environment(), "config": vars(args), "cpu": {}, "db": {}}
+    table = []
+
+    def run(case, rows):
+        context = {"rows": rows, "rng": random.Random(args.seed)}
+        stats = measure(case, context, args.iterations, args.warmup, args.alloc_iterations)
+        table.append(dict(case=case.name, rows=rows if case.db else "-", **stats))
+        return stats
+
+    for index, rows in enumerate(sizes):
+        use_fixture(rows, args.fixtures_dir)
+        result["db"][str(rows)] = {case.name: run(case, rows) for case in cases if case.db}
+        if index == 0:
+            # Los casos sin base no dependen del tamaño: una sola vez.
+            result["cpu"] = {case.name: run(case, rows) for case in cases if not case.db}
+
+    harness.print_table(
+        f"Microbenchmarks: {args.iterations} llamadas por caso",
+        table,
+        ["case", "rows", "p50_us", "p95_us", "p99_us", "queries_per_call", "alloc_peak_kb", "alloc_retained_kb"],
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if compare(baseline, result, args.tolerance):
+            sys.exit(1)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Control de admisión de llamadas salientes a LlaveMX, compartido por todo el
+clúster vía el cache de Django (Redis/Memcached en producción).
+
+Cada endpoint limitado tiene una tasa (llamadas/segundo). El tiempo se divide
+en ventanas cortas con un cupo de rate * window llamadas; cada llamada reserva
+su turno con un incr() atómico en la ventana actual o, si está llena, en las
+siguientes, y espera hasta su turno. Así un pico de callbacks se convierte en
+un flujo constante que LlaveMX acepta.
+
+La espera está acotada por max_wait: si no hay turno dentro de ese lapso la
+llamada se rechaza con AdmissionRejected (la cola "se desborda").
+
+SOCIAL_AUTH_LLAVEMX_ADMISSION_RATES = {"token": 40, "user_data": 40}
+
+areserve() es la versión coroutine para el camino asyncio (API async del cache).
+"""
+
+import math
+import time
+
+from oauth2_llavemx.cache import make_key
+
+DEFAULT_MAX_WAIT = 2.0
+DEFAULT_WINDOW = 0.25
+
+
+class AdmissionRejected(Exception):
+    """No hubo turno para la llamada dentro de la espera máxima."""
+
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f"LlaveMX {name}: límite de llamadas excedido (cola de admisión llena).")
+
+
+class AdmissionController:
+
+    def __init__(self, cache, name, rate, max_wait=DEFAULT_MAX_WAIT, window=DEFAULT_WINDOW):
+        self.cache = cache
+        self.name = name
+        self.max_wait = max_wait
+        # Con tasas bajas la ventana crece para que el cupo sea al menos 1.
+        self.window = max(window, 1.0 / rate)
+        self.quota = max(1, int(rate * self.window))
+        self._ttl = int(math.ceil(max_wait + self.window)) + 5
+
+    def _take(self, slot):
+        key = make_key("adm", self.name, slot)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 0, self._ttl)
+            return self.cache.incr(key)
+
+    async def _atake(self, slot):
+        key = make_key("adm", self.name, slot)
+        try:
+            return await self.cache.aincr(key)
+        except ValueError:
+            await self.cache.aadd(key, 0, self._ttl)
+            return await self.cache.aincr(key)
+
+    def reserve(self, now=None):
+        """
+        Reserva un turno y regresa los segundos que hay que esperar antes de
+        hacer la llamada (0 si hay cupo inmediato). Lanza AdmissionRejected si
+        el siguiente turno libre queda más allá de max_wait.
+        """
+        now = time.time() if now is None else now
+        for slot in self._slots(now):
+            delay = self._delay(slot, self._take(slot), now)
+            if delay is None:
+                continue
+            if delay > self.max_wait:
+                break
+            return max(delay, 0.0)
+
+        raise AdmissionRejected(self.name)
+
+    async def areserve(self, now=None):
+        """Versión coroutine de reserve()."""
+        now = time.time() if now is None else now
+        for slot in self._slots(now):
+            delay = self._delay(slot, await self._atake(slot), now)
+            if delay is None:
+                continue
+            if delay > self.max_wait:
+                break
+            return max(delay, 0.0)
+
+        raise AdmissionRejected(self.name)
+
+    def _slots(self, now):
+        return range(int(now // self.window), int((now + self.max_wait) // self.window) + 1)
+
+    def _delay(self, slot, count, now):
+        """Espera hasta el turno `count` de la ventana `slot`, o None si está llena."""
+        if count > self.quota:
+            return None
+        # Los turnos se reparten uniformemente dentro de la ventana.
+        return slot * self.window + self.window * (count - 1) / self.quota - now
@@ -0,0 +1,310 @@
+"""
+Cliente asyncio para los WS de LlaveMX (despliegues ASGI).
+
+Implementado sobre asyncio streams, sin dependencias externas:
+- HTTP/1.1 con keep-alive; un pool de conexiones por host y por event loop.
+- Soporta respuestas con Content-Length o Transfer-Encoding: chunked; el
+  body se acota a MAX_BODY_SIZE bytes.
+- Mismos errores que el transporte síncrono (WSHTTPError / URLError), de modo
+  que el backend traduce errores igual en ambos caminos.
+- Mismas reglas que el transporte síncrono: proxy de salida del entorno
+  (túnel CONNECT para HTTPS) y una conexión reutilizada que falla después de
+  enviar solo se reintenta si la llamada es idempotente.
+"""
+
+import asyncio
+import socket
+import ssl
+import weakref
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+from oauth2_llavemx.transport import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+    IDEMPOTENT_METHODS,
+    WSHTTPError,
+    proxy_for,
+)
+
+# Las respuestas de LlaveMX son JSON de unos cuantos KB.
+MAX_BODY_SIZE = 1024 * 1024
+
+_READ_CHUNK = 64 * 1024
+
+_STALE_ERRORS = (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError)
+
+
+class ResponseTooLarge(ValueError):
+    pass
+
+
+class _Response:
+
+    def __init__(self, status, reason, headers, body, will_close):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.will_close = will_close
+
+
+class AsyncLlaveMXClient:
+    """Pool de conexiones keep-alive atado a un event loop."""
+
+    def __init__(
+        self,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_maxsize = pool_maxsize
+        self._pools = {}
+        self._ssl_context = None
+        self._proxies = {}
+
+    def _ssl(self):
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def _proxy(self, scheme, host):
+        try:
+            return self._proxies[(scheme, host)]
+        except KeyError:
+            proxy = self._proxies[(scheme, host)] = proxy_for(scheme, host)
+            return proxy
+
+    async def _connect(self, scheme, host, port, timeout):
+        return await asyncio.wait_for(self._open(scheme, host, port), timeout)
+
+    async def _open(self, scheme, host, port):
+        proxy = self._proxy(scheme, host)
+        if proxy is None:
+            return await asyncio.open_connection(
+                host,
+                port,
+                ssl=self._ssl() if scheme == "https" else None,
+                server_hostname=host if scheme == "https" else None,
+            )
+        if scheme == "http":
+            # Al proxy HTTP se le manda la URL completa (ver request()).
+            return await asyncio.open_connection(proxy[0], proxy[1])
+        sock = await self._tunnel(proxy, host, port)
+        try:
+            return await asyncio.open_connection(sock=sock, ssl=self._ssl(), server_hostname=host)
+        except BaseException:
+            sock.close()
+            raise
+
+    async def _tunnel(self, proxy, host, port):
+        """Abre un túnel CONNECT hacia host:port por el proxy y regresa el socket."""
+        loop = asyncio.get_running_loop()
+        proxy_host, proxy_port, proxy_headers = proxy
+        error = None
+        for family, socktype, proto, _, sockaddr in await loop.getaddrinfo(
+            proxy_host, proxy_port, type=socket.SOCK_STREAM
+        ):
+            sock = socket.socket(family, socktype, proto)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, sockaddr)
+                break
+            except OSError as e:
+                sock.close()
+                error = e
+        else:
+            raise error or OSError(f"Sin direcciones para {proxy_host}")
+
+        try:
+            lines = [f"CONNECT {host}:{port} HTTP/1.0"]
+            lines.extend(f"{name}: {value}" for name, value in proxy_headers.items())
+            await loop.sock_sendall(sock, ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            response = b""
+            while b"\r\n\r\n" not in response:
+                chunk = await loop.sock_recv(sock, 4096)
+                if not chunk or len(response) > _READ_CHUNK:
+                    raise OSError("Respuesta inválida del proxy")
+                response += chunk
+            status_line = response.split(b"\r\n", 1)[0].decode("latin-1")
+            _, status, *message = status_line.split(" ", 2)
+            if status != "200":
+                raise OSError(f"Tunnel connection failed: {status} {''.join(message).strip()}")
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _acquire(self, key, connect_timeout):
+        pool = self._pools.get(key)
+        while pool:
+            reader, writer = pool.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await self._connect(*key, connect_timeout)
+        return reader, writer, False
+
+    def _release(self, key, conn):
+        pool = self._pools.setdefault(key, [])
+        if len(pool) < self.pool_maxsize:
+            pool.append(conn)
+        else:
+            conn[1].close()
+
+    async def close(self):
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for _, writer in pool:
+                writer.close()
+
+    async def request(self, method, url, headers=None, body=None, timeout=None, idempotent=None):
+        """
+        Regresa el body en bytes; WSHTTPError para >= 400, URLError para red.
+        timeout acota los timeouts de conexión y lectura de esta llamada.
+        idempotent (por defecto según el método) decide si una conexión
+        reutilizada que falla después de enviar se reintenta con otra.
+        """
+        connect_timeout, read_timeout = self.connect_timeout, self.read_timeout
+        if timeout is not None:
+            connect_timeout, read_timeout = min(connect_timeout, timeout), min(read_timeout, timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        parts = urlsplit(url)
+        scheme = parts.scheme or "https"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        headers = dict(headers or {})
+        proxy = self._proxy(scheme, parts.hostname)
+        if proxy is not None and scheme == "http":
+            path = url
+            headers.update(proxy[2])
+
+        while True:
+            try:
+                reader, writer, reused = await self._acquire(key, connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                raise URLError(e)
+            try:
+                self._write_request(writer, method, path, parts.hostname, headers, body)
+                await writer.drain()
+                resp = await asyncio.wait_for(self._read_response(reader), read_timeout)
+            except _STALE_ERRORS as e:
+                writer.close()
+                if reused and idempotent:
+                    # Solo se repite lo que es seguro repetir (nunca el canje de code).
+                    continue
+                raise URLError(e)
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                writer.close()
+                raise URLError(e)
+            break
+
+        if resp.will_close:
+            writer.close()
+        else:
+            self._release(key, (reader, writer))
+
+        if resp.status >= 400:
+            raise WSHTTPError(url, resp.status, resp.reason, resp.headers, resp.body)
+        return resp.body
+
+    def _write_request(self, writer, method, path, host, headers, body):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: keep-alive"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        writer.write(head + (body or b""))
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        version, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        will_close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(_checked_size(int(headers["content-length"])))
+        elif status in (204, 304) or 100 <= status < 200:
+            body = b""
+        else:
+            body = await self._read_to_eof(reader)
+            will_close = True
+
+        return _Response(status, reason[0] if reason else "", headers, body, will_close)
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        total = 0
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # Trailers opcionales hasta la línea vacía.
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            total = _checked_size(total + size)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def _read_to_eof(self, reader):
+        chunks = []
+        total = 0
+        while True:
+            chunk = await reader.read(_READ_CHUNK)
+            if not chunk:
+                return b"".join(chunks)
+            total = _checked_size(total + len(chunk))
+            chunks.append(chunk)
+
+
+def _checked_size(size):
+    if size > MAX_BODY_SIZE:
+        raise ResponseTooLarge(f"Respuesta de más de {MAX_BODY_SIZE} bytes")
+    return size
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(
+    connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+    read_timeout=DEFAULT_READ_TIMEOUT,
+    pool_maxsize=DEFAULT_POOL_MAXSIZE,
+    pool=None,
+):
+    """Cliente compartido del event loop actual para esta configuración (y `pool`)."""
+    loop = asyncio.get_running_loop()
+    per_loop = _clients.setdefault(loop, {})
+    key = (connect_timeout, read_timeout, pool_maxsize, pool)
+    client = per_loop.get(key)
+    if client is None:
+        client = per_loop[key] = AsyncLlaveMXClient(connect_timeout, read_timeout, pool_maxsize)
+    return client
+
+
+def running_loop():
+    """Event loop corriendo en este hilo, o None en el camino síncrono."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
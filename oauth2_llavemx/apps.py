@@ -17,12 +17,76 @@ class OAuth2LlaveMXConfig(AppConfig):
         We rely on the fact that TPA's settings are applied early, 
         so we modify the settings.SOCIAL_AUTH_PIPELINE list directly.
         """
+        self._install_audit_queue()
+
         try:
             self._inject_pipeline_step()
+            self._swap_profile_sync_steps()
             self._patch_mfe_context()
+            self._profile_pipeline()
         except Exception:
             logger.exception("[LlaveMX] Error during pipeline injection")
 
+        self._connect_curp_index_signals()
+        self._connect_site_registry()
+        self._start_prewarm()
+
+    def _install_audit_queue(self):
+        """
+        Opt-in (SOCIAL_AUTH_LLAVEMX_AUDIT_QUEUE = True): los logs del paquete
+        salen por un QueueListener (ver audit.py), sin I/O de logging dentro
+        del request. Fija los handlers de ese momento y corta la propagación.
+        """
+        if not getattr(settings, "SOCIAL_AUTH_LLAVEMX_AUDIT_QUEUE", False):
+            return
+        try:
+            from oauth2_llavemx.audit import DEFAULT_QUEUE_SIZE, install_queue_logging
+
+            install_queue_logging(getattr(settings, "SOCIAL_AUTH_LLAVEMX_AUDIT_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+        except Exception:
+            logger.exception("[LlaveMX] Could not install queued logging")
+
+    def _start_prewarm(self):
+        """
+        Pre-calienta el pool hacia los WS de LlaveMX
+        (SOCIAL_AUTH_LLAVEMX_PREWARM_CONNECTIONS > 0) una sola vez por proceso,
+        con el primer request que atiende. Así solo los workers web abren
+        conexiones: los comandos de manage.py y los hijos de Celery nunca
+        reciben request_started. El DNS se refresca en el transporte, sin hilo.
+        """
+        if not getattr(settings, "SOCIAL_AUTH_LLAVEMX_PREWARM_CONNECTIONS", 0):
+            return
+
+        from django.core.signals import request_started
+
+        from oauth2_llavemx.transport import set_prewarm
+
+        set_prewarm(_prewarm_sites)
+        request_started.connect(_prewarm_on_request, dispatch_uid="llavemx-prewarm")
+
+    def _connect_curp_index_signals(self):
+        """Mantiene CurpIndex en sync con custom_reg_form.ExtraInfo."""
+        try:
+            from custom_reg_form.models import ExtraInfo
+        except Exception:
+            logger.warning("[LlaveMX] ExtraInfo no disponible. CurpIndex no se sincroniza.")
+            return
+
+        from django.db.models.signals import post_delete, post_save
+
+        from oauth2_llavemx.signals import drop_curp_index, sync_curp_index
+
+        post_save.connect(sync_curp_index, sender=ExtraInfo, dispatch_uid="llavemx_curp_index_save")
+        post_delete.connect(drop_curp_index, sender=ExtraInfo, dispatch_uid="llavemx_curp_index_delete")
+
+    def _connect_site_registry(self):
+        """El registro de sitios (sites.py) se vacía si cambia un SOCIAL_AUTH_* (override_settings)."""
+        from django.core.signals import setting_changed
+
+        from oauth2_llavemx.sites import clear_on_setting_changed
+
+        setting_changed.connect(clear_on_setting_changed, dispatch_uid="llavemx_site_registry")
+
     def _inject_pipeline_step(self):
         if self._pipeline_patched:
             return
@@ -76,11 +140,57 @@ class OAuth2LlaveMXConfig(AppConfig):
         except Exception as e:
             logger.error(f"[LlaveMX] Failed to patch SOCIAL_AUTH_PIPELINE: {e}")
 
+    def _swap_profile_sync_steps(self):
+        """
+        Opt-in (SOCIAL_AUTH_LLAVEMX_PROFILE_FAST_PATH = True): sustituye
+        load_extra_data / user_details / user_details_force_sync por las
+        versiones de oauth2_llavemx.pipeline y agrega save_profile_fp después
+        del último. Con la huella del perfil sin cambios, un login recurrente
+        solo escribe los tokens; user_details_force_sync tampoco corrige
+        ediciones locales del User hasta que el perfil de LlaveMX cambie.
+        """
+        if not getattr(settings, "SOCIAL_AUTH_LLAVEMX_PROFILE_FAST_PATH", False):
+            return
+
+        from oauth2_llavemx.pipeline import PROFILE_SYNC_STEPS, SAVE_PROFILE_FP_STEP
+
+        pipeline = [PROFILE_SYNC_STEPS.get(step, step) for step in getattr(settings, "SOCIAL_AUTH_PIPELINE", [])]
+        swapped = [index for index, step in enumerate(pipeline) if step in PROFILE_SYNC_STEPS.values()]
+        if swapped and SAVE_PROFILE_FP_STEP not in pipeline:
+            pipeline.insert(swapped[-1] + 1, SAVE_PROFILE_FP_STEP)
+        setattr(settings, "SOCIAL_AUTH_PIPELINE", pipeline)
+        logger.info("[LlaveMX] Profile sync steps replaced with fingerprint-aware versions.")
+
+    def _profile_pipeline(self):
+        """
+        Opt-in (SOCIAL_AUTH_LLAVEMX_PIPELINE_PROFILE): envuelve cada paso del
+        pipeline con un temporizador para logins LlaveMX (ver profiling.py).
+        """
+        if not getattr(settings, "SOCIAL_AUTH_LLAVEMX_PIPELINE_PROFILE", False):
+            return
+
+        from oauth2_llavemx.profiling import (
+            DEFAULT_SLOW_MS,
+            DEFAULT_SLOW_SAMPLE,
+            PipelineProfiler,
+            install_pipeline_profiler,
+        )
+
+        profiler = PipelineProfiler(
+            slow_ms=getattr(settings, "SOCIAL_AUTH_LLAVEMX_PIPELINE_SLOW_MS", DEFAULT_SLOW_MS),
+            sample_rate=getattr(settings, "SOCIAL_AUTH_LLAVEMX_PIPELINE_SLOW_SAMPLE", DEFAULT_SLOW_SAMPLE),
+        )
+        pipeline = list(getattr(settings, "SOCIAL_AUTH_PIPELINE", []))
+        pipeline += [step for step in getattr(settings, "SOCIAL_AUTH_LLAVEMX_PIPELINE", []) if step not in pipeline]
+        wrapped = install_pipeline_profiler(pipeline, profiler)
+        logger.info("[LlaveMX] Pipeline profiling enabled for %s steps.", len(wrapped))
+
     def _patch_mfe_context(self):
         """
         Parche pequeño para que, si el pipeline_user_details viene vacío,
         pero la sesión trae llavemx_details, el MFE reciba esos datos.
         No toca el core, solo envuelve las funciones utilitarias.
+        La sesión solo se consulta si hay una señal barata (ver details.py).
         """
         if self._context_patched:
             return
@@ -88,25 +198,13 @@ class OAuth2LlaveMXConfig(AppConfig):
         try:
             from openedx.core.djangoapps.user_authn.views import utils as auth_utils
 
-            def _with_llavemx_fallback(fn):
-                def wrapper(request, *args, **kwargs):
-                    context = fn(request, *args, **kwargs)
-                    if not context:
-                        return context
-
-                    pud = context.get("pipeline_user_details") or {}
-                    if not pud:
-                        session_obj = getattr(request, "session", {}) or {}
-                        session_details = session_obj.get("llavemx_details") or {}
-                        if session_details:
-                            context["pipeline_user_details"] = session_details
-                            # set currentProvider if missing
-                            context.setdefault("currentProvider", "llavemx")
-                    return context
-                return wrapper
-
-            auth_utils.get_auth_context = _with_llavemx_fallback(auth_utils.get_auth_context)
-            auth_utils.get_mfe_context = _with_llavemx_fallback(auth_utils.get_mfe_context)
+            from oauth2_llavemx.details import FLAG_MIDDLEWARE, with_details_fallback
+
+            # Sin el middleware no hay cookie que consultar: se revisa siempre la sesión.
+            gated = FLAG_MIDDLEWARE in getattr(settings, "MIDDLEWARE", [])
+
+            auth_utils.get_auth_context = with_details_fallback(auth_utils.get_auth_context, gated)
+            auth_utils.get_mfe_context = with_details_fallback(auth_utils.get_mfe_context, gated)
 
             logger.info("[LlaveMX] Patched MFE/auth context to include llavemx_details fallback.")
 
@@ -125,3 +223,21 @@ class OAuth2LlaveMXConfig(AppConfig):
             self._context_patched = True
         except Exception as e:
             logger.exception(f"[LlaveMX] Failed to patch serializer for pipeline_user_details: {e}")
+
+
+def _prewarm_sites():
+    from social_django.utils import load_strategy
+
+    from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+    from oauth2_llavemx.sites import get_site_registry
+
+    backend = LlaveMXOAuth2(strategy=load_strategy())
+    for site in get_site_registry().names():
+        warm = backend.for_site(site).prewarm()
+        logger.debug("[LlaveMX] Conexiones pre-calentadas (%s): %s", site or "default", warm)
+
+
+def _prewarm_on_request(sender, **kwargs):
+    from oauth2_llavemx.transport import prewarm_once
+
+    prewarm_once()
@@ -0,0 +1,196 @@
+"""
+Eventos de auditoría del backend y del pipeline.
+
+- Eventos tipados (AuditEvent: nombre + nivel) en lugar de mensajes libres.
+- CURP y correo se enmascaran antes de que el registro salga de la función;
+  nunca se escriben en claro.
+- El mensaje se formatea de forma perezosa: si el nivel no está habilitado
+  no se construye nada, y si lo está, el texto se arma en el hilo del
+  QueueListener, no en el request.
+- Los eventos DEBUG se muestrean con SOCIAL_AUTH_LLAVEMX_AUDIT_DEBUG_SAMPLE
+  (fracción, default 0.1).
+
+install_queue_logging() (opt-in: lo llama la AppConfig con
+SOCIAL_AUTH_LLAVEMX_AUDIT_QUEUE = True) cuelga un QueueHandler del logger
+"oauth2_llavemx" y mueve sus handlers efectivos a un QueueListener: los logs
+de todo el paquete dejan de hacer I/O dentro del request. Si la cola
+(SOCIAL_AUTH_LLAVEMX_AUDIT_QUEUE_SIZE) se llena, los registros se descartan
+en lugar de bloquear. Como los handlers se fijan al instalar y el logger deja
+de propagar, los handlers que se agreguen después (LOGGING reconfigurado,
+caplog) no ven los logs del paquete; por eso no está activo por omisión.
+
+Los campos del evento van además en record.llavemx_event y record.llavemx
+para handlers estructurados (JSON).
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from collections import namedtuple
+
+from django.conf import settings
+
+logger = logging.getLogger("oauth2_llavemx.audit")
+
+DEFAULT_DEBUG_SAMPLE = 0.1
+DEFAULT_QUEUE_SIZE = 10000
+PACKAGE_LOGGER = "oauth2_llavemx"
+
+AuditEvent = namedtuple("AuditEvent", ["name", "level"])
+
+# Pipeline: associate_by_curp
+CURP_LOOKUP = AuditEvent("curp_lookup", logging.DEBUG)
+CURP_GENERIC = AuditEvent("curp_generic", logging.WARNING)
+CURP_AMBIGUOUS = AuditEvent("curp_ambiguous", logging.ERROR)
+CURP_ASSOCIATED = AuditEvent("curp_associated", logging.INFO)
+CURP_ASSOCIATED_INACTIVE = AuditEvent("curp_associated_inactive", logging.WARNING)
+CURP_INCONCLUSIVE = AuditEvent("curp_inconclusive", logging.WARNING)
+
+# Backend
+LOGOUT_RESPONSE = AuditEvent("logout_response", logging.DEBUG)
+
+
+def mask_curp(value):
+    """GODE561231HDFRRN09 -> GODE************09"""
+    value = str(value or "")
+    if len(value) <= 6:
+        return "*" * len(value)
+    return f"{value[:4]}{'*' * (len(value) - 6)}{value[-2:]}"
+
+
+def mask_email(value):
+    """juan.perez@correo.mx -> j***@correo.mx"""
+    value = str(value or "")
+    local, at, domain = value.partition("@")
+    if not at:
+        return mask_curp(value)
+    return f"{local[:1]}***@{domain}"
+
+
+MASKERS = {"curp": mask_curp, "email": mask_email, "correo": mask_email}
+
+
+class _EventMessage:
+    """Se convierte en texto solo cuando un handler formatea el registro."""
+
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self):
+        pairs = " ".join(f"{key}={value}" for key, value in self.fields.items() if value is not None)
+        return f"[LlaveMX] {self.name} {pairs}" if pairs else f"[LlaveMX] {self.name}"
+
+
+def audit(event, **fields):
+    """Emite un evento de auditoría; los campos sensibles se enmascaran."""
+    if not logger.isEnabledFor(event.level):
+        return
+    if event.level <= logging.DEBUG:
+        sample = getattr(settings, "SOCIAL_AUTH_LLAVEMX_AUDIT_DEBUG_SAMPLE", DEFAULT_DEBUG_SAMPLE)
+        if random.random() >= sample:
+            return
+
+    for key, mask in MASKERS.items():
+        if fields.get(key):
+            fields[key] = mask(fields[key])
+
+    logger.log(
+        event.level,
+        _EventMessage(event.name, fields),
+        extra={"llavemx_event": event.name, "llavemx": fields},
+    )
+
+
+# -------------------------------------------------------------
+# Cola no bloqueante
+# -------------------------------------------------------------
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que registra (la cola vive en el
+    mismo proceso) y que descarta en lugar de bloquear si la cola se llena.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_installed = {"handler": None, "listener": None, "handlers": None, "size": None}
+
+
+def _effective_handlers(target):
+    """Handlers que atenderían un registro del logger (propagación incluida)."""
+    handlers = []
+    current = target
+    while current is not None:
+        handlers.extend(h for h in current.handlers if h not in handlers)
+        if not current.propagate:
+            break
+        current = current.parent
+    return handlers
+
+
+def _start(handlers, size):
+    records = queue.Queue(size)
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    handler = NonBlockingQueueHandler(records)
+    listener.start()
+    return handler, listener
+
+
+def install_queue_logging(size=DEFAULT_QUEUE_SIZE):
+    """
+    Desvía los logs del paquete a un QueueListener. Los handlers efectivos
+    se fijan al instalar; se puede llamar una sola vez por proceso.
+    """
+    if _installed["handler"] is not None:
+        return _installed["handler"]
+
+    target = logging.getLogger(PACKAGE_LOGGER)
+    handlers = _effective_handlers(target)
+    if not handlers:
+        return None
+
+    handler, listener = _start(handlers, size)
+    for existing in list(target.handlers):
+        target.removeHandler(existing)
+    target.addHandler(handler)
+    target.propagate = False
+
+    _installed.update(handler=handler, listener=listener, handlers=handlers, size=size)
+    atexit.register(_stop)
+    return handler
+
+
+def _stop():
+    listener = _installed["listener"]
+    if listener is not None:
+        listener.stop()
+
+
+def _after_fork_in_child():
+    # El hilo del listener no sobrevive al fork (gunicorn --preload).
+    if _installed["handler"] is None:
+        return
+    target = logging.getLogger(PACKAGE_LOGGER)
+    target.removeHandler(_installed["handler"])
+    handler, listener = _start(_installed["handlers"], _installed["size"])
+    target.addHandler(handler)
+    _installed.update(handler=handler, listener=listener)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,132 @@
+"""
+Circuit breaker para los WS de LlaveMX con estado compartido en el cache de
+Django, de modo que todos los workers ven el mismo estado.
+
+Estados:
+- cerrado:    se permiten llamadas; las fallas se cuentan en una ventana.
+- abierto:    al llegar al umbral de fallas se rechazan llamadas sin tocar
+              la red durante reset_timeout segundos.
+- semiabierto: vencido reset_timeout, un solo worker hace una llamada de
+              prueba; si funciona se cierra, si falla se vuelve a abrir.
+
+Los métodos a* son las versiones coroutine para el camino asyncio: usan la
+API async del cache (aget/aadd/aincr) en lugar de bloquear el event loop.
+"""
+
+import time
+
+from oauth2_llavemx.cache import make_key
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_FAILURE_WINDOW = 30
+DEFAULT_RESET_TIMEOUT = 30
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """El breaker del endpoint está abierto; no se intentó la llamada."""
+
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f"LlaveMX {name} no disponible temporalmente (circuit breaker abierto).")
+
+
+class CircuitBreaker:
+
+    def __init__(
+        self,
+        cache,
+        name,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        failure_window=DEFAULT_FAILURE_WINDOW,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+    ):
+        self.cache = cache
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.reset_timeout = reset_timeout
+        self._failures_key = make_key("cb", name, "failures")
+        self._open_key = make_key("cb", name, "open_until")
+        self._probe_key = make_key("cb", name, "probe")
+
+    def allow(self):
+        """
+        Regresa el estado con el que se autoriza la llamada (CLOSED o HALF_OPEN).
+        Lanza CircuitOpenError si la llamada no debe hacerse.
+        """
+        open_until = self.cache.get(self._open_key)
+        if open_until is None:
+            return CLOSED
+        if time.time() < open_until:
+            raise CircuitOpenError(self.name)
+        # Semiabierto: solo un worker obtiene el permiso de prueba.
+        if self.cache.add(self._probe_key, 1, self.reset_timeout):
+            return HALF_OPEN
+        raise CircuitOpenError(self.name)
+
+    async def aallow(self):
+        """Versión coroutine de allow()."""
+        open_until = await self.cache.aget(self._open_key)
+        if open_until is None:
+            return CLOSED
+        if time.time() < open_until:
+            raise CircuitOpenError(self.name)
+        if await self.cache.aadd(self._probe_key, 1, self.reset_timeout):
+            return HALF_OPEN
+        raise CircuitOpenError(self.name)
+
+    def record_success(self, state):
+        if state == HALF_OPEN:
+            self.cache.delete_many([self._open_key, self._probe_key, self._failures_key])
+
+    async def arecord_success(self, state):
+        if state == HALF_OPEN:
+            await self.cache.adelete_many([self._open_key, self._probe_key, self._failures_key])
+
+    def release(self, state):
+        """La llamada no dice nada de LlaveMX (p. ej. la cortó el presupuesto del login)."""
+        if state == HALF_OPEN:
+            self.cache.delete(self._probe_key)
+
+    async def arelease(self, state):
+        if state == HALF_OPEN:
+            await self.cache.adelete(self._probe_key)
+
+    def record_failure(self, state):
+        if state == HALF_OPEN:
+            self._open()
+            return
+        self.cache.add(self._failures_key, 0, self.failure_window)
+        try:
+            failures = self.cache.incr(self._failures_key)
+        except ValueError:
+            # La llave expiró entre add() e incr().
+            self.cache.set(self._failures_key, 1, self.failure_window)
+            failures = 1
+        if failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        # El estado abierto vive más que reset_timeout para poder pasar a semiabierto.
+        self.cache.set(self._open_key, time.time() + self.reset_timeout, self.reset_timeout * 10)
+        self.cache.delete_many([self._probe_key, self._failures_key])
+
+    async def arecord_failure(self, state):
+        if state == HALF_OPEN:
+            await self._aopen()
+            return
+        await self.cache.aadd(self._failures_key, 0, self.failure_window)
+        try:
+            failures = await self.cache.aincr(self._failures_key)
+        except ValueError:
+            await self.cache.aset(self._failures_key, 1, self.failure_window)
+            failures = 1
+        if failures >= self.failure_threshold:
+            await self._aopen()
+
+    async def _aopen(self):
+        await self.cache.aset(self._open_key, time.time() + self.reset_timeout, self.reset_timeout * 10)
+        await self.cache.adelete_many([self._probe_key, self._failures_key])
@@ -0,0 +1,31 @@
+"""
+Acceso al cache de Django para los datos compartidos entre workers.
+
+El alias se configura con SOCIAL_AUTH_LLAVEMX_CACHE_ALIAS (default "default").
+Las llaves llevan el prefijo "llavemx:" y nunca contienen tokens en claro.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULT_CACHE_ALIAS = "default"
+KEY_PREFIX = "llavemx"
+
+
+def get_cache(backend=None):
+    if backend is not None:
+        alias = backend.setting("CACHE_ALIAS", DEFAULT_CACHE_ALIAS)
+    else:
+        alias = getattr(settings, "SOCIAL_AUTH_LLAVEMX_CACHE_ALIAS", DEFAULT_CACHE_ALIAS)
+    return caches[alias]
+
+
+def make_key(*parts):
+    return ":".join((KEY_PREFIX,) + tuple(str(p) for p in parts))
+
+
+def fingerprint(value):
+    """Hash estable para usar valores sensibles (tokens, codes) como llave."""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
@@ -0,0 +1,47 @@
+"""
+Presupuesto de tiempo por login (SOCIAL_AUTH_LLAVEMX_LOGIN_TIMEOUT).
+
+auth_complete() arranca un Deadline y todas las llamadas salientes del login
+(token, perfil, roles) toman de él solo lo que resta: los timeouts de
+conexión y lectura, la espera de admisión, el backoff de los reintentos y la
+espera del single-flight del code se acotan al presupuesto restante. Al
+agotarse, el login falla con DeadlineExceeded (traducido a AuthUnknownError)
+en lugar de acumular un timeout completo por llamada.
+"""
+
+import time
+
+DEFAULT_LOGIN_TIMEOUT = 30
+# Un timeout de socket puede vencer unos milisegundos antes que el reloj.
+_SLACK = 0.05
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el presupuesto de tiempo del login."""
+
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f"LlaveMX {name}: se agotó el tiempo del login.")
+
+
+class Deadline:
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= _SLACK
+
+    def cap(self, seconds, name):
+        """
+        min(seconds, restante); seconds=None regresa el restante. Lanza
+        DeadlineExceeded si ya no queda presupuesto.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(name)
+        return remaining if seconds is None else min(seconds, remaining)
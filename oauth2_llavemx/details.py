@@ -0,0 +1,128 @@
+"""
+Almacenamiento de llavemx_details para el fallback del MFE.
+
+SOCIAL_AUTH_LLAVEMX_DETAILS_STORAGE:
+- "session" (default) guarda los details completos en la sesión
+            (llavemx_details), como siempre.
+- "cache"   los guarda una sola vez en el cache bajo una llave opaca con TTL
+            (SOCIAL_AUTH_LLAVEMX_DETAILS_TTL); la sesión solo conserva esa
+            llave (llavemx_details_ref). En el cache va la versión compacta
+            (sin campos vacíos o default, ver fields.py) y se rehidrata bajo
+            demanda.
+
+Fallback del MFE (with_details_fallback): antes de tocar la sesión se revisa
+una señal barata (sesión ya cargada, cookie DETAILS_COOKIE puesta por
+LlaveMXDetailsFlagMiddleware o currentProvider en el contexto), de modo que
+el tráfico anónimo sin LlaveMX no paga la carga de la sesión.
+"""
+
+import secrets
+
+from oauth2_llavemx.cache import get_cache, make_key
+from oauth2_llavemx.fields import get_field_schema
+
+SESSION_KEY = "llavemx_details"
+SESSION_REF_KEY = "llavemx_details_ref"
+DEFAULT_DETAILS_TTL = 3600
+
+DETAILS_COOKIE = "llavemx_details"
+FLAG_MIDDLEWARE = "oauth2_llavemx.middleware.LlaveMXDetailsFlagMiddleware"
+# Marca en el request para que el middleware ponga o borre la cookie.
+REQUEST_FLAG = "_llavemx_details_flag"
+
+
+def compact_details(details, schema=None):
+    """Elimina los campos que valen su default (o vacío) para almacenar menos."""
+    return (schema or get_field_schema()).compact(details)
+
+
+def expand_details(compact, schema=None):
+    """Inverso de compact_details: restaura los defaults omitidos."""
+    return (schema or get_field_schema()).expand(compact)
+
+
+def _details_key(ref):
+    return make_key("details", ref)
+
+
+def store_details(backend, details):
+    """Persiste los details para el fallback del MFE según el modo configurado."""
+    strategy = backend.strategy
+    schema = get_field_schema(backend)
+
+    request = getattr(strategy, "request", None)
+    if request is not None:
+        setattr(request, REQUEST_FLAG, True)
+
+    if backend.setting("DETAILS_STORAGE", "session") != "cache":
+        strategy.session_set(SESSION_KEY, schema.visible(details))
+        return
+
+    # Reutilizamos la llave si el pipeline vuelve a pasar por aquí.
+    ref = strategy.session_get(SESSION_REF_KEY) or secrets.token_urlsafe(16)
+    ttl = backend.setting("DETAILS_TTL", DEFAULT_DETAILS_TTL)
+    get_cache(backend).set(_details_key(ref), compact_details(details, schema), ttl)
+    strategy.session_set(SESSION_REF_KEY, ref)
+
+
+def load_details(session):
+    """Regresa los details guardados (sesión o cache) o {} si no hay."""
+    details = session.get(SESSION_KEY)
+    if details:
+        return details
+
+    ref = session.get(SESSION_REF_KEY)
+    if not ref:
+        return {}
+
+    compact = get_cache().get(_details_key(ref))
+    if compact is None:
+        return {}
+    return expand_details(compact)
+
+
+def may_have_details(request, context):
+    """
+    Señal barata de que puede haber llavemx_details para este request,
+    sin forzar la carga de la sesión.
+    """
+    session = getattr(request, "session", None)
+    if not session:
+        return False
+    # Si la sesión ya se cargó, consultarla es gratis.
+    if getattr(session, "accessed", False):
+        return True
+    return DETAILS_COOKIE in request.COOKIES or bool(context.get("currentProvider"))
+
+
+def with_details_fallback(fn, gated=True):
+    """
+    Envuelve get_auth_context / get_mfe_context: si pipeline_user_details
+    viene vacío pero hay llavemx_details guardados, el MFE recibe esos datos.
+
+    Con gated=False (sin LlaveMXDetailsFlagMiddleware) siempre se consulta
+    la sesión, porque la cookie nunca se pondría.
+    """
+    def wrapper(request, *args, **kwargs):
+        context = fn(request, *args, **kwargs)
+        if not context:
+            return context
+
+        pud = context.get("pipeline_user_details") or {}
+        if pud:
+            return context
+        if gated and not may_have_details(request, context):
+            return context
+
+        session_obj = getattr(request, "session", {}) or {}
+        # Rehidrata desde la sesión o el cache solo cuando hace falta.
+        session_details = load_details(session_obj)
+        if session_details:
+            context["pipeline_user_details"] = session_details
+            # set currentProvider if missing
+            context.setdefault("currentProvider", "llavemx")
+        elif gated and DETAILS_COOKIE in request.COOKIES:
+            # Los details ya expiraron: que el middleware quite la cookie.
+            setattr(request, REQUEST_FLAG, False)
+        return context
+    return wrapper
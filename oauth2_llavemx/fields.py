@@ -0,0 +1,295 @@
+"""
+Tabla única de campos LlaveMX -> details.
+
+Cada FieldSpec declara de dónde sale el campo en la respuesta de
+/datosUsuario, cómo se normaliza, su valor por omisión y a dónde se propaga:
+
+- mfe:        se expone al MFE (llavemx_details en sesión/cache).
+- extra_data: se guarda en UserSocialAuth.extra_data. Igual que EXTRA_DATA
+              de social_core, el valor sale primero de la respuesta cruda y
+              solo si no viene ahí, de details.
+- optional:   el campo solo aparece en details si la respuesta lo trae.
+
+De la tabla compilada salen get_user_details() (mismo resultado que el mapeo
+escrito a mano que reemplaza), las entradas de extra_data, el payload del MFE
+y la huella del perfil (fingerprint) con la que el pipeline detecta logins
+sin cambios. extra_data y el payload del cache omiten los campos que valen su
+default (merge_extra_data() los quita de lo ya guardado).
+
+Ajustes por despliegue:
+- SOCIAL_AUTH_LLAVEMX_EXTRA_FIELDS: lista de dicts
+  {"name", "source", "normalize", "default", "mfe", "extra_data"}; source
+  admite rutas con punto ("domicilio.codigoPostal") y normalize "text",
+  "flag", "blank" o la ruta punteada de un callable. Sin normalize el valor
+  se copia tal cual.
+- SOCIAL_AUTH_LLAVEMX_EXCLUDE_FIELDS: nombres de campos a omitir.
+"""
+
+import json
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from oauth2_llavemx.cache import fingerprint
+
+FieldSpec = namedtuple(
+    "FieldSpec",
+    ["name", "source", "normalize", "default", "mfe", "extra_data", "optional"],
+    defaults=(None, "", True, False, False),
+)
+
+
+def text(value):
+    """(value or "").strip()"""
+    if isinstance(value, str):
+        return value.strip()
+    return value or ""
+
+
+def blank(value):
+    """value or "" (sin strip)."""
+    return value or ""
+
+
+def flag(value):
+    return bool(value)
+
+
+NORMALIZERS = {"text": text, "blank": blank, "flag": flag}
+
+
+# -------------------------------------------------------------
+# Campos derivados: reciben también los details ya calculados para
+# reutilizar los valores normalizados (la tabla los declara antes).
+# -------------------------------------------------------------
+def _part(response, details, name, source):
+    value = details.get(name)
+    return text(response.get(source)) if value is None else value
+
+
+def _username(response, details):
+    return _part(response, details, "curp", "curp") or text(response.get("login"))
+
+
+def _email(response, details):
+    email = text(response.get("correo"))
+    if not email:
+        login = text(response.get("login"))
+        if login:
+            email = f"{login}@llavemx.temp"
+    return email
+
+
+def _last_name(response, details):
+    return " ".join(filter(None, [
+        _part(response, details, "primer_apellido", "primerApellido"),
+        _part(response, details, "segundo_apellido", "segundoApellido"),
+    ]))
+
+
+def _full_name(response, details):
+    nombres = _part(response, details, "nombres", "nombre")
+    last_name = details.get("last_name")
+    if last_name is None:
+        last_name = _last_name(response, details)
+    return f"{nombres} {last_name}" if nombres and last_name else nombres or last_name
+
+
+def _first_name(response, details):
+    return _part(response, details, "nombres", "nombre")
+
+
+def _telefono(response, details):
+    return response.get("telVigente") or response.get("telefono") or ""
+
+
+# source: llave de la respuesta (admite "a.b" para anidados), callable
+# (response, details) para derivados, o None si el campo siempre vale su
+# default (lo llena el formulario de registro). Si la llave no viene se usa
+# el default. Los normalizadores reproducen el mapeo original campo por
+# campo: text para los que se recortaban, blank para los que solo cambiaban
+# None por "", y ninguno para id y municipio (None se conserva).
+DEFAULT_FIELDS = (
+    FieldSpec("id", "idUsuario", extra_data=True),
+    FieldSpec("nombres", "nombre", text),
+    FieldSpec("primer_apellido", "primerApellido", text),
+    FieldSpec("segundo_apellido", "segundoApellido", text),
+    FieldSpec("curp", "curp", text, extra_data=True),
+    FieldSpec("username", _username),
+    FieldSpec("email", _email),
+    FieldSpec("first_name", _first_name),
+    FieldSpec("last_name", _last_name),
+    FieldSpec("name", _full_name),
+    FieldSpec("telefono", _telefono, extra_data=True),
+    FieldSpec("fechaNacimiento", "fechaNacimiento", blank, extra_data=True),
+    FieldSpec("sexo", "sexo", blank, extra_data=True),
+    FieldSpec("correoVerificado", "correoVerificado", flag, False, extra_data=True),
+    FieldSpec("telefonoVerificado", "telefonoVerificado", flag, False, extra_data=True),
+    FieldSpec("estado", "estadoNacimiento", blank),
+    FieldSpec("municipio", "domicilio.alcaldiaMunicipio"),
+    # Solo cuando FETCH_ROLES los agregó a la respuesta.
+    FieldSpec("roles", "roles", default=[], extra_data=True, optional=True),
+    FieldSpec("pais", None),
+    FieldSpec("dni", None),
+    FieldSpec("ocupacion", None),
+    FieldSpec("maximo_nivel", None),
+    FieldSpec("eres_docente", None, default=False),
+    FieldSpec("cct", None),
+    FieldSpec("funcion", None),
+    FieldSpec("nivel_Educativo", None),
+    FieldSpec("asignatura", None),
+    FieldSpec("cuentanos", None),
+)
+
+
+def _nested_getter(source, default):
+    path = source.split(".")
+
+    def nested(response, details):
+        value = response
+        for part in path:
+            if not isinstance(value, dict):
+                return default
+            value = value.get(part, default)
+        return value
+
+    return nested
+
+
+def _dynamic_entry(spec):
+    """
+    (name, llave simple, derivador, normalizador, default, optional) de un
+    campo con source. Los opcionales se leen con default None para saber si
+    vinieron en la respuesta.
+    """
+    default = None if spec.optional else spec.default
+    if callable(spec.source):
+        return spec.name, None, spec.source, spec.normalize, default, spec.optional
+    if "." in spec.source:
+        return spec.name, None, _nested_getter(spec.source, default), spec.normalize, default, spec.optional
+    return spec.name, spec.source, None, spec.normalize, default, spec.optional
+
+
+def _is_default(value, default):
+    return value is None or value == "" or value == default
+
+
+class FieldSchema:
+    """Versión compilada de una lista de FieldSpec."""
+
+    def __init__(self, specs):
+        self.specs = tuple(specs)
+        self.defaults = {spec.name: spec.default for spec in self.specs}
+        # Los campos fijos se copian de un golpe; solo los dinámicos se evalúan.
+        self._static = {spec.name: spec.default for spec in self.specs if spec.source is None}
+        self._dynamic = tuple(_dynamic_entry(spec) for spec in self.specs if spec.source is not None)
+        self._mfe_defaults = {spec.name: spec.default for spec in self.specs if spec.mfe and not spec.optional}
+        self._hidden = frozenset(spec.name for spec in self.specs if not spec.mfe)
+        self._extra = tuple((spec.name, spec.default) for spec in self.specs if spec.extra_data)
+        self.extra_names = frozenset(name for name, _ in self._extra)
+
+    def user_details(self, response):
+        get = response.get
+        details = self._static.copy()
+        for name, key, derive, normalize, default, optional in self._dynamic:
+            value = get(key, default) if derive is None else derive(response, details)
+            if value is None and optional:
+                continue
+            details[name] = value if normalize is None else normalize(value)
+        return details
+
+    def extra_data(self, response, details):
+        """
+        Todos los campos de extra_data, con el criterio de EXTRA_DATA de
+        social_core (respuesta cruda y luego details). También los que faltan
+        (None): un update() sobre lo guardado (social_core set_extra_data)
+        debe poder limpiar un valor que dejó de venir.
+        """
+        return {name: response.get(name, details.get(name)) for name, _ in self._extra}
+
+    def merge_extra_data(self, current, data):
+        """
+        extra_data guardado + data, sin los campos del perfil que quedaron en
+        su default (se quitan del dict en lugar de guardarse vacíos).
+        """
+        merged = dict(current)
+        merged.update(data)
+        for name, default in self._extra:
+            if name in merged and _is_default(merged[name], default):
+                del merged[name]
+        return merged
+
+    def fingerprint(self, details):
+        """
+        Huella del perfil normalizado (todos los campos con valor distinto a
+        su default): si no cambia, los datos del usuario tampoco.
+        """
+        profile = {
+            key: value
+            for key, value in details.items()
+            if not _is_default(value, self.defaults.get(key))
+        }
+        return fingerprint(json.dumps(profile, sort_keys=True, default=str))[:32]
+
+    def visible(self, details):
+        """details sin los campos que no se exponen al MFE."""
+        if not self._hidden:
+            return details
+        return {key: value for key, value in details.items() if key not in self._hidden}
+
+    def compact(self, details):
+        """Payload del MFE sin los campos que valen su default."""
+        return {
+            key: value
+            for key, value in details.items()
+            if key not in self._hidden and not _is_default(value, self.defaults.get(key))
+        }
+
+    def expand(self, compact):
+        """Inverso de compact(): restaura los defaults de los campos del MFE."""
+        details = dict(self._mfe_defaults)
+        details.update(compact)
+        return details
+
+
+def _spec_from_setting(entry):
+    entry = dict(entry)
+    normalize = entry.get("normalize")
+    if isinstance(normalize, str):
+        entry["normalize"] = NORMALIZERS.get(normalize) or import_string(normalize)
+    return FieldSpec(**entry)
+
+
+def build_schema(extra_fields=(), exclude_fields=()):
+    excluded = set(exclude_fields or ())
+    specs = [spec for spec in DEFAULT_FIELDS if spec.name not in excluded]
+    for entry in extra_fields or ():
+        spec = _spec_from_setting(entry)
+        specs = [s for s in specs if s.name != spec.name]
+        specs.append(spec)
+    return FieldSchema(specs)
+
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+def get_field_schema(backend=None):
+    """Esquema compilado para los ajustes actuales (se compila una vez)."""
+    if backend is not None:
+        extra = backend.setting("EXTRA_FIELDS", ())
+        exclude = backend.setting("EXCLUDE_FIELDS", ())
+    else:
+        extra = getattr(settings, "SOCIAL_AUTH_LLAVEMX_EXTRA_FIELDS", ())
+        exclude = getattr(settings, "SOCIAL_AUTH_LLAVEMX_EXCLUDE_FIELDS", ())
+
+    key = repr((extra, exclude))
+    schema = _schemas.get(key)
+    if schema is None:
+        with _schemas_lock:
+            schema = _schemas.get(key)
+            if schema is None:
+                schema = _schemas[key] = build_schema(extra, exclude)
+    return schema
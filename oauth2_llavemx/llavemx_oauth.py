@@ -12,12 +12,17 @@ NOTAS DE SEGURIDAD IMPLEMENTADAS:
 
 1) Parámetro "state" contra CSRF (Manual LlaveMX, sección 3.2)
    - Valor criptográficamente seguro y único por solicitud
-   - Se guarda en sesión
-   - Se valida al recibir el callback
+   - Se guarda en sesión, o con SOCIAL_AUTH_LLAVEMX_STATE_MODE = "signed" se
+     firma con HMAC atado a la cookie CSRF del navegador (state.py), sin
+     escribir la sesión; el nonce es de un solo uso
+   - Se valida al recibir el callback (comparación en tiempo constante)
 
 2) Intercambio de "code" por "token" SOLO desde backend (3.5)
    - Se hace desde el servidor usando BasicAuth y client_secret
    - Se maneja el escenario de "code" inválido/expirado
+   - Single-flight por hash de code + state (singleflight.py): un callback
+     duplicado del mismo navegador reutiliza el resultado del primer canje
+     durante CODE_RESULT_TTL segundos (SOCIAL_AUTH_LLAVEMX_CODE_SINGLE_FLIGHT)
 
 3) Manejo seguro de token de acceso (4.1)
    - No se expone al frontend
@@ -27,22 +32,134 @@ NOTAS DE SEGURIDAD IMPLEMENTADAS:
    - Se implementa revoke_token() que llama al WS /cerrarSesion
    - Se usa BasicAuth + accessToken en header
    - Se envía body "{}" para evitar HTTP 411 en productivo
+
+5) Transporte HTTP (transport.py)
+   - Conexiones keep-alive reutilizadas por host, compartidas entre hilos
+   - Timeouts de conexión y lectura configurables:
+     SOCIAL_AUTH_LLAVEMX_CONNECT_TIMEOUT, SOCIAL_AUTH_LLAVEMX_READ_TIMEOUT,
+     SOCIAL_AUTH_LLAVEMX_POOL_MAXSIZE
+   - DNS en cache (SOCIAL_AUTH_LLAVEMX_DNS_TTL) y reanudación de sesión TLS;
+     pre-calentamiento opcional con el primer request del worker
+     (SOCIAL_AUTH_LLAVEMX_PREWARM_CONNECTIONS)
+
+6) Logout no bloqueante (revocation.py)
+   - SOCIAL_AUTH_LLAVEMX_REVOKE_MODE = "sync" | "background" | "task"
+
+7) Roles (opt-in, SOCIAL_AUTH_LLAVEMX_FETCH_ROLES)
+   - Cache por idUsuario (SOCIAL_AUTH_LLAVEMX_ROLES_CACHE_TTL), revisado con
+     el idUsuario del perfil: un usuario recurrente no llama al WS de roles
+   - Con el cache vacío, /getRolesUsuarioLogueado se llama después de
+     /datosUsuario (la respuesta del token no trae idUsuario)
+
+8) Cache corto de /datosUsuario (SOCIAL_AUTH_LLAVEMX_PROFILE_CACHE_TTL)
+   - Llave = hash SHA-256 del accessToken (nunca el token en claro)
+   - TTL acotado por expires_in; revoke_token() invalida la entrada
+
+9) Circuit breaker y reintentos (breaker.py)
+   - Estado compartido vía cache de Django entre todos los workers
+   - Reintentos acotados con jitter solo para llamadas idempotentes (GET)
+
+10) Métricas por endpoint (metrics.py, SOCIAL_AUTH_LLAVEMX_METRICS)
+   - Latencia, status HTTP, códigos de error LlaveMX y llamadas en vuelo
+
+11) Camino asyncio para ASGI (aio.py)
+   - aauth_complete(), arequest_access_token(), auser_data(), arevoke_token()
+   - Mismo breaker, reintentos, métricas y traducción de errores que el
+     camino síncrono; el pool de conexiones es por event loop y el cache
+     compartido se usa con su API async
+   - API de librería: la vista complete de social_django es síncrona, hace
+     falta una vista async propia que llame aauth_complete()
+
+12) Refresco de tokens (tokens.py)
+   - expires_in se guarda en extra_data; refresh_token() usa
+     grantType=refresh_token con single-flight por cuenta
+   - revoke_token() refresca un token vencido antes de /cerrarSesion
+
+13) Control de admisión (admission.py, SOCIAL_AUTH_LLAVEMX_ADMISSION_RATES)
+   - Tasa por endpoint compartida en el clúster; espera acotada por turno
+   - Solo si la cola se desborda se rechaza con un mensaje de reintento
+
+14) Presupuesto de tiempo por login (deadline.py, SOCIAL_AUTH_LLAVEMX_LOGIN_TIMEOUT)
+   - Arranca en auth_complete(); timeouts, esperas y reintentos de cada
+     llamada se acotan a lo que resta
+
+15) Multi-sitio (sites.py, SOCIAL_AUTH_LLAVEMX_SITES)
+   - KEY/SECRET, credenciales WS, ambiente (producción o validación) y
+     cualquier setting por host; pool propio. Los settings sin override se
+     consultan a la strategy en cada llamada (KEY/SECRET del admin)
 """
 
+import asyncio
+import copy
 import json
-import base64
 import logging
+import random
 import secrets
-from urllib.request import Request, urlopen
+import time
+from contextlib import contextmanager
 from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
 
+from asgiref.sync import sync_to_async
 from social_core.backends.oauth import BaseOAuth2
 from social_core.exceptions import AuthFailed, AuthUnknownError
-from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+from oauth2_llavemx.admission import (
+    DEFAULT_MAX_WAIT as DEFAULT_ADMISSION_MAX_WAIT,
+    DEFAULT_WINDOW as DEFAULT_ADMISSION_WINDOW,
+    AdmissionController,
+    AdmissionRejected,
+)
+from oauth2_llavemx.aio import get_async_client, running_loop
+from oauth2_llavemx.audit import LOGOUT_RESPONSE, audit
+from oauth2_llavemx.breaker import (
+    DEFAULT_FAILURE_THRESHOLD,
+    DEFAULT_FAILURE_WINDOW,
+    DEFAULT_RESET_TIMEOUT,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from oauth2_llavemx.cache import fingerprint, get_cache, make_key
+from oauth2_llavemx.deadline import DEFAULT_LOGIN_TIMEOUT, Deadline, DeadlineExceeded
+from oauth2_llavemx.fields import get_field_schema
+from oauth2_llavemx.metrics import error_label, get_metrics_sink
+from oauth2_llavemx.revocation import dispatch_revocation
+from oauth2_llavemx.sites import MISSING, SITE_FIELD, get_site_registry
+from oauth2_llavemx.singleflight import DEFAULT_LOCK_TTL, DEFAULT_RESULT_TTL, FlightTimeout, SingleFlight
+from oauth2_llavemx.state import check_state, is_signed, make_state
+from oauth2_llavemx.tokens import refresh_social
+from oauth2_llavemx.transport import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_DNS_TTL,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+    get_transport,
+)
 
 logger = logging.getLogger(__name__)
-VERBOSE = True
+
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.2
+DEFAULT_PROFILE_CACHE_TTL = 60
+DEFAULT_ROLES_CACHE_TTL = 300
+
+# Referencias fuertes a los logout agendados en el event loop (ver revoke_token).
+_pending_revocations = set()
+
+
+def _describe_auth_error(error):
+    """
+    Error del canje que se comparte con los callbacks duplicados: solo el
+    rechazo definitivo de LlaveMX. Red, 5xx, breaker, admisión o presupuesto
+    (AuthUnknownError) no se publican: el code pudo no haberse consumido y
+    una recarga debe poder reintentar.
+    """
+    if not isinstance(error, AuthFailed):
+        return None
+    if isinstance(error.__cause__, HTTPError) and error.__cause__.code >= 500:
+        return None
+    return ("failed", error.args[0] if error.args else "")
 
 
 class LlaveMXOAuth2(BaseOAuth2):
@@ -61,21 +178,57 @@ class LlaveMXOAuth2(BaseOAuth2):
     LOGOUT_URL        = "https://www.api.llave.gob.mx/ws/rest/oauth/cerrarSesion"
 
     # NOTA DE SEGURIDAD:
-    # Guardamos también el access_token para poder consumir /cerrarSesion
+    # Guardamos también el access_token para poder consumir /cerrarSesion.
+    # Los campos del perfil que van a extra_data se declaran en fields.py.
     EXTRA_DATA = [
-        ("id", "id"),
-        ("curp", "curp"),
-        ("telefono", "telefono"),
-        ("fechaNacimiento", "fechaNacimiento"),
-        ("sexo", "sexo"),
-        ("correoVerificado", "correoVerificado"),
-        ("telefonoVerificado", "telefonoVerificado"),
         ("refresh_token", "refresh_token"),
         ("access_token", "access_token"),
+        ("expires_in", "expires_in"),
     ]
 
     UPDATE_USER_ON_LOGIN = True
 
+    # Presupuesto del login en curso (ver deadline.py); None fuera de auth_complete().
+    _deadline = None
+    _site = None
+    # State ya validado en este callback (validate_state se llama dos veces).
+    _validated_state = None
+
+    # =============================================================
+    # SITIO (multi-sitio, ver sites.py)
+    # =============================================================
+    @property
+    def site(self):
+        """Sitio del request (host); el sitio por defecto sin request."""
+        if self._site is None:
+            self._site = get_site_registry().for_request(getattr(self.strategy, "request", None))
+        return self._site
+
+    @site.setter
+    def site(self, value):
+        self._site = value
+
+    def for_site(self, name):
+        """Este backend atado al sitio `name` (p. ej. el guardado en extra_data)."""
+        site = get_site_registry().get(name)
+        if site is self.site:
+            return self
+        backend = copy.copy(self)
+        backend.site = site
+        return backend
+
+    def setting(self, name, default=None):
+        """Override del sitio o, si no hay, el setting de la strategy."""
+        value = self.site.setting(name, self._global_setting)
+        return default if value is MISSING else value
+
+    def _global_setting(self, name):
+        return super().setting(name, MISSING)
+
+    def _url(self, name):
+        """Endpoint del ambiente del sitio; si no lo fija, el de la clase."""
+        return self.site.urls.get(name) or getattr(self, name)
+
     # =============================================================
     # STATE MANUAL (Seguridad CSRF)
     # =============================================================
@@ -88,9 +241,13 @@ class LlaveMXOAuth2(BaseOAuth2):
         Construye el URL de autorización incluyendo el parámetro STATE
         generado manualmente según las notas de seguridad de LlaveMX.
         """
-        state = self.generate_state()
-
-        self.strategy.session_set("llavemx_state", state)
+        state = None
+        if self.setting("STATE_MODE", "session") == "signed":
+            # Sin escritura de sesión; None si el navegador no tiene cookie CSRF.
+            state = make_state(getattr(self.strategy, "request", None))
+        if state is None:
+            state = self.generate_state()
+            self.strategy.session_set("llavemx_state", state)
 
         params = {
             "client_id": self.setting("KEY"),
@@ -99,18 +256,33 @@ class LlaveMXOAuth2(BaseOAuth2):
             "state": state,
         }
 
-        return f"{self.AUTHORIZATION_URL}?{urlencode(params)}"
+        return f"{self._url('AUTHORIZATION_URL')}?{urlencode(params)}"
 
     def validate_state(self):
         """
         Valida que el state del callback coincida con el generado.
-        Protege contra ataques CSRF.
+        Protege contra ataques CSRF. Los state firmados se verifican sin
+        sesión (state.py); el resto se compara con el guardado en sesión.
+
+        auth_complete() valida antes de delegar y BaseOAuth2.auth_complete()
+        vuelve a llamar a este método: el segundo llamado del mismo callback
+        reutiliza el resultado, porque check_state() consume el nonce.
         """
         sent_state = self.data.get("state")
+        if sent_state and sent_state == self._validated_state:
+            return
+
+        if sent_state and is_signed(sent_state):
+            if not check_state(self, sent_state):
+                raise AuthFailed(self, "State inválido o inexistente. Posible CSRF.")
+            self._validated_state = sent_state
+            return
+
         saved_state = self.strategy.session_get("llavemx_state")
 
-        if not sent_state or not saved_state or sent_state != saved_state:
+        if not sent_state or not saved_state or not constant_time_compare(sent_state, saved_state):
             raise AuthFailed(self, "State inválido o inexistente. Posible CSRF.")
+        self._validated_state = sent_state
 
     def auth_complete(self, *args, **kwargs):
         """
@@ -118,95 +290,324 @@ class LlaveMXOAuth2(BaseOAuth2):
         NOTA DE SEGURIDAD:
         - LlaveMX ya valida internamente el redirect_url registrado.
         """
-        self.validate_state()
-        return super().auth_complete(*args, **kwargs)
+        self._start_deadline()
+        try:
+            self.validate_state()
+            return super().auth_complete(*args, **kwargs)
+        finally:
+            self._deadline = None
+
+    async def aauth_complete(self, *args, **kwargs):
+        """
+        Versión coroutine de auth_complete() para vistas async (ASGI).
+        Los WS se consumen sin bloquear el event loop; la sesión y el
+        pipeline (ORM) corren vía sync_to_async. La vista complete de
+        social_django es síncrona: esto se llama desde una vista async propia.
+        """
+        self._start_deadline()
+        try:
+            self.process_error(self.data)
+            await sync_to_async(self.validate_state)()
+            response = await self.arequest_access_token()
+            self.process_error(response)
+
+            access_token = response["access_token"]
+            data = await self.auser_data(access_token, response=response)
+            response.update(data or {})
+            if "access_token" not in response:
+                response["access_token"] = access_token
+            kwargs.update({"response": response, "backend": self})
+            return await sync_to_async(self.strategy.authenticate)(*args, **kwargs)
+        finally:
+            self._deadline = None
+
+    def _start_deadline(self):
+        seconds = self.setting("LOGIN_TIMEOUT", DEFAULT_LOGIN_TIMEOUT)
+        self._deadline = Deadline(seconds) if seconds else None
+
+    def _remaining(self):
+        """Segundos que le quedan al login, o None si no hay presupuesto."""
+        return None if self._deadline is None else self._deadline.remaining()
 
     # =============================================================
     # BASIC AUTH (usuario_ws + password_ws)
     # =============================================================
     def _basic_auth(self):
-        user = settings.SOCIAL_AUTH_LLAVEMX_WS_USER
-        pwd = settings.SOCIAL_AUTH_LLAVEMX_WS_PASSWORD
-
-        if not user or not pwd:
+        # WS_USER / WS_PASSWORD del sitio o de la strategy; el header se
+        # reutiliza mientras no cambien.
+        header = self.site.auth_header(self.setting("WS_USER"), self.setting("WS_PASSWORD"))
+        if header is None:
             raise AuthFailed(
                 self,
                 "Faltan credenciales WS (usuario_ws o password_ws)."
             )
-
-        raw = f"{user}:{pwd}".encode("utf-8")
-        encoded = base64.b64encode(raw).decode("utf-8")
-        return f"Basic {encoded}"
+        return header
 
     # =============================================================
-    # TOKEN EXCHANGE (Authorization Code)
+    # TRANSPORTE HTTP (keep-alive + timeouts)
     # =============================================================
-    def request_access_token(self, *args, **kwargs):
-        """
-        Canjea el "code" por un access_token usando el WS de LlaveMX.
+    def _transport(self):
+        return get_transport(
+            connect_timeout=self.setting("CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=self.setting("READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+            pool_maxsize=self.setting("POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE),
+            dns_ttl=self.setting("DNS_TTL", DEFAULT_DNS_TTL),
+            pool=self.site.name,
+        )
 
-        NOTA DE SEGURIDAD:
-        - Esta llamada se hace SOLO desde backend (Manual LlaveMX 3.5).
-        - Se maneja explícitamente el caso de code inválido/expirado.
+    def _ws_urls(self):
+        names = ["ACCESS_TOKEN_URL", "USER_DATA_URL", "LOGOUT_URL"]
+        if self._roles_enabled():
+            names.append("ROLES_URL")
+        return [self._url(name) for name in names]
+
+    def prewarm(self, connections=None):
         """
-        code = self.data.get("code")
-        if not code:
-            raise AuthFailed(self, "No se recibió parámetro 'code'.")
+        Abre por adelantado conexiones (DNS + TCP + TLS) a los hosts de los WS
+        para que los primeros logins del worker no paguen el handshake.
+        Regresa cuántas conexiones quedaron listas.
+        """
+        if connections is None:
+            connections = self.setting("PREWARM_CONNECTIONS", 0)
+        transport = self._transport()
+        transport.refresh_dns()
+        hosts = {urlsplit(url).netloc: url for url in self._ws_urls()}
+        return sum(transport.warm(url, connections) for url in hosts.values())
 
-        client_id = self.setting("KEY")
-        client_secret = self.setting("SECRET")
-        redirect_uri = self.get_redirect_uri()
+    def _async_client(self):
+        return get_async_client(
+            connect_timeout=self.setting("CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=self.setting("READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+            pool_maxsize=self.setting("POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE),
+            pool=self.site.name,
+        )
 
-        payload = {
-            "grantType": "authorization_code",
-            "code": code,
-            "redirectUri": redirect_uri,
-            "clientId": client_id,
-            "clientSecret": client_secret,
-        }
+    def _breaker(self, endpoint):
+        return CircuitBreaker(
+            get_cache(self),
+            self.site.breaker_name(endpoint),
+            failure_threshold=self.setting("BREAKER_FAILURE_THRESHOLD", DEFAULT_FAILURE_THRESHOLD),
+            failure_window=self.setting("BREAKER_FAILURE_WINDOW", DEFAULT_FAILURE_WINDOW),
+            reset_timeout=self.setting("BREAKER_RESET_TIMEOUT", DEFAULT_RESET_TIMEOUT),
+        )
 
-        headers = {
+    def _ws_headers(self, access_token):
+        return {
             "Content-Type": "application/json",
             "Authorization": self._basic_auth(),
-            "Accept": "application/json",
+            "accessToken": access_token,
         }
 
+    def _ws_request(self, endpoint, method, url, headers, body=None, idempotent=False):
+        """
+        Llama un WS de LlaveMX por el pool compartido y regresa el JSON.
+
+        - Si el endpoint tiene tasa en ADMISSION_RATES, espera su turno en el
+          control de admisión del clúster (AdmissionRejected si no lo hay).
+        - Pasa por el circuit breaker del endpoint (CircuitOpenError si está abierto).
+        - Solo las llamadas idempotentes se reintentan, con backoff y jitter,
+          ante errores de red o HTTP 5xx.
+        - Dentro de un login, timeouts, espera de admisión y backoff se
+          acotan al presupuesto restante (DeadlineExceeded al agotarse).
+        """
+        breaker, retries, backoff, sink = self._ws_policy(endpoint, idempotent)
+
+        for attempt in range(retries + 1):
+            admission = self._admission(endpoint)
+            if admission is not None:
+                wait = self._ws_admitted(endpoint, sink, admission.reserve)
+                if wait:
+                    time.sleep(wait)
+            timeout = self._ws_budget(endpoint, sink)
+            state = self._ws_allowed(endpoint, sink, breaker.allow)
+            started = self._ws_started(endpoint, sink)
+            try:
+                raw = self._transport().request(
+                    method, url, headers=headers, body=body, timeout=timeout, idempotent=idempotent
+                )
+            except (HTTPError, URLError) as e:
+                kind = self._ws_failure_kind(endpoint, sink, started, e)
+                if kind == "deadline":
+                    breaker.release(state)
+                    raise DeadlineExceeded(endpoint) from e
+                if kind == "client":
+                    # Error del cliente: LlaveMX está respondiendo.
+                    breaker.record_success(state)
+                    raise
+                breaker.record_failure(state)
+                time.sleep(self._ws_retry_delay(e, attempt, retries, backoff))
+                continue
+            breaker.record_success(state)
+            return self._ws_parse(endpoint, sink, started, raw)
+
+    async def _aws_request(self, endpoint, method, url, headers, body=None, idempotent=False):
+        """
+        Versión coroutine de _ws_request() sobre el cliente asyncio (aio.py).
+        El breaker y la admisión usan la API async del cache (aget/aadd/aincr):
+        con Redis o Memcached una llamada síncrona bloquearía todo el loop.
+        """
+        breaker, retries, backoff, sink = self._ws_policy(endpoint, idempotent)
+
+        for attempt in range(retries + 1):
+            admission = self._admission(endpoint)
+            if admission is not None:
+                wait = await self._aws_admitted(endpoint, sink, admission.areserve)
+                if wait:
+                    await asyncio.sleep(wait)
+            timeout = self._ws_budget(endpoint, sink)
+            state = await self._aws_allowed(endpoint, sink, breaker.aallow)
+            started = self._ws_started(endpoint, sink)
+            try:
+                raw = await self._async_client().request(
+                    method, url, headers=headers, body=body, timeout=timeout, idempotent=idempotent
+                )
+            except (HTTPError, URLError) as e:
+                kind = self._ws_failure_kind(endpoint, sink, started, e)
+                if kind == "deadline":
+                    await breaker.arelease(state)
+                    raise DeadlineExceeded(endpoint) from e
+                if kind == "client":
+                    await breaker.arecord_success(state)
+                    raise
+                await breaker.arecord_failure(state)
+                await asyncio.sleep(self._ws_retry_delay(e, attempt, retries, backoff))
+                continue
+            await breaker.arecord_success(state)
+            return self._ws_parse(endpoint, sink, started, raw)
+
+    def _ws_policy(self, endpoint, idempotent):
+        retries = self.setting("MAX_RETRIES", DEFAULT_MAX_RETRIES) if idempotent else 0
+        backoff = self.setting("RETRY_BACKOFF", DEFAULT_RETRY_BACKOFF)
+        return self._breaker(endpoint), retries, backoff, get_metrics_sink()
+
+    def _admission(self, endpoint):
+        """Control de admisión del endpoint, o None si no tiene tasa en ADMISSION_RATES."""
+        rate = self.setting("ADMISSION_RATES", {}).get(endpoint)
+        if not rate:
+            return None
+        max_wait = self.setting("ADMISSION_MAX_WAIT", DEFAULT_ADMISSION_MAX_WAIT)
+        if self._deadline is not None:
+            max_wait = min(max_wait, self._deadline.remaining())
+        return AdmissionController(
+            get_cache(self),
+            endpoint,
+            rate,
+            max_wait=max_wait,
+            window=self.setting("ADMISSION_WINDOW", DEFAULT_ADMISSION_WINDOW),
+        )
+
+    def _ws_admitted(self, endpoint, sink, reserve):
+        """Segundos a esperar por el turno de admisión del endpoint."""
         try:
-            req = Request(
-                self.ACCESS_TOKEN_URL,
-                data=json.dumps(payload).encode("utf-8"),
-                headers=headers,
-                method="POST",
-            )
-            resp = urlopen(req)
-            raw = resp.read().decode("utf-8") or "{}"
-            data = json.loads(raw)
+            return reserve()
+        except AdmissionRejected:
+            if sink.enabled:
+                sink.count_status(endpoint, "rejected")
+            raise
 
-            # Manejo explícito de errores devueltos por LlaveMX
-            if isinstance(data, dict) and data.get("error"):
-                error = data.get("error")
-                description = data.get("errorDescription") or data.get("error_description") or ""
-                msg = f"Error al obtener token LlaveMX: {error} - {description}"
+    async def _aws_admitted(self, endpoint, sink, areserve):
+        try:
+            return await areserve()
+        except AdmissionRejected:
+            if sink.enabled:
+                sink.count_status(endpoint, "rejected")
+            raise
 
-                # NOTA DE SEGURIDAD: si el code expiró o es inválido,
-                # forzamos a que el usuario reinicie el flujo de login.
-                raise AuthFailed(self, msg)
+    def _ws_budget(self, endpoint, sink):
+        """Timeout de la llamada: lo que resta del login (None fuera de un login)."""
+        if self._deadline is None:
+            return None
+        try:
+            return self._deadline.cap(None, endpoint)
+        except DeadlineExceeded:
+            if sink.enabled:
+                sink.count_status(endpoint, "deadline")
+            raise
+
+    def _ws_allowed(self, endpoint, sink, allow):
+        """Estado con el que el breaker autoriza la llamada."""
+        try:
+            return allow()
+        except CircuitOpenError:
+            if sink.enabled:
+                sink.count_status(endpoint, "circuit_open")
+            raise
+
+    async def _aws_allowed(self, endpoint, sink, aallow):
+        try:
+            return await aallow()
+        except CircuitOpenError:
+            if sink.enabled:
+                sink.count_status(endpoint, "circuit_open")
+            raise
+
+    def _ws_started(self, endpoint, sink):
+        if not sink.enabled:
+            return None
+        sink.in_flight(endpoint, 1)
+        return time.perf_counter()
+
+    def _ws_failure_kind(self, endpoint, sink, started, error):
+        """
+        Registra el fallo y lo clasifica para el breaker: "deadline" (lo cortó
+        el presupuesto del login), "client" (4xx) o "server" (red o 5xx).
+        """
+        if not isinstance(error, HTTPError) and self._deadline is not None and self._deadline.expired():
+            # El timeout lo puso el presupuesto del login: no cuenta como falla de LlaveMX.
+            if sink.enabled:
+                sink.in_flight(endpoint, -1)
+                sink.count_status(endpoint, "deadline")
+            return "deadline"
+        if sink.enabled:
+            self._record_ws_failure(sink, endpoint, error, started)
+        if isinstance(error, HTTPError) and error.code < 500:
+            return "client"
+        return "server"
 
-            access_token = data.get("accessToken")
-            if not access_token:
-                raise AuthFailed(self, "LlaveMX no retornó accessToken.")
+    def _ws_retry_delay(self, error, attempt, retries, backoff):
+        """Espera antes del reintento, o relanza el error si ya no hay reintento."""
+        if attempt >= retries:
+            raise error
+        delay = random.uniform(0, backoff * (2 ** attempt))
+        if self._deadline is not None and delay >= self._deadline.remaining():
+            # El reintento ya no cabe en el presupuesto del login.
+            raise error
+        return delay
 
-            expires_raw = data.get("expiresIn", 900)
-            # Manual: expiresIn en milisegundos; convertimos si es necesario
-            expires_in = int(expires_raw / 1000) if isinstance(expires_raw, (int, float)) and expires_raw > 10_000_000 else expires_raw
+    def _ws_parse(self, endpoint, sink, started, raw):
+        if sink.enabled:
+            # Antes de parsear: un 200 sin JSON (p. ej. HTML de un gateway)
+            # no debe dejar la llamada contada como en vuelo.
+            sink.in_flight(endpoint, -1)
+            sink.observe_latency(endpoint, time.perf_counter() - started)
+            sink.count_status(endpoint, 200)
+        data = json.loads(raw.decode("utf-8") or "{}")
+        if sink.enabled:
+            if isinstance(data, dict) and data.get("error"):
+                sink.count_error(endpoint, error_label(code=data["error"]))
+        return data
 
-            return {
-                "access_token": access_token,
-                "expires_in": expires_in,
-                "refresh_token": data.get("refreshToken"),
-                "token_type": "Bearer",
-            }
+    def _record_ws_failure(self, sink, endpoint, error, started):
+        sink.in_flight(endpoint, -1)
+        sink.observe_latency(endpoint, time.perf_counter() - started)
+        if not isinstance(error, HTTPError):
+            sink.count_status(endpoint, "network")
+            sink.count_error(endpoint, error_label(error))
+            return
 
+        sink.count_status(endpoint, error.code)
+        try:
+            payload = json.loads(getattr(error, "body", b"") or b"{}")
+            code = payload.get("error") if isinstance(payload, dict) else None
+        except ValueError:
+            code = None
+        sink.count_error(endpoint, error_label(error, code))
+
+    @contextmanager
+    def _ws_errors(self, label):
+        """Traduce los errores de un WS a AuthFailed / AuthUnknownError."""
+        try:
+            yield
         except HTTPError as e:
             # Intentamos leer el detalle de error del body
             try:
@@ -217,19 +618,202 @@ class LlaveMXOAuth2(BaseOAuth2):
 
             error = data.get("error") or e.reason
             description = data.get("errorDescription") or data.get("error_description") or ""
-            msg = f"LlaveMX token HTTPError ({e.code}): {error} - {description}"
+            msg = f"LlaveMX {label} HTTPError ({e.code}): {error} - {description}"
             logger.error(msg)
-            raise AuthFailed(self, msg)
+            # La causa conserva el status para quien necesite distinguir 4xx de 5xx.
+            raise AuthFailed(self, msg) from e
+        except CircuitOpenError as e:
+            # Fallamos rápido: no ocupamos un worker esperando a LlaveMX.
+            logger.error(f"LlaveMX {label}: {e}")
+            raise AuthUnknownError(
+                self,
+                "LlaveMX no está disponible en este momento. Intenta de nuevo en unos minutos.",
+            )
+        except AdmissionRejected as e:
+            logger.warning(f"LlaveMX {label}: {e}")
+            raise AuthUnknownError(
+                self,
+                "Hay muchos inicios de sesión con LlaveMX en este momento. Intenta de nuevo en un minuto.",
+            )
+        except DeadlineExceeded as e:
+            logger.warning(f"LlaveMX {label}: {e}")
+            raise AuthUnknownError(
+                self,
+                "LlaveMX tardó demasiado en responder. Intenta de nuevo.",
+            )
         except (URLError, ValueError) as e:
-            logger.error(f"LlaveMX token error de red/parsing: {e}")
+            logger.error(f"LlaveMX {label} error de red/parsing: {e}")
             raise AuthUnknownError(self, str(e))
         except AuthFailed:
-            # Ya está formateado arriba, sólo lo propagamos
+            # Ya está formateado, sólo lo propagamos
             raise
         except Exception as e:
-            logger.error(f"LlaveMX token error inesperado: {e}")
+            logger.error(f"LlaveMX {label} error inesperado: {e}")
             raise AuthUnknownError(self, str(e))
 
+    # =============================================================
+    # TOKEN EXCHANGE (Authorization Code)
+    # =============================================================
+    def request_access_token(self, *args, **kwargs):
+        """
+        Canjea el "code" por un access_token usando el WS de LlaveMX.
+
+        NOTA DE SEGURIDAD:
+        - Esta llamada se hace SOLO desde backend (Manual LlaveMX 3.5).
+        - Se maneja explícitamente el caso de code inválido/expirado.
+        """
+        headers, body = self._token_request()
+
+        def exchange():
+            with self._ws_errors("token"):
+                data = self._ws_request("token", "POST", self._url("ACCESS_TOKEN_URL"), headers, body=body)
+                return self._parse_token_response(data)
+
+        flight = self._code_flight()
+        if flight is None:
+            return exchange()
+        with self._flight_errors():
+            outcome = flight.run(exchange, _describe_auth_error, wait=self._remaining())
+        return self._flight_outcome(outcome)
+
+    async def arequest_access_token(self, *args, **kwargs):
+        """Versión coroutine de request_access_token()."""
+        headers, body = self._token_request()
+
+        async def exchange():
+            with self._ws_errors("token"):
+                data = await self._aws_request("token", "POST", self._url("ACCESS_TOKEN_URL"), headers, body=body)
+                return self._parse_token_response(data)
+
+        flight = self._code_flight()
+        if flight is None:
+            return await exchange()
+        with self._flight_errors():
+            outcome = await flight.arun(exchange, _describe_auth_error, wait=self._remaining())
+        return self._flight_outcome(outcome)
+
+    def _code_flight(self):
+        """
+        Single-flight del canje: un doble tap o recarga del callback espera
+        el resultado del primer canje en lugar de repetirlo.
+
+        La llave es el hash de code + state. El state ya se validó contra la
+        sesión o la cookie CSRF de este navegador, así que solo un duplicado
+        del mismo navegador comparte el resultado. Otra sesión con el mismo
+        code (y su propio state) canjea por su cuenta y LlaveMX lo rechaza,
+        como sin single-flight.
+
+        El resultado publicado incluye los tokens: mientras dure
+        CODE_RESULT_TTL, volver a abrir la URL del callback en ese navegador
+        inicia sesión otra vez sin pasar por LlaveMX. Por eso el TTL es de
+        pocos segundos (lo que dura un doble tap o una recarga); después, el
+        code ya consumido hace que LlaveMX rechace el canje.
+        """
+        if not self.setting("CODE_SINGLE_FLIGHT", True):
+            return None
+        return SingleFlight(
+            get_cache(self),
+            "code",
+            fingerprint(f"{self.data['code']}.{self.data.get('state', '')}"),
+            lock_ttl=self.setting("CODE_LOCK_TTL", DEFAULT_LOCK_TTL),
+            result_ttl=self.setting("CODE_RESULT_TTL", DEFAULT_RESULT_TTL),
+        )
+
+    @contextmanager
+    def _flight_errors(self):
+        """El duplicado no canjea por su cuenta si el primero no termina a tiempo."""
+        try:
+            yield
+        except FlightTimeout:
+            logger.warning("[LlaveMX] El canje duplicado no recibió el resultado del primero a tiempo.")
+            raise AuthUnknownError(
+                self,
+                "LlaveMX tardó demasiado en responder. Intenta de nuevo.",
+            )
+
+    def _flight_outcome(self, outcome):
+        if outcome[0] == "ok":
+            return outcome[1]
+        _, _, message = outcome
+        raise AuthFailed(self, message)
+
+    def _token_request(self):
+        code = self.data.get("code")
+        if not code:
+            raise AuthFailed(self, "No se recibió parámetro 'code'.")
+
+        payload = {
+            "grantType": "authorization_code",
+            "code": code,
+            "redirectUri": self.get_redirect_uri(),
+            "clientId": self.setting("KEY"),
+            "clientSecret": self.setting("SECRET"),
+        }
+        return self._token_headers(), json.dumps(payload).encode("utf-8")
+
+    def _token_headers(self):
+        return {
+            "Content-Type": "application/json",
+            "Authorization": self._basic_auth(),
+            "Accept": "application/json",
+        }
+
+    def _parse_token_response(self, data):
+        # Manejo explícito de errores devueltos por LlaveMX
+        if isinstance(data, dict) and data.get("error"):
+            error = data.get("error")
+            description = data.get("errorDescription") or data.get("error_description") or ""
+            msg = f"Error al obtener token LlaveMX: {error} - {description}"
+
+            # NOTA DE SEGURIDAD: si el code expiró o es inválido,
+            # forzamos a que el usuario reinicie el flujo de login.
+            raise AuthFailed(self, msg)
+
+        access_token = data.get("accessToken")
+        if not access_token:
+            raise AuthFailed(self, "LlaveMX no retornó accessToken.")
+
+        expires_raw = data.get("expiresIn", 900)
+        # Manual: expiresIn en milisegundos; convertimos si es necesario
+        expires_in = int(expires_raw / 1000) if isinstance(expires_raw, (int, float)) and expires_raw > 10_000_000 else expires_raw
+
+        return {
+            "access_token": access_token,
+            "expires_in": expires_in,
+            "refresh_token": data.get("refreshToken"),
+            "token_type": "Bearer",
+        }
+
+    # =============================================================
+    # REFRESH TOKEN (ver tokens.py)
+    # =============================================================
+    def refresh_token(self, token, *args, **kwargs):
+        """
+        Obtiene un access_token nuevo con el refresh_token guardado
+        (grantType=refresh_token en /obtenerToken). Regresa la misma forma
+        que request_access_token() para que extra_data() la normalice.
+        """
+        payload = {
+            "grantType": "refresh_token",
+            "refreshToken": token,
+            "clientId": self.setting("KEY"),
+            "clientSecret": self.setting("SECRET"),
+        }
+
+        with self._ws_errors("refresh"):
+            data = self._ws_request(
+                "refresh",
+                "POST",
+                self._url("ACCESS_TOKEN_URL"),
+                self._token_headers(),
+                body=json.dumps(payload).encode("utf-8"),
+            )
+            response = self._parse_token_response(data)
+
+        # Si LlaveMX no rota el refresh_token seguimos usando el mismo.
+        response["refresh_token"] = response["refresh_token"] or token
+        return response
+
     # =============================================================
     # USER DATA
     # =============================================================
@@ -241,56 +825,81 @@ class LlaveMXOAuth2(BaseOAuth2):
         - El token se envía SOLO por header desde backend.
         - No se expone el token ni la respuesta completa en el frontend.
         - Si LlaveMX responde 'invalid_token', se fuerza reautenticación.
+        - El perfil se cachea brevemente por hash del token para no repetir
+          la llamada cuando social-core reingresa al backend con el mismo token.
         """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": self._basic_auth(),
-            "accessToken": access_token,
-        }
+        response = kwargs.get("response")
+        cache_ttl = self._profile_cache_ttl(response)
+        if cache_ttl:
+            cached = get_cache(self).get(self._profile_cache_key(access_token))
+            if cached is not None:
+                return cached
 
-        try:
-            req = Request(self.USER_DATA_URL, headers=headers, method="GET")
-            resp = urlopen(req)
-            raw = resp.read().decode("utf-8") or "{}"
-            data = json.loads(raw)
+        headers = self._ws_headers(access_token)
 
-            # Manejo explícito de invalid_token
-            if isinstance(data, dict) and data.get("error"):
-                error = data.get("error")
-                description = data.get("errorDescription") or data.get("error_description") or ""
-                msg = f"Error al obtener datos de usuario LlaveMX: {error} - {description}"
+        with self._ws_errors("user_data"):
+            data = self._ws_request("user_data", "GET", self._url("USER_DATA_URL"), headers, idempotent=True)
+            data = self._parse_user_data(data)
+
+            if self._roles_enabled():
+                data["roles"] = self._user_roles(data, access_token)
 
-                if error == "invalid_token":
-                    # NOTA DE SEGURIDAD:
-                    # No damos acceso, obligamos a reiniciar el flujo de autenticación.
-                    raise AuthFailed(self, msg)
+            if cache_ttl:
+                get_cache(self).set(self._profile_cache_key(access_token), data, cache_ttl)
 
-                raise AuthUnknownError(self, msg)
+            return data
+
+    async def auser_data(self, access_token, *args, **kwargs):
+        """Versión coroutine de user_data()."""
+        response = kwargs.get("response")
+        cache_ttl = self._profile_cache_ttl(response)
+        if cache_ttl:
+            cached = await get_cache(self).aget(self._profile_cache_key(access_token))
+            if cached is not None:
+                return cached
+
+        headers = self._ws_headers(access_token)
+
+        with self._ws_errors("user_data"):
+            data = await self._aws_request("user_data", "GET", self._url("USER_DATA_URL"), headers, idempotent=True)
+            data = self._parse_user_data(data)
 
-            if not self._valid_user_response(data):
-                raise AuthFailed(self, "Respuesta inválida de LlaveMX al obtener datos de usuario.")
+            if self._roles_enabled():
+                data["roles"] = await self._auser_roles(data, access_token)
+
+            if cache_ttl:
+                await get_cache(self).aset(self._profile_cache_key(access_token), data, cache_ttl)
 
             return data
 
-        except HTTPError as e:
-            try:
-                body = e.read().decode("utf-8") or "{}"
-                data = json.loads(body)
-            except Exception:
-                data = {}
-            error = data.get("error") or e.reason
+    def _parse_user_data(self, data):
+        # Manejo explícito de invalid_token
+        if isinstance(data, dict) and data.get("error"):
+            error = data.get("error")
             description = data.get("errorDescription") or data.get("error_description") or ""
-            msg = f"LlaveMX user_data HTTPError ({e.code}): {error} - {description}"
-            logger.error(msg)
-            raise AuthFailed(self, msg)
-        except (URLError, ValueError) as e:
-            logger.error(f"LlaveMX user_data error de red/parsing: {e}")
-            raise AuthUnknownError(self, str(e))
-        except AuthFailed:
-            raise
-        except Exception as e:
-            logger.error(f"LlaveMX user_data error inesperado: {e}")
-            raise AuthUnknownError(self, str(e))
+            msg = f"Error al obtener datos de usuario LlaveMX: {error} - {description}"
+
+            if error == "invalid_token":
+                # NOTA DE SEGURIDAD:
+                # No damos acceso, obligamos a reiniciar el flujo de autenticación.
+                raise AuthFailed(self, msg)
+
+            raise AuthUnknownError(self, msg)
+
+        if not self._valid_user_response(data):
+            raise AuthFailed(self, "Respuesta inválida de LlaveMX al obtener datos de usuario.")
+        return data
+
+    def _profile_cache_key(self, access_token):
+        return make_key("profile", fingerprint(access_token))
+
+    def _profile_cache_ttl(self, response=None):
+        """TTL del cache de perfil, nunca mayor a la vigencia del token."""
+        ttl = self.setting("PROFILE_CACHE_TTL", DEFAULT_PROFILE_CACHE_TTL)
+        expires_in = (response or {}).get("expires_in")
+        if isinstance(expires_in, (int, float)) and expires_in > 0:
+            ttl = min(ttl, int(expires_in))
+        return max(ttl, 0)
 
     def _valid_user_response(self, data):
         if not isinstance(data, dict):
@@ -302,6 +911,52 @@ class LlaveMXOAuth2(BaseOAuth2):
         return True
 
     # =============================================================
+    # ROLES (opt-in: SOCIAL_AUTH_LLAVEMX_FETCH_ROLES)
+    # =============================================================
+    def _roles_enabled(self):
+        return bool(self.setting("FETCH_ROLES", False))
+
+    def _roles_cache_key(self, user_id):
+        return make_key("roles", user_id)
+
+    def _user_roles(self, data, access_token):
+        """
+        Roles del usuario de `data` (perfil de /datosUsuario): del cache por
+        idUsuario y, solo si no están, del WS de roles. La respuesta del token
+        no trae idUsuario, así que no se puede decidir antes del perfil.
+        """
+        key = self._roles_cache_key(data["idUsuario"])
+        roles = get_cache(self).get(key)
+        if roles is None:
+            roles = self._fetch_roles(access_token)
+            get_cache(self).set(key, roles, self.setting("ROLES_CACHE_TTL", DEFAULT_ROLES_CACHE_TTL))
+        return roles
+
+    async def _auser_roles(self, data, access_token):
+        key = self._roles_cache_key(data["idUsuario"])
+        roles = await get_cache(self).aget(key)
+        if roles is None:
+            roles = await self._afetch_roles(access_token)
+            await get_cache(self).aset(key, roles, self.setting("ROLES_CACHE_TTL", DEFAULT_ROLES_CACHE_TTL))
+        return roles
+
+    def _fetch_roles(self, access_token):
+        data = self._ws_request("roles", "GET", self._url("ROLES_URL"), self._ws_headers(access_token), idempotent=True)
+        return self._parse_roles(data)
+
+    async def _afetch_roles(self, access_token):
+        data = await self._aws_request("roles", "GET", self._url("ROLES_URL"), self._ws_headers(access_token), idempotent=True)
+        return self._parse_roles(data)
+
+    def _parse_roles(self, data):
+        if isinstance(data, dict):
+            if data.get("error"):
+                error = data.get("error")
+                description = data.get("errorDescription") or data.get("error_description") or ""
+                raise AuthUnknownError(self, f"Error al obtener roles LlaveMX: {error} - {description}")
+            data = data.get("roles", data)
+        return data
+    # =============================================================
     # USER ID
     # =============================================================
     def get_user_id(self, details, response):
@@ -311,57 +966,26 @@ class LlaveMXOAuth2(BaseOAuth2):
     # USER DETAILS MAPPING
     # =============================================================
     def get_user_details(self, response):
-        curp = (response.get("curp") or "").strip()
-        login = (response.get("login") or "").strip()
-        username = curp if curp else login
-
-        email = (response.get("correo") or "").strip()
-        if not email and login:
-            email = f"{login}@llavemx.temp"
-
-        nombres = (response.get("nombre") or "").strip()
-        primer_ap = (response.get("primerApellido") or "").strip()
-        segundo_ap = (response.get("segundoApellido") or "").strip()
+        """Mapeo declarado en fields.py (SOCIAL_AUTH_LLAVEMX_EXTRA_FIELDS / EXCLUDE_FIELDS)."""
+        return get_field_schema(self).user_details(response)
 
-        full_name = " ".join(filter(None, [nombres, primer_ap, segundo_ap]))
-        last_name = " ".join(filter(None, [primer_ap, segundo_ap]))
-
-        return {
-            "id": response.get("idUsuario", ""),
-            "username": username,
-            "email": email,
-            "name": full_name,
-            "first_name": nombres,
-            "last_name": last_name,
-
-            "nombres": nombres,
-            "primer_apellido": primer_ap,
-            "segundo_apellido": segundo_ap,
-            "curp": curp,
-            "telefono": response.get("telVigente") or response.get("telefono") or "",
-            "fechaNacimiento": response.get("fechaNacimiento") or "",
-            "sexo": response.get("sexo") or "",
-            "correoVerificado": bool(response.get("correoVerificado", False)),
-            "telefonoVerificado": bool(response.get("telefonoVerificado", False)),
-            "estado": response.get("estadoNacimiento") or "",
-            "municipio": (response.get("domicilio") or {}).get("alcaldiaMunicipio", ""),
-
-            "pais": "",
-            "dni": "",
-            "ocupacion": "",
-            "maximo_nivel": "",
-            "eres_docente": False,
-            "cct": "",
-            "funcion": "",
-            "nivel_Educativo": "",
-            "asignatura": "",
-            "cuentanos": "",
-        }
+    def extra_data(self, user, uid, response, details, pipeline_kwargs):
+        """
+        Tokens (EXTRA_DATA) + campos del perfil declarados para extra_data,
+        tomados de la respuesta cruda como las entradas de EXTRA_DATA. Los que
+        no vienen quedan en None para que un update() limpie lo guardado.
+        """
+        data = super().extra_data(user, uid, response, details, pipeline_kwargs)
+        data.update(get_field_schema(self).extra_data(response, details or {}))
+        if self.site.name is not None:
+            # Para refrescar y cerrar la sesión con el cliente del sitio fuera del request.
+            data[SITE_FIELD] = self.site.name
+        return data
 
     # =============================================================
     # LOGOUT / REVOCACIÓN DE TOKEN
     # =============================================================
-    def revoke_token(self, token, response=None, *args, **kwargs):
+    def revoke_token(self, token, uid=None, *args, **kwargs):
         """
         Cierra la sesión de la cuenta LlaveMX consumiendo el WS /cerrarSesion.
 
@@ -369,29 +993,110 @@ class LlaveMXOAuth2(BaseOAuth2):
         - Se usa BasicAuth (usuario_ws + password_ws).
         - Se envía accessToken en header.
         - Se envía body "{}" para evitar HTTP 411 en productivo.
+
+        Con SOCIAL_AUTH_LLAVEMX_REVOKE_MODE = "background" o "task" la
+        llamada se delega (ver revocation.py) y el logout regresa de inmediato.
+        Si se invoca dentro de un event loop, la llamada se agenda en el loop.
+
+        Si el token guardado para `uid` ya expiró se refresca antes: con un
+        token vencido /cerrarSesion no cierra nada. El refresco va junto con
+        /cerrarSesion (en segundo plano si el modo lo delega), nunca antes de
+        regresar el logout.
         """
         if not token:
             return
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": self._basic_auth(),
-            "accessToken": token,
-        }
+        try:
+            get_cache(self).delete(self._profile_cache_key(token))
+        except Exception as e:
+            logger.error(f"LlaveMX profile cache invalidation error: {e}")
 
         try:
-            req = Request(
-                self.LOGOUT_URL,
-                data="{}".encode("utf-8"),  # workaround HTTP 411 Length Required
-                headers=headers,
-                method="POST",
-            )
-            resp = urlopen(req)
-            raw = resp.read().decode("utf-8") or "{}"
-            data = json.loads(raw)
-            if VERBOSE:
-                logger.info(f"LlaveMX logout response: {data}")
+            if dispatch_revocation(self, token, uid):
+                return
+        except Exception as e:
+            logger.error(f"LlaveMX logout dispatch error: {e}")
+
+        loop = running_loop()
+        if loop is not None:
+            task = loop.create_task(self._arevoke_remote_logged(token, uid))
+            _pending_revocations.add(task)
+            task.add_done_callback(_pending_revocations.discard)
+            return
+
+        try:
+            self._logout_remote(token, uid)
         except Exception as e:
             logger.error(f"LlaveMX logout error: {e}")
             # No rompemos el logout de Open edX aunque falle el WS remoto.
             return
+
+    async def arevoke_token(self, token, uid=None, *args, **kwargs):
+        """Versión coroutine de revoke_token()."""
+        if not token:
+            return
+
+        try:
+            await get_cache(self).adelete(self._profile_cache_key(token))
+        except Exception as e:
+            logger.error(f"LlaveMX profile cache invalidation error: {e}")
+
+        try:
+            if await sync_to_async(dispatch_revocation)(self, token, uid):
+                return
+        except Exception as e:
+            logger.error(f"LlaveMX logout dispatch error: {e}")
+
+        await self._arevoke_remote_logged(token, uid)
+
+    def _logout_remote(self, token, uid=None):
+        """Refresca el token de `uid` si ya venció y llama /cerrarSesion."""
+        return self._revoke_remote(self._token_for_logout(token, uid))
+
+    def _token_for_logout(self, token, uid):
+        if not uid:
+            return token
+        try:
+            social = self.strategy.storage.user.get_social_auth(self.name, uid)
+            if social is None or social.extra_data.get("access_token") != token:
+                return token
+            refresh_social(self, social, margin=0)
+            return social.extra_data.get("access_token") or token
+        except Exception as e:
+            logger.error(f"LlaveMX logout refresh error: {e}")
+            return token
+
+    def _revoke_remote(self, token):
+        """Llamada real a /cerrarSesion. Lanza excepción si falla."""
+        data = self._ws_request(
+            "logout",
+            "POST",
+            self._url("LOGOUT_URL"),
+            self._ws_headers(token),
+            body="{}".encode("utf-8"),  # workaround HTTP 411 Length Required
+        )
+        self._audit_logout(data)
+        return data
+
+    async def _arevoke_remote(self, token):
+        data = await self._aws_request(
+            "logout",
+            "POST",
+            self._url("LOGOUT_URL"),
+            self._ws_headers(token),
+            body="{}".encode("utf-8"),  # workaround HTTP 411 Length Required
+        )
+        self._audit_logout(data)
+        return data
+
+    def _audit_logout(self, data):
+        # Solo el resultado: la respuesta completa puede traer datos de la cuenta.
+        error = data.get("error") if isinstance(data, dict) else None
+        audit(LOGOUT_RESPONSE, result="error" if error else "ok", error=error)
+
+    async def _arevoke_remote_logged(self, token, uid=None):
+        try:
+            token = await sync_to_async(self._token_for_logout)(token, uid)
+            await self._arevoke_remote(token)
+        except Exception as e:
+            logger.error(f"LlaveMX logout error: {e}")
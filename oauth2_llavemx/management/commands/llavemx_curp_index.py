@@ -0,0 +1,58 @@
+"""
+Resincroniza CurpIndex con custom_reg_form.ExtraInfo.
+
+associate_by_curp solo consulta CurpIndex: una fila de ExtraInfo que no esté
+en el índice no cuenta para detectar CURPs ambiguas. Las señales cubren los
+save()/delete() normales, pero no QuerySet.update(), bulk_update() ni lo que
+escriban los workers con la versión anterior durante un despliegue gradual.
+
+Correr después de cada despliegue que migre oauth2_llavemx y después de
+cargas masivas sobre ExtraInfo. Es idempotente y se puede correr con el LMS
+en línea.
+
+Uso:
+    ./manage.py lms llavemx_curp_index
+    ./manage.py lms llavemx_curp_index --dry-run
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from oauth2_llavemx.signals import DEFAULT_RESYNC_BATCH_SIZE, resync_curp_index
+
+
+class Command(BaseCommand):
+    help = "Crea, corrige y elimina entradas de CurpIndex para que coincida con ExtraInfo."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_RESYNC_BATCH_SIZE)
+        parser.add_argument("--dry-run", action="store_true", help="Solo cuenta las diferencias.")
+
+    def handle(self, *args, **options):
+        try:
+            from custom_reg_form.models import ExtraInfo
+        except Exception:
+            raise CommandError("custom_reg_form.ExtraInfo no está disponible.")
+
+        started = time.monotonic()
+        stats = resync_curp_index(
+            ExtraInfo,
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            progress=self._progress,
+        )
+
+        self.stderr.write("")
+        self.stdout.write(
+            f"[LlaveMX] CurpIndex resincronizado en {time.monotonic() - started:.1f}s: "
+            + ", ".join(f"{name} {value}" for name, value in stats.items())
+        )
+
+    def _progress(self, stats):
+        self.stderr.write(
+            f"\r[LlaveMX] revisadas {stats['scanned']} | creadas {stats['created']} | "
+            f"actualizadas {stats['updated']} | eliminadas {stats['deleted'] + stats['orphans']}",
+            ending="",
+        )
+        self.stderr.flush()
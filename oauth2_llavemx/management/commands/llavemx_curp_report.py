@@ -0,0 +1,192 @@
+"""
+Reporte masivo de CURPs problemáticas para la asociación LlaveMX.
+
+Recorre CurpIndex (la CURP normalizada de ExtraInfo) ordenado por CURP en
+páginas de --chunk-size filas con cursor (curp, extra_info_id), agrupa filas
+consecutivas y escribe en CSV o JSONL:
+
+- ambiguous:     2+ cuentas activas  -> associate_by_curp bloquea el login
+- inactive_only: 2+ cuentas, ninguna activa -> asociación no concluyente
+- generic:       XEXX010101HDFXXX04 -> nunca se asocia
+
+La memoria es constante: solo se conserva una página, el grupo actual y un
+búfer de salida. No se usa iterator(): en MySQL el driver cargaría todo el
+resultado. Al final de cada bloque se escribe un checkpoint (última CURP
+completa + offset del archivo) para poder reanudar con --resume.
+
+Uso:
+    ./manage.py lms llavemx_curp_report --output /tmp/curps.csv
+    ./manage.py lms llavemx_curp_report --output /tmp/curps.jsonl --resume
+"""
+
+import csv
+import io
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from oauth2_llavemx.models import GENERIC_CURP, CurpIndex
+
+MAX_USER_IDS = 20
+FIELDS = ["curp", "category", "total_accounts", "active_accounts", "user_ids"]
+
+
+class Command(BaseCommand):
+    help = "Reporta CURPs ambiguas, solo-inactivas y genéricas sin cargar la tabla en memoria."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", required=True, help="Archivo .csv o .jsonl de salida.")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Default: según la extensión.")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--checkpoint", help="Default: <output>.checkpoint")
+        parser.add_argument("--resume", action="store_true", help="Continúa desde el checkpoint.")
+        parser.add_argument("--skip-count", action="store_true", help="No calcula el total de filas.")
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        fmt = options["format"] or ("jsonl" if output.endswith(".jsonl") else "csv")
+        chunk_size = options["chunk_size"]
+        checkpoint_path = options["checkpoint"] or f"{output}.checkpoint"
+
+        state = {"last_curp": None, "offset": 0, "rows": 0, "reported": 0}
+        if options["resume"]:
+            if not os.path.exists(checkpoint_path):
+                raise CommandError(f"No existe checkpoint en {checkpoint_path}")
+            with open(checkpoint_path, encoding="utf-8") as fh:
+                state.update(json.load(fh))
+
+        qs = CurpIndex.objects.order_by("curp", "extra_info_id")
+        if state["last_curp"] is not None:
+            qs = qs.filter(curp__gt=state["last_curp"])
+
+        total = None if options["skip_count"] else state["rows"] + qs.count()
+
+        mode = "r+" if options["resume"] and os.path.exists(output) else "w"
+        with open(output, mode, encoding="utf-8", newline="") as out:
+            # Descarta lo que se haya escrito después del último checkpoint.
+            out.seek(state["offset"])
+            out.truncate()
+            if fmt == "csv" and state["offset"] == 0:
+                csv.writer(out).writerow(FIELDS)
+
+            self._run(qs, out, fmt, chunk_size, checkpoint_path, state, total)
+
+        self.stderr.write("")
+        self.stdout.write(
+            f"[LlaveMX] Reporte terminado: {state['rows']} filas, "
+            f"{state['reported']} CURPs reportadas -> {output}"
+        )
+
+    def _run(self, qs, out, fmt, chunk_size, checkpoint_path, state, total):
+        rows = self._rows(qs, chunk_size)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == "csv" else None
+        group = None
+        pending = 0
+        started = (time.monotonic(), state["rows"])
+
+        for curp, _, user_id, is_active in rows:
+            if group is None or group["curp"] != curp:
+                if group is not None:
+                    self._close_group(group, buffer, writer, state)
+                group = {"curp": curp, "total": 0, "active": 0, "user_ids": []}
+
+            group["total"] += 1
+            group["active"] += 1 if is_active else 0
+            if len(group["user_ids"]) < MAX_USER_IDS:
+                group["user_ids"].append(user_id)
+
+            pending += 1
+            if pending >= chunk_size:
+                self._flush(out, buffer, checkpoint_path, state)
+                self._progress(state, total, started)
+                pending = 0
+
+        if group is not None:
+            self._close_group(group, buffer, writer, state)
+        self._flush(out, buffer, checkpoint_path, state)
+        self._progress(state, total, started)
+
+    def _rows(self, qs, chunk_size):
+        """
+        Filas (curp, extra_info_id, user_id, is_active) en orden, una página
+        de chunk_size a la vez. El cursor incluye extra_info_id porque una
+        CURP puede repetirse en el límite de la página.
+        """
+        cursor = None
+        while True:
+            page = qs
+            if cursor is not None:
+                curp, pk = cursor
+                page = page.filter(Q(curp__gt=curp) | Q(curp=curp, extra_info_id__gt=pk))
+            rows = list(page.values_list("curp", "extra_info_id", "user_id", "user__is_active")[:chunk_size])
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            cursor = rows[-1][0], rows[-1][1]
+
+    def _close_group(self, group, buffer, writer, state):
+        state["reported"] += self._emit(group, buffer, writer)
+        state["rows"] += group["total"]
+        state["last_curp"] = group["curp"]
+
+    def _classify(self, group):
+        if group["curp"] == GENERIC_CURP:
+            return "generic"
+        if group["active"] > 1:
+            return "ambiguous"
+        if group["active"] == 0 and group["total"] > 1:
+            return "inactive_only"
+        return None
+
+    def _emit(self, group, buffer, writer):
+        category = self._classify(group)
+        if category is None:
+            return 0
+
+        if writer is not None:
+            writer.writerow([
+                group["curp"],
+                category,
+                group["total"],
+                group["active"],
+                ";".join(str(uid) for uid in group["user_ids"]),
+            ])
+        else:
+            buffer.write(json.dumps({
+                "curp": group["curp"],
+                "category": category,
+                "total_accounts": group["total"],
+                "active_accounts": group["active"],
+                "user_ids": group["user_ids"],
+            }))
+            buffer.write("\n")
+        return 1
+
+    def _flush(self, out, buffer, checkpoint_path, state):
+        out.write(buffer.getvalue())
+        out.flush()
+        os.fsync(out.fileno())
+        buffer.seek(0)
+        buffer.truncate()
+
+        state["offset"] = out.tell()
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+        os.replace(tmp_path, checkpoint_path)
+
+    def _progress(self, state, total, started):
+        started_at, started_rows = started
+        elapsed = max(time.monotonic() - started_at, 1e-6)
+        done = f"{state['rows']}/{total}" if total else str(state["rows"])
+        self.stderr.write(
+            f"\r[LlaveMX] filas {done} | reportadas {state['reported']} | "
+            f"{int((state['rows'] - started_rows) / elapsed)} filas/s",
+            ending="",
+        )
+        self.stderr.flush()
@@ -0,0 +1,67 @@
+"""
+Refresco por lotes de los access tokens LlaveMX por vencer.
+
+Recorre UserSocialAuth (provider=llavemx) por páginas de pk, refresca
+en paralelo los tokens que vencen dentro de --margin segundos y guarda cada
+token nuevo solo si la cuenta no recibió otro mientras tanto (un login no se
+pisa). Usa los mismos candados que el refresco en línea, de modo que puede
+correr junto a los workers del LMS.
+
+Uso (p. ej. desde cron cada pocos minutos):
+    ./manage.py lms llavemx_refresh_tokens --margin 300
+    ./manage.py lms llavemx_refresh_tokens --dry-run
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from oauth2_llavemx.tokens import (
+    DEFAULT_REFRESH_BATCH_SIZE,
+    DEFAULT_REFRESH_MARGIN,
+    DEFAULT_REFRESH_WORKERS,
+    refresh_expiring,
+)
+
+
+class Command(BaseCommand):
+    help = "Refresca los access tokens LlaveMX que están por vencer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--margin", type=int, default=DEFAULT_REFRESH_MARGIN, help="Segundos antes del vencimiento.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_REFRESH_BATCH_SIZE)
+        parser.add_argument("--workers", type=int, default=DEFAULT_REFRESH_WORKERS, help="Llamadas simultáneas al WS.")
+        parser.add_argument("--limit", type=int, help="Máximo de tokens a refrescar en esta corrida.")
+        parser.add_argument("--dry-run", action="store_true", help="Solo cuenta los tokens por vencer.")
+
+    def handle(self, *args, **options):
+        from social_django.utils import load_strategy
+
+        from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+        backend = LlaveMXOAuth2(strategy=load_strategy())
+        started = time.monotonic()
+
+        stats = refresh_expiring(
+            backend,
+            margin=options["margin"],
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            limit=options["limit"],
+            dry_run=options["dry_run"],
+            progress=self._progress,
+        )
+
+        self.stderr.write("")
+        self.stdout.write(
+            f"[LlaveMX] Refresco terminado en {time.monotonic() - started:.1f}s: "
+            + ", ".join(f"{name} {value}" for name, value in stats.items())
+        )
+
+    def _progress(self, stats):
+        self.stderr.write(
+            f"\r[LlaveMX] revisadas {stats['scanned']} | por vencer {stats['due']} | "
+            f"refrescadas {stats['refreshed']} | fallidas {stats['failed']}",
+            ending="",
+        )
+        self.stderr.flush()
@@ -0,0 +1,114 @@
+"""
+Cierre masivo de sesiones LlaveMX (incidentes de seguridad, migraciones).
+
+Recorre UserSocialAuth (provider=llavemx) por páginas de pk, llama
+/cerrarSesion con el access_token de extra_data en un pool de hilos acotado
+(--workers) y con una tasa máxima (--rate llamadas/s), y elimina de
+extra_data los tokens revocados (solo si la fila sigue guardando ese token).
+
+Al terminar cada lote se escribe un checkpoint (último pk procesado y
+contadores); --resume continúa desde ahí. Las cuentas que fallaron por red
+conservan su token: una corrida nueva sin --resume solo las reintenta a ellas.
+
+Uso:
+    ./manage.py lms llavemx_revoke_sessions --workers 16 --rate 40
+    ./manage.py lms llavemx_revoke_sessions --resume --noinput
+    ./manage.py lms llavemx_revoke_sessions --dry-run
+"""
+
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from oauth2_llavemx.revocation import (
+    DEFAULT_BULK_BATCH_SIZE,
+    DEFAULT_BULK_RATE,
+    DEFAULT_BULK_WORKERS,
+    revoke_all,
+)
+
+DEFAULT_CHECKPOINT = "llavemx_revoke_sessions.checkpoint"
+
+
+class Command(BaseCommand):
+    help = "Cierra en LlaveMX las sesiones de todas las cuentas con access token guardado."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=DEFAULT_BULK_WORKERS, help="Llamadas simultáneas al WS.")
+        parser.add_argument("--rate", type=float, default=DEFAULT_BULK_RATE, help="Llamadas/s máximas (0 = sin límite).")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BULK_BATCH_SIZE)
+        parser.add_argument("--limit", type=int, help="Máximo de cuentas a revocar en esta corrida.")
+        parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+        parser.add_argument("--resume", action="store_true", help="Continúa desde el checkpoint.")
+        parser.add_argument("--dry-run", action="store_true", help="Solo cuenta las cuentas con token.")
+        parser.add_argument("--noinput", "--no-input", action="store_false", dest="interactive")
+
+    def handle(self, *args, **options):
+        from social_django.utils import load_strategy
+
+        from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+        backend = LlaveMXOAuth2(strategy=load_strategy())
+        checkpoint_path = options["checkpoint"]
+        dry_run = options["dry_run"]
+
+        after_pk = None
+        if options["resume"]:
+            if not os.path.exists(checkpoint_path):
+                raise CommandError(f"No existe checkpoint en {checkpoint_path}")
+            with open(checkpoint_path, encoding="utf-8") as fh:
+                after_pk = json.load(fh)["last_pk"]
+
+        if not dry_run:
+            # Sin credenciales WS todas las llamadas fallarían igual.
+            try:
+                backend._basic_auth()
+            except Exception as e:
+                raise CommandError(str(e))
+            if options["interactive"]:
+                answer = input("Se cerrarán las sesiones LlaveMX de todas las cuentas. Escribe 'si' para continuar: ")
+                if answer.strip().lower() not in ("si", "sí"):
+                    raise CommandError("Cancelado.")
+
+        started = time.monotonic()
+
+        def progress(stats, last_pk):
+            if not dry_run:
+                self._checkpoint(checkpoint_path, stats, last_pk)
+            self._progress(stats, started)
+
+        stats = revoke_all(
+            backend,
+            workers=options["workers"],
+            rate=options["rate"],
+            batch_size=options["batch_size"],
+            after_pk=after_pk,
+            limit=options["limit"],
+            dry_run=dry_run,
+            progress=progress,
+        )
+
+        self.stderr.write("")
+        self.stdout.write(
+            f"[LlaveMX] Cierre de sesiones terminado en {time.monotonic() - started:.1f}s: "
+            + ", ".join(f"{name} {value}" for name, value in stats.items())
+        )
+
+    def _checkpoint(self, path, stats, last_pk):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump({"last_pk": last_pk, "stats": stats}, fh)
+        os.replace(tmp_path, path)
+
+    def _progress(self, stats, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        done = stats["revoked"] + stats["rejected"] + stats["failed"]
+        self.stderr.write(
+            f"\r[LlaveMX] revisadas {stats['scanned']} | con token {stats['with_token']} | "
+            f"revocadas {stats['revoked']} | rechazadas {stats['rejected']} | fallidas {stats['failed']} | "
+            f"{done / elapsed:.1f}/s",
+            ending="",
+        )
+        self.stderr.flush()
@@ -0,0 +1,237 @@
+"""
+Métricas de las llamadas salientes a LlaveMX.
+
+Por endpoint (token, user_data, roles, logout):
+- latencia (histograma, segundos)
+- respuestas por status HTTP ("200", "503", "network", "circuit_open", "rejected")
+- errores por tipo, con un conjunto fijo de etiquetas (ERROR_LABELS):
+  "invalid_token" (código del body), "http_4xx", "http_5xx", "timeout",
+  "network" y "other". El texto que manda LlaveMX nunca llega a una
+  etiqueta ni al nombre de una métrica.
+- llamadas en vuelo (gauge)
+
+SOCIAL_AUTH_LLAVEMX_METRICS:
+- "auto" (default): Prometheus si prometheus_client está instalado; si no,
+  statsd si SOCIAL_AUTH_LLAVEMX_STATSD_HOST está definido; si no, no-op.
+- "prometheus", "statsd", "none" o la ruta punteada de una clase sink propia.
+
+Por paso del pipeline (opt-in, ver profiling.py):
+- duración (histograma, segundos), consultas a la base y resultado
+  ("ok", "halt", "error")
+
+Con el sink no-op el costo por llamada es un atributo leído (sink.enabled).
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+from urllib.error import HTTPError, URLError
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATSD_PORT = 8125
+DEFAULT_STATSD_PREFIX = "llavemx"
+
+ERROR_LABELS = frozenset(("invalid_token", "http_4xx", "http_5xx", "timeout", "network", "other"))
+
+_TIMEOUT_ERRORS = (socket.timeout, TimeoutError, asyncio.TimeoutError)
+
+
+def error_label(error=None, code=None):
+    """
+    Etiqueta acotada de un error: el código del body solo se reconoce si es
+    "invalid_token"; si no, cuenta el status HTTP o el tipo de error de red.
+    """
+    if code == "invalid_token":
+        return "invalid_token"
+    if isinstance(error, HTTPError):
+        return "http_4xx" if error.code < 500 else "http_5xx"
+    reason = error.reason if isinstance(error, URLError) else error
+    if isinstance(reason, _TIMEOUT_ERRORS):
+        return "timeout"
+    if isinstance(reason, OSError):
+        return "network"
+    return "other"
+
+
+def _error(error):
+    # Defensa para llamadas externas: nada fuera del conjunto fijo.
+    return error if error in ERROR_LABELS else "other"
+
+
+class NullSink:
+    enabled = False
+
+    def observe_latency(self, endpoint, seconds):
+        pass
+
+    def count_status(self, endpoint, status):
+        pass
+
+    def count_error(self, endpoint, error):
+        pass
+
+    def in_flight(self, endpoint, delta):
+        pass
+
+    def observe_step(self, step, seconds, queries, outcome):
+        pass
+
+
+class PrometheusSink(NullSink):
+    enabled = True
+
+    def __init__(self):
+        from prometheus_client import Counter, Gauge, Histogram
+
+        self.latency = Histogram(
+            "llavemx_ws_latency_seconds",
+            "Latencia de las llamadas a los WS de LlaveMX.",
+            ["endpoint"],
+            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+        )
+        self.responses = Counter(
+            "llavemx_ws_responses_total",
+            "Respuestas de los WS de LlaveMX por status.",
+            ["endpoint", "status"],
+        )
+        self.errors = Counter(
+            "llavemx_ws_errors_total",
+            "Errores de los WS de LlaveMX por tipo (ERROR_LABELS).",
+            ["endpoint", "error"],
+        )
+        self.inflight = Gauge(
+            "llavemx_ws_in_flight",
+            "Llamadas a los WS de LlaveMX en curso.",
+            ["endpoint"],
+        )
+        self.step_latency = Histogram(
+            "llavemx_pipeline_step_seconds",
+            "Duración de cada paso del pipeline en logins LlaveMX.",
+            ["step"],
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+        )
+        self.step_queries = Counter(
+            "llavemx_pipeline_step_queries_total",
+            "Consultas a la base por paso del pipeline.",
+            ["step"],
+        )
+        self.step_outcomes = Counter(
+            "llavemx_pipeline_steps_total",
+            "Pasos del pipeline ejecutados por resultado.",
+            ["step", "outcome"],
+        )
+
+    def observe_latency(self, endpoint, seconds):
+        self.latency.labels(endpoint).observe(seconds)
+
+    def count_status(self, endpoint, status):
+        self.responses.labels(endpoint, str(status)).inc()
+
+    def count_error(self, endpoint, error):
+        self.errors.labels(endpoint, _error(error)).inc()
+
+    def in_flight(self, endpoint, delta):
+        self.inflight.labels(endpoint).inc(delta)
+
+    def observe_step(self, step, seconds, queries, outcome):
+        self.step_latency.labels(step).observe(seconds)
+        self.step_queries.labels(step).inc(queries)
+        self.step_outcomes.labels(step, outcome).inc()
+
+
+class StatsdSink(NullSink):
+    """Cliente statsd mínimo por UDP (sin dependencias, nunca bloquea)."""
+
+    enabled = True
+
+    def __init__(self, host, port=DEFAULT_STATSD_PORT, prefix=DEFAULT_STATSD_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def _send(self, metric):
+        try:
+            self._sock.sendto(f"{self.prefix}.{metric}".encode("utf-8"), self.address)
+        except OSError:
+            pass
+
+    def observe_latency(self, endpoint, seconds):
+        self._send(f"ws.{endpoint}.latency:{seconds * 1000:.3f}|ms")
+
+    def count_status(self, endpoint, status):
+        self._send(f"ws.{endpoint}.status.{status}:1|c")
+
+    def count_error(self, endpoint, error):
+        self._send(f"ws.{endpoint}.error.{_error(error)}:1|c")
+
+    def in_flight(self, endpoint, delta):
+        self._send(f"ws.{endpoint}.in_flight:{delta:+d}|g")
+
+    def observe_step(self, step, seconds, queries, outcome):
+        self._send(f"pipeline.{step}.latency:{seconds * 1000:.3f}|ms")
+        self._send(f"pipeline.{step}.queries:{queries}|c")
+        self._send(f"pipeline.{step}.{outcome}:1|c")
+
+
+def _statsd_sink():
+    host = getattr(settings, "SOCIAL_AUTH_LLAVEMX_STATSD_HOST", None)
+    if not host:
+        return None
+    return StatsdSink(
+        host,
+        getattr(settings, "SOCIAL_AUTH_LLAVEMX_STATSD_PORT", DEFAULT_STATSD_PORT),
+        getattr(settings, "SOCIAL_AUTH_LLAVEMX_STATSD_PREFIX", DEFAULT_STATSD_PREFIX),
+    )
+
+
+_prometheus_sink = None
+
+
+def _get_prometheus_sink():
+    # Los colectores de Prometheus solo se pueden registrar una vez por proceso.
+    global _prometheus_sink
+    if _prometheus_sink is None:
+        _prometheus_sink = PrometheusSink()
+    return _prometheus_sink
+
+
+def _build_sink(kind):
+    if kind in (None, "none"):
+        return NullSink()
+    if kind == "prometheus":
+        return _get_prometheus_sink()
+    if kind == "statsd":
+        return _statsd_sink() or NullSink()
+    if kind == "auto":
+        try:
+            return _get_prometheus_sink()
+        except ImportError:
+            return _statsd_sink() or NullSink()
+    return import_string(kind)()
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def get_metrics_sink():
+    """Sink del proceso para el valor actual de SOCIAL_AUTH_LLAVEMX_METRICS."""
+    kind = getattr(settings, "SOCIAL_AUTH_LLAVEMX_METRICS", "auto")
+    sink = _sinks.get(kind)
+    if sink is None:
+        with _sinks_lock:
+            sink = _sinks.get(kind)
+            if sink is None:
+                try:
+                    sink = _build_sink(kind)
+                except Exception:
+                    logger.exception("[LlaveMX] No se pudo crear el sink de métricas %s", kind)
+                    sink = NullSink()
+                _sinks[kind] = sink
+    return sink
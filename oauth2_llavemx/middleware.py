@@ -0,0 +1,35 @@
+"""
+Cookie indicadora de llavemx_details.
+
+El pipeline marca el request cuando guarda details (details.store_details) y
+este middleware pone la cookie DETAILS_COOKIE en la respuesta; el fallback del
+MFE la usa como señal barata antes de cargar la sesión. La cookie no contiene
+datos, solo "1", y se borra cuando los details ya no existen.
+"""
+
+from django.conf import settings
+
+from oauth2_llavemx.details import DETAILS_COOKIE, REQUEST_FLAG
+
+
+class LlaveMXDetailsFlagMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        flag = getattr(request, REQUEST_FLAG, None)
+        if flag is True:
+            response.set_cookie(
+                DETAILS_COOKIE,
+                "1",
+                max_age=settings.SESSION_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+        elif flag is False:
+            response.delete_cookie(DETAILS_COOKIE, samesite=settings.SESSION_COOKIE_SAMESITE)
+        return response
@@ -0,0 +1,56 @@
+from django.apps import apps as global_apps
+from django.db import migrations
+
+BATCH_SIZE = 5000
+
+
+def backfill_curp_index(apps, schema_editor):
+    """Llena CurpIndex desde ExtraInfo en lotes, sin cargar la tabla en memoria."""
+    try:
+        ExtraInfo = apps.get_model("custom_reg_form", "ExtraInfo")
+    except LookupError:
+        # custom_reg_form no está instalado: no hay nada que indexar.
+        return
+
+    CurpIndex = apps.get_model("oauth2_llavemx", "CurpIndex")
+
+    qs = (
+        ExtraInfo.objects
+        .exclude(curp__isnull=True)
+        .exclude(curp="")
+        .exclude(user_id__isnull=True)
+        .order_by("pk")
+    )
+
+    # Páginas por pk en lugar de iterator(): en MySQL no hace streaming.
+    last_pk = None
+    while True:
+        page = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+        rows = list(page.values_list("pk", "curp", "user_id")[:BATCH_SIZE])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        batch = [
+            CurpIndex(extra_info_id=pk, curp=curp.strip().upper(), user_id=user_id)
+            for pk, curp, user_id in rows
+            if curp.strip()
+        ]
+        CurpIndex.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    # Tablas de millones de filas: cada lote se confirma por separado y
+    # ignore_conflicts permite volver a correr el backfill sin duplicados.
+    atomic = False
+
+    dependencies = [
+        ("oauth2_llavemx", "0001_initial"),
+    ]
+
+    if global_apps.is_installed("custom_reg_form"):
+        dependencies.append(("custom_reg_form", "__first__"))
+
+    operations = [
+        migrations.RunPython(backfill_curp_index, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.db import models
+
+# CURP genérico de extranjeros / sin CURP: nunca se usa para asociar cuentas.
+GENERIC_CURP = "XEXX010101HDFXXX04"
+
+
+def normalize_curp(value):
+    """Forma canónica de la CURP para búsquedas exactas indexadas."""
+    return (value or "").strip().upper()
+
+
+class CurpIndex(models.Model):
+    """
+    Índice normalizado de custom_reg_form.ExtraInfo.curp.
+
+    Una fila por ExtraInfo con usuario, con la CURP ya normalizada, para que
+    associate_by_curp encuentre candidatos por índice exacto en lugar de un
+    curp__iexact (UPPER()) sobre ExtraInfo. Solo es una pista: cada candidato
+    se vuelve a comparar con su ExtraInfo antes de asociar. Se mantiene en sync con señales
+    de ExtraInfo (ver signals.py), la migración 0002 hace el backfill y el
+    comando llavemx_curp_index lo resincroniza.
+    """
+
+    extra_info_id = models.BigIntegerField(primary_key=True)
+    curp = models.CharField(max_length=64, db_index=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+
+    def __str__(self):
+        return f"{self.curp} -> {self.user_id}"
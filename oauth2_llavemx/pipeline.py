@@ -1,6 +1,22 @@
 import logging
 
 from django.contrib.auth import get_user_model
+from django.db.models import Q
+from social_core.pipeline.social_auth import load_extra_data as social_load_extra_data
+from social_core.utils import module_member
+
+from oauth2_llavemx.audit import (
+    CURP_AMBIGUOUS,
+    CURP_ASSOCIATED,
+    CURP_ASSOCIATED_INACTIVE,
+    CURP_GENERIC,
+    CURP_INCONCLUSIVE,
+    CURP_LOOKUP,
+    audit,
+)
+from oauth2_llavemx.details import store_details
+from oauth2_llavemx.fields import get_field_schema
+from oauth2_llavemx.models import GENERIC_CURP, CurpIndex, normalize_curp
 
 try:
     from custom_reg_form.models import ExtraInfo
@@ -10,10 +26,19 @@ except Exception:
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# Huella del perfil en UserSocialAuth.extra_data, bandera para los pasos
+# posteriores del pipeline y huella pendiente de guardar (save_profile_fp).
+PROFILE_FP_KEY = "profile_fp"
+PROFILE_UNCHANGED = "llavemx_profile_unchanged"
+PROFILE_FP_PENDING = "llavemx_profile_fp"
+
 
 def associate_by_curp(backend, details, user=None, *args, **kwargs):
     """
     Asociación por CURP SOLO para LlaveMX.
+    CurpIndex solo sirve para encontrar candidatos; la decisión se toma con
+    ExtraInfo (ver _curp_users), así que un índice desactualizado no asocia
+    con una cuenta cuya CURP ya cambió.
     Reglas:
     - No tocar si ya hay user
     - Ignorar CURP genérico
@@ -27,85 +52,85 @@ def associate_by_curp(backend, details, user=None, *args, **kwargs):
     if backend_name != "llavemx":
         return {"user": user}
 
+    # Si ya hay usuario (cuenta ya vinculada), no reasociar
+    if user is not None:
+        return {"user": user}
+
     # Seguridad defensiva
     if ExtraInfo is None:
         logger.error("[LlaveMX] ExtraInfo no disponible. Se omite CURP.")
         return {"user": user}
 
-    # Si ya hay usuario, no reasociar
-    if user is not None:
-        return {"user": user}
-
     details = details or {}
     curp = details.get("curp")
 
-    logger.warning(
-        "[LlaveMX][DEBUG] associate_by_curp curp=%s",
-        curp,
-    )
+    audit(CURP_LOOKUP, curp=curp)
 
     # Sin CURP → no asociar
     if not curp:
         return {"user": None}
 
     # CURP genérico → NO asociar
-    if curp.upper() == "XEXX010101HDFXXX04":
-        logger.warning("[LlaveMX] CURP genérico detectado. Asociación bloqueada.")
+    curp = normalize_curp(curp)
+    if curp == GENERIC_CURP:
+        audit(CURP_GENERIC, result="bloqueada")
         return {"user": None}
 
-    # Buscar coincidencias
-    matches = (
-        ExtraInfo.objects
-        .filter(curp__iexact=curp)
-        .select_related("user")
-    )
+    users = _curp_users(curp)
 
-    if not matches.exists():
+    if not users:
         return {"user": None}
 
-    # Extraer usuarios válidos
-    users = [ei.user for ei in matches if ei.user]
-
     # Filtrar activos
     active_users = [u for u in users if u.is_active]
 
     # 🔴 Caso peligroso: más de una cuenta activa
     if len(active_users) > 1:
-        logger.error(
-            "[LlaveMX][BLOCKED] CURP duplicado con múltiples cuentas activas. "
-            "Asociación automática cancelada. curp=%s users=%s",
-            curp,
-            [u.id for u in active_users],
-        )
+        audit(CURP_AMBIGUOUS, curp=curp, user_ids=[u.id for u in active_users], result="cancelada")
         return {"user": None}
 
     # ✅ Caso seguro: exactamente una activa
     if len(active_users) == 1:
-        u = active_users[0]
-        logger.warning(
-            "[LlaveMX] Asociación por CURP exitosa. user_id=%s",
-            u.id,
-        )
-        return {"user": u}
+        audit(CURP_ASSOCIATED, user_id=active_users[0].id)
+        return {"user": active_users[0]}
 
     # 🟡 Caso raro: ninguno activo, pero solo uno total
     if len(users) == 1:
-        u = users[0]
-        logger.warning(
-            "[LlaveMX] Asociación por CURP con cuenta inactiva. user_id=%s",
-            u.id,
-        )
-        return {"user": u}
+        audit(CURP_ASSOCIATED_INACTIVE, user_id=users[0].id)
+        return {"user": users[0]}
 
     # Todo lo demás → no asociar
-    logger.warning(
-        "[LlaveMX] Asociación por CURP no concluyente. curp=%s total_users=%s",
-        curp,
-        len(users),
-    )
+    audit(CURP_INCONCLUSIVE, curp=curp, total_users=len(users))
     return {"user": None}
 
 
+def _curp_users(curp):
+    """
+    Usuarios cuya ExtraInfo tiene hoy la CURP (ya normalizada), en una consulta.
+
+    CurpIndex es una copia que solo mantienen las señales: QuerySet.update(),
+    bulk_update(), SQL directo o un worker sin las señales la dejan atrás.
+    Por eso los candidatos salen del índice O de ExtraInfo.curp exacta (la
+    forma en que se guarda normalmente) y cada uno se vuelve a comparar con
+    su ExtraInfo.curp normalizada. Una entrada vieja del índice se descarta,
+    y un duplicado que el índice no conoce sigue contando como ambigüedad.
+    Solo un duplicado fuera del índice y guardado con otra forma (minúsculas,
+    espacios) necesita el comando llavemx_curp_index para verse.
+    """
+    indexed = CurpIndex.objects.filter(curp=curp).values("extra_info_id")
+    rows = (
+        ExtraInfo.objects
+        .filter(Q(pk__in=indexed) | Q(curp=curp))
+        .select_related("user")
+        .order_by("user_id")
+    )
+    users = {}
+    for extra_info in rows:
+        if extra_info.user is not None and normalize_curp(extra_info.curp) == curp:
+            users[extra_info.user_id] = extra_info.user
+    return list(users.values())
+
+
 def preserve_llavemx_details(backend, details=None, *args, **kwargs):
     """
     Asegura que los datos completos de LlaveMX (details) lleguen al MFE.
@@ -113,7 +138,8 @@ def preserve_llavemx_details(backend, details=None, *args, **kwargs):
     - Solo aplica cuando el backend es LlaveMX.
     - Reinyecta `details` en kwargs para que queden en el partial pipeline
       y sean expuestos como `pipeline_user_details` en el endpoint de TPA.
-    - Además los persiste en sesión (llavemx_details) como fallback para el MFE.
+    - Además los persiste compactados como fallback para el MFE: en sesión
+      (llavemx_details) o, con DETAILS_STORAGE = "cache", en el cache (ver details.py).
     """
     backend_name = getattr(backend, "name", None)
     if backend_name != "llavemx":
@@ -123,10 +149,103 @@ def preserve_llavemx_details(backend, details=None, *args, **kwargs):
     details = details or {}
     kwargs["details"] = details
 
-    # Persistir en sesión como respaldo para MFE
+    # Persistir como respaldo para MFE
     try:
-        backend.strategy.session_set("llavemx_details", details)
+        store_details(backend, details)
     except Exception:
         logger.exception("[LlaveMX] No se pudo guardar llavemx_details en sesión.")
 
     return {"details": details}
+
+
+def load_extra_data(backend, details, response, uid, user=None, *args, **kwargs):
+    """
+    Reemplazo de social_core.pipeline.social_auth.load_extra_data.
+
+    Para LlaveMX compara una huella del perfil normalizado con la guardada
+    en extra_data. Si no cambió, solo se escriben los campos de sesión
+    (tokens, expires_in, auth_time) y se marca el perfil como sin cambios
+    para que los pasos de sincronización del usuario se omitan. Si cambió,
+    la huella nueva NO se guarda aquí: la guarda save_profile_fp al final,
+    cuando user_details / user_details_force_sync ya terminaron. Si alguno
+    falla o el pipeline se detiene antes, el siguiente login sincroniza otra vez.
+    El UPDATE toca solo la columna extra_data.
+    Otros backends usan el paso original.
+    """
+    if getattr(backend, "name", None) != "llavemx":
+        return social_load_extra_data(backend, details, response, uid, user, *args, **kwargs)
+
+    social = kwargs.get("social") or backend.strategy.storage.user.get_social_auth(backend.name, uid)
+    if not social:
+        return {}
+
+    schema = get_field_schema(backend)
+    profile_fp = schema.fingerprint(details or {})
+    data = backend.extra_data(user, uid, response, details or {}, kwargs)
+    current = social.extra_data if isinstance(social.extra_data, dict) else {}
+
+    unchanged = current.get(PROFILE_FP_KEY) == profile_fp
+    if unchanged:
+        data = {key: value for key, value in data.items() if key not in schema.extra_names}
+
+    merged = schema.merge_extra_data(current, data)
+    if merged != current:
+        social.extra_data = merged
+        social.save(update_fields=_social_update_fields(social))
+
+    if unchanged:
+        return {PROFILE_UNCHANGED: True}
+    return {PROFILE_UNCHANGED: False, PROFILE_FP_PENDING: profile_fp}
+
+
+def save_profile_fp(backend, social=None, *args, **kwargs):
+    """
+    Guarda la huella del perfil que load_extra_data dejó pendiente. La
+    AppConfig lo coloca después del último paso de sincronización del
+    perfil, así que solo corre si todos terminaron bien.
+    """
+    profile_fp = kwargs.get(PROFILE_FP_PENDING)
+    if getattr(backend, "name", None) != "llavemx" or social is None or not profile_fp:
+        return {}
+    if not isinstance(social.extra_data, dict):
+        social.extra_data = {}
+    if social.extra_data.get(PROFILE_FP_KEY) != profile_fp:
+        social.extra_data[PROFILE_FP_KEY] = profile_fp
+        social.save(update_fields=_social_update_fields(social))
+    return {}
+
+
+def _social_update_fields(social):
+    # UserSocialAuth.modified (auto_now) solo se actualiza si se incluye.
+    if any(field.name == "modified" for field in social._meta.concrete_fields):
+        return ["extra_data", "modified"]
+    return ["extra_data"]
+
+
+def _unless_profile_unchanged(path):
+    """Paso que delega en `path` salvo que el perfil LlaveMX no haya cambiado."""
+
+    def step(*args, **kwargs):
+        if kwargs.get(PROFILE_UNCHANGED):
+            return {}
+        return module_member(path)(*args, **kwargs)
+
+    step.__name__ = path.rsplit(".", 1)[-1]
+    step.__doc__ = f"{path}, omitido si el perfil LlaveMX no cambió desde el último login."
+    return step
+
+
+# Pasos que solo copian el perfil del proveedor al usuario (con
+# PROFILE_FAST_PATH la AppConfig los sustituye en SOCIAL_AUTH_PIPELINE por
+# estas versiones y agrega SAVE_PROFILE_FP_STEP después del último).
+SAVE_PROFILE_FP_STEP = "oauth2_llavemx.pipeline.save_profile_fp"
+PROFILE_SYNC_STEPS = {
+    "social_core.pipeline.social_auth.load_extra_data": "oauth2_llavemx.pipeline.load_extra_data",
+    "social_core.pipeline.user.user_details": "oauth2_llavemx.pipeline.user_details",
+    "common.djangoapps.third_party_auth.pipeline.user_details_force_sync":
+        "oauth2_llavemx.pipeline.user_details_force_sync",
+}
+user_details = _unless_profile_unchanged("social_core.pipeline.user.user_details")
+user_details_force_sync = _unless_profile_unchanged(
+    "common.djangoapps.third_party_auth.pipeline.user_details_force_sync"
+)
@@ -0,0 +1,130 @@
+"""
+Perfilado por paso del SOCIAL_AUTH_PIPELINE (opt-in).
+
+Con SOCIAL_AUTH_LLAVEMX_PIPELINE_PROFILE = True la AppConfig envuelve cada
+paso del pipeline (se reemplaza el atributo en su módulo, como hace
+module_member() al resolverlo) con un temporizador que, solo en logins
+LlaveMX, registra por paso:
+
+- tiempo de pared,
+- consultas a la base (connection.execute_wrapper),
+- resultado: "ok", "halt" (el paso regresó una respuesta, p. ej. un partial)
+  o "error" (excepción).
+
+Cada paso se envía al sink de métricas (metrics.py). Al terminar el tramo
+del pipeline, si el total supera SOCIAL_AUTH_LLAVEMX_PIPELINE_SLOW_MS se
+escribe el desglose en el log, muestreado con
+SOCIAL_AUTH_LLAVEMX_PIPELINE_SLOW_SAMPLE (fracción de logins lentos).
+"""
+
+import functools
+import logging
+import random
+import time
+from importlib import import_module
+
+from django.db import connection
+
+from oauth2_llavemx.metrics import get_metrics_sink
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_MS = 1000
+DEFAULT_SLOW_SAMPLE = 1.0
+
+# Atributo del backend (uno por request) donde se acumulan los pasos.
+_PROFILE_ATTR = "_llavemx_pipeline_profile"
+
+
+class _QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class PipelineProfiler:
+
+    def __init__(self, slow_ms=DEFAULT_SLOW_MS, sample_rate=DEFAULT_SLOW_SAMPLE):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+
+    def wrap(self, path, func):
+        label = path.rsplit(".", 1)[-1]
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            backend = kwargs.get("backend")
+            if getattr(backend, "name", None) != "llavemx":
+                return func(*args, **kwargs)
+
+            counter = _QueryCounter()
+            outcome = "error"
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(counter):
+                    result = func(*args, **kwargs)
+                outcome = "ok" if result is None or isinstance(result, dict) else "halt"
+                return result
+            finally:
+                elapsed = time.perf_counter() - started
+                self._record(backend, kwargs.get("pipeline_index"), path, label, elapsed, counter.count, outcome)
+
+        timed.llavemx_profiled = True
+        return timed
+
+    def _record(self, backend, index, path, label, seconds, queries, outcome):
+        sink = get_metrics_sink()
+        if sink.enabled:
+            sink.observe_step(label, seconds, queries, outcome)
+
+        steps = getattr(backend, _PROFILE_ATTR, None)
+        if steps is None:
+            steps = []
+            setattr(backend, _PROFILE_ATTR, steps)
+        steps.append((path, seconds, queries, outcome))
+
+        # El tramo termina con el último paso, un partial o una excepción.
+        if outcome == "ok" and index is not None and index < len(backend.strategy.get_pipeline(backend)) - 1:
+            return
+        setattr(backend, _PROFILE_ATTR, None)
+        self._report(steps)
+
+    def _report(self, steps):
+        total_ms = sum(seconds for _, seconds, _, _ in steps) * 1000
+        if total_ms < self.slow_ms or random.random() >= self.sample_rate:
+            return
+        logger.warning(
+            "[LlaveMX] Login lento: %.1f ms, %d consultas en %d pasos: %s",
+            total_ms,
+            sum(queries for _, _, queries, _ in steps),
+            len(steps),
+            "; ".join(
+                f"{path}={seconds * 1000:.1f}ms/{queries}q/{outcome}"
+                for path, seconds, queries, outcome in steps
+            ),
+        )
+
+
+def install_pipeline_profiler(pipeline, profiler):
+    """
+    Envuelve en su módulo cada paso de `pipeline`. Regresa los pasos
+    envueltos; los que no se pueden importar se omiten.
+    """
+    wrapped = []
+    for path in pipeline:
+        module_name, member = path.rsplit(".", 1)
+        try:
+            module = import_module(module_name)
+            func = getattr(module, member)
+        except (ImportError, AttributeError) as e:
+            logger.warning("[LlaveMX] No se pudo perfilar el paso %s: %s", path, e)
+            continue
+        if getattr(func, "llavemx_profiled", False):
+            continue
+        setattr(module, member, profiler.wrap(path, func))
+        wrapped.append(path)
+    return wrapped
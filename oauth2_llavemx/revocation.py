@@ -0,0 +1,386 @@
+"""
+Revocación de tokens LlaveMX fuera del request de logout.
+
+Modos (SOCIAL_AUTH_LLAVEMX_REVOKE_MODE):
+- "sync"        (default) llama /cerrarSesion dentro del request.
+- "background"  encola el token en un pool de hilos acotado del proceso;
+                el logout regresa de inmediato y los reintentos ocurren
+                en segundo plano.
+- "task"        entrega el token a SOCIAL_AUTH_LLAVEMX_REVOKE_TASK (ruta
+                punteada a un callable o tarea Celery que recibe el token),
+                p. ej. una tarea que envuelva revoke_token_task; recibe
+                además uid= (y site= en multi-sitio) como kwargs.
+
+La cola expone contadores (depth, enqueued, dropped, completed, failed)
+vía get_revocation_queue().stats() para dimensionarla.
+
+revoke_all() cierra en masa las sesiones de todas las cuentas LlaveMX
+(comando llavemx_revoke_sessions): llamadas en paralelo con tasa acotada.
+Los tokens revocados se quitan fila por fila y solo si la fila sigue
+guardando el token revocado (un login durante el lote no se pisa).
+"""
+
+import functools
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+from social_core.exceptions import AuthFailed
+
+from oauth2_llavemx.breaker import DEFAULT_RESET_TIMEOUT, CircuitOpenError
+from oauth2_llavemx.cache import get_cache
+from oauth2_llavemx.sites import SITE_FIELD
+from oauth2_llavemx.tokens import DEFAULT_REFRESH_LOCK_TTL, _lock_key, _refresh_locked, iter_by_pk, needs_refresh
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+
+DEFAULT_BULK_WORKERS = 8
+DEFAULT_BULK_RATE = 20
+DEFAULT_BULK_BATCH_SIZE = 500
+
+# Campos de extra_data que se eliminan al revocar.
+TOKEN_FIELDS = ("access_token", "refresh_token", "expires_in")
+
+
+class RevocationQueue:
+    """Cola acotada de revocaciones atendida por hilos daemon."""
+
+    def __init__(
+        self,
+        workers=DEFAULT_WORKERS,
+        maxsize=DEFAULT_QUEUE_SIZE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        retry_backoff=DEFAULT_RETRY_BACKOFF,
+    ):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.enqueued = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self.depth,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _ensure_workers(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                t = threading.Thread(
+                    target=self._run,
+                    name=f"llavemx-revoke-{len(self._threads)}",
+                    daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, fn, token):
+        """
+        Encola fn(token). Regresa False (y cuenta un drop) si la cola está llena;
+        nunca bloquea al request que hace logout.
+        """
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((fn, token))
+        except queue.Full:
+            self._count("dropped")
+            logger.warning("[LlaveMX] Cola de revocación llena; token descartado.")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _run(self):
+        while True:
+            fn, token = self._queue.get()
+            # Como en un request: el trabajo puede tocar el ORM (refresco del
+            # token), así que no se reutiliza una conexión caída o vencida
+            # (CONN_MAX_AGE) ni se deja abierta mientras el hilo espera.
+            close_old_connections()
+            try:
+                self._revoke_with_retries(fn, token)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def _revoke_with_retries(self, fn, token):
+        for attempt in range(self.max_retries + 1):
+            try:
+                fn(token)
+                self._count("completed")
+                return
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self._count("failed")
+                    logger.error(f"LlaveMX logout error (background): {e}")
+                    return
+                # Backoff exponencial con jitter para no sincronizar reintentos.
+                delay = self.retry_backoff * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+
+
+_queue_instance = None
+_queue_lock = threading.Lock()
+
+
+def get_revocation_queue(
+    workers=DEFAULT_WORKERS,
+    maxsize=DEFAULT_QUEUE_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+):
+    """Regresa la cola de revocación del proceso (se crea la primera vez)."""
+    global _queue_instance
+    if _queue_instance is None:
+        with _queue_lock:
+            if _queue_instance is None:
+                _queue_instance = RevocationQueue(workers, maxsize, max_retries)
+    return _queue_instance
+
+
+def dispatch_revocation(backend, token, uid=None):
+    """
+    Entrega el token al modo de revocación configurado.
+    Regresa True si la revocación quedó en manos de un proceso en segundo plano.
+    Con `uid`, el refresco de un token vencido también ocurre allá, no en el
+    request de logout.
+    """
+    mode = backend.setting("REVOKE_MODE", "sync")
+
+    if mode == "background":
+        q = get_revocation_queue(
+            workers=backend.setting("REVOKE_WORKERS", DEFAULT_WORKERS),
+            maxsize=backend.setting("REVOKE_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+            max_retries=backend.setting("REVOKE_MAX_RETRIES", DEFAULT_MAX_RETRIES),
+        )
+        q.submit(functools.partial(backend._logout_remote, uid=uid), token)
+        return True
+
+    if mode == "task":
+        task_path = backend.setting("REVOKE_TASK")
+        if not task_path:
+            logger.error("[LlaveMX] REVOKE_MODE=task sin REVOKE_TASK; se revoca en línea.")
+            return False
+        task = import_string(task_path)
+        # En multi-sitio la tarea recibe además el sitio del cliente (sites.py),
+        # y el uid de la cuenta para refrescar un token vencido.
+        kwargs = {"site": backend.site.name} if backend.site.name is not None else {}
+        if uid:
+            kwargs["uid"] = uid
+        getattr(task, "delay", task)(token, **kwargs)
+        return True
+
+    return False
+
+
+def revoke_token_task(token, site=None, uid=None):
+    """
+    Punto de entrada para backends de tareas (Celery, RQ, ...).
+    Con `uid` refresca antes el token si ya venció.
+    Lanza excepción si /cerrarSesion falla para que la tarea pueda reintentarse.
+    """
+    from social_django.utils import load_strategy
+
+    from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+    backend = LlaveMXOAuth2(strategy=load_strategy()).for_site(site)
+    return backend._logout_remote(token, uid)
+
+
+# -------------------------------------------------------------
+# Revocación masiva
+# -------------------------------------------------------------
+class RateLimiter:
+    """Reparte las llamadas a `rate` por segundo entre todos los hilos."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _token_rejected(error):
+    # 4xx de /cerrarSesion o de /obtenerToken: el token ya no sirve y solo
+    # queda limpiarlo. Red, 5xx, breaker o admisión se reintentan otra vez.
+    # refresh_token() traduce todo HTTPError a AuthFailed: cuenta el status
+    # del HTTPError original.
+    if isinstance(error, AuthFailed) and isinstance(error.__cause__, HTTPError):
+        error = error.__cause__
+    if isinstance(error, HTTPError):
+        return 400 <= error.code < 500
+    return isinstance(error, AuthFailed)
+
+
+def revoke_all(
+    backend,
+    workers=DEFAULT_BULK_WORKERS,
+    rate=DEFAULT_BULK_RATE,
+    batch_size=DEFAULT_BULK_BATCH_SIZE,
+    after_pk=None,
+    limit=None,
+    dry_run=False,
+    progress=None,
+):
+    """
+    Llama /cerrarSesion para cada cuenta LlaveMX con access_token.
+
+    - Las filas se leen en orden de pk, por páginas de batch_size (iter_by_pk).
+    - Las llamadas de un lote corren en `workers` hilos, a lo más `rate`
+      por segundo en total (0 = sin límite).
+    - Los tokens vencidos con refresh_token se refrescan antes, como en el
+      logout interactivo, y el par nuevo se guarda antes de /cerrarSesion:
+      si el logout falla, la cuenta conserva un refresh_token válido.
+    - Los tokens revocados (o que LlaveMX ya rechaza) se eliminan de
+      extra_data (ver _clear_tokens); los que fallan por red se conservan
+      para una corrida posterior.
+    - Las cuentas cuyo candado de refresco tiene otro worker se omiten (busy).
+
+    progress(stats, last_pk) se llama al terminar cada lote; last_pk permite
+    reanudar con `after_pk`.
+    """
+    from social_django.models import UserSocialAuth
+
+    stats = {"scanned": 0, "with_token": 0, "revoked": 0, "rejected": 0, "failed": 0, "busy": 0}
+    qs = (
+        UserSocialAuth.objects
+        .filter(provider=backend.name)
+        .only("pk", "uid", "extra_data")
+    )
+
+    limiter = RateLimiter(rate)
+    batch = []
+    last_pk = after_pk
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="llavemx-bulk-revoke") as pool:
+        for social in iter_by_pk(qs, batch_size, after_pk):
+            stats["scanned"] += 1
+            if (social.extra_data or {}).get("access_token"):
+                stats["with_token"] += 1
+                if not dry_run:
+                    batch.append(social)
+            if len(batch) >= batch_size or (dry_run and stats["scanned"] % batch_size == 0):
+                if batch:
+                    _revoke_batch(backend, pool, limiter, batch, stats)
+                    batch = []
+                last_pk = social.pk
+                if progress:
+                    progress(stats, last_pk)
+            if limit and stats["with_token"] >= limit:
+                break
+
+        if batch:
+            _revoke_batch(backend, pool, limiter, batch, stats)
+        if stats["scanned"]:
+            last_pk = social.pk
+    if progress:
+        progress(stats, last_pk)
+    return stats
+
+
+def _revoke_batch(backend, pool, limiter, batch, stats):
+    from social_django.models import UserSocialAuth
+
+    cache = get_cache(backend)
+    lock_ttl = backend.setting("REFRESH_LOCK_TTL", DEFAULT_REFRESH_LOCK_TTL)
+    locked = [social for social in batch if cache.add(_lock_key(social), 1, lock_ttl)]
+    stats["busy"] += len(batch) - len(locked)
+
+    max_retries = backend.setting("REVOKE_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+    reset_timeout = backend.setting("BREAKER_RESET_TIMEOUT", DEFAULT_RESET_TIMEOUT)
+
+    def revoke(social):
+        token = social.extra_data["access_token"]
+        site_backend = backend.for_site(social.extra_data.get(SITE_FIELD))
+        for attempt in range(max_retries + 1):
+            try:
+                if needs_refresh(social.extra_data, margin=0):
+                    # Ya tenemos el candado de la cuenta: mismo camino que refresh_social.
+                    limiter.wait()
+                    _refresh_locked(backend, social, token, margin=0)
+                    token = social.extra_data.get("access_token")
+                limiter.wait()
+                data = site_backend._revoke_remote(token)
+                break
+            except Exception as e:
+                if _token_rejected(e):
+                    return "rejected", token
+                if attempt >= max_retries:
+                    logger.warning("[LlaveMX] No se pudo cerrar la sesión de uid=%s: %s", social.uid, e)
+                    return "failed", token
+                # Con el breaker abierto todos los hilos esperan a que se cierre.
+                delay = DEFAULT_RETRY_BACKOFF * (2 ** attempt)
+                if isinstance(e, CircuitOpenError):
+                    delay = max(delay, reset_timeout)
+                time.sleep(delay + random.uniform(0, delay))
+        # LlaveMX responde 200 con {"error": "invalid_token"} si la sesión ya no existe.
+        if isinstance(data, dict) and data.get("error"):
+            return "rejected", token
+        return "revoked", token
+
+    try:
+        tokens = []
+        for social, (result, token) in zip(locked, pool.map(revoke, locked)):
+            stats[result] += 1
+            if result == "failed":
+                continue
+            _clear_tokens(UserSocialAuth, social.pk, token)
+            tokens.append(token)
+        if tokens:
+            cache.delete_many([backend._profile_cache_key(token) for token in tokens])
+    finally:
+        cache.delete_many([_lock_key(social) for social in locked])
+
+
+def _clear_tokens(model, pk, token):
+    """
+    Quita los campos de token de la fila, releída con select_for_update, solo
+    si su access_token sigue siendo el revocado. Un lote puede tardar decenas
+    de segundos por la tasa: un login o refresco guardado mientras tanto
+    conserva sus tokens y su perfil.
+    """
+    with transaction.atomic():
+        social = model.objects.select_for_update().only("pk", "extra_data").filter(pk=pk).first()
+        if social is None or (social.extra_data or {}).get("access_token") != token:
+            return False
+        social.extra_data = {key: value for key, value in social.extra_data.items() if key not in TOKEN_FIELDS}
+        social.save(update_fields=["extra_data"])
+    return True
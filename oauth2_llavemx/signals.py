@@ -0,0 +1,115 @@
+"""
+Mantiene CurpIndex en sync con custom_reg_form.ExtraInfo.
+
+NOTA: QuerySet.update() / bulk_update() sobre ExtraInfo no disparan señales,
+y durante un despliegue gradual los workers viejos escriben ExtraInfo sin
+tocar el índice. Para esos casos resync_curp_index() (comando
+llavemx_curp_index) compara ExtraInfo contra CurpIndex por lotes y corrige
+las diferencias.
+"""
+
+from oauth2_llavemx.models import CurpIndex, normalize_curp
+
+DEFAULT_RESYNC_BATCH_SIZE = 5000
+
+
+def sync_curp_index(sender, instance, **kwargs):
+    curp = normalize_curp(getattr(instance, "curp", None))
+    user_id = getattr(instance, "user_id", None)
+
+    if not curp or not user_id:
+        CurpIndex.objects.filter(extra_info_id=instance.pk).delete()
+        return
+
+    CurpIndex.objects.update_or_create(
+        extra_info_id=instance.pk,
+        defaults={"curp": curp, "user_id": user_id},
+    )
+
+
+def drop_curp_index(sender, instance, **kwargs):
+    CurpIndex.objects.filter(extra_info_id=instance.pk).delete()
+
+
+def resync_curp_index(extra_info_model, batch_size=DEFAULT_RESYNC_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Reconstruye CurpIndex a partir de ExtraInfo sin cargar ninguna tabla en
+    memoria: ambas se recorren por pk en páginas de `batch_size` (keyset,
+    pk__gt=último), de modo que funciona igual en MySQL, donde iterator()
+    no hace streaming.
+
+    - Filas de ExtraInfo sin entrada o con CURP/usuario distintos: se crean o
+      actualizan (bulk_create / bulk_update por página).
+    - Entradas de ExtraInfo sin CURP o sin usuario, y entradas cuyo ExtraInfo
+      ya no existe: se borran.
+
+    progress(stats) se llama al terminar cada página. Regresa los contadores.
+    """
+    stats = {"scanned": 0, "created": 0, "updated": 0, "deleted": 0, "orphans": 0}
+
+    last_pk = None
+    while True:
+        qs = extra_info_model.objects.order_by("pk")
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+        rows = list(qs.values_list("pk", "curp", "user_id")[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        stats["scanned"] += len(rows)
+        _resync_page(rows, stats, dry_run)
+        if progress:
+            progress(stats)
+
+    last_pk = None
+    while True:
+        qs = CurpIndex.objects.order_by("extra_info_id")
+        if last_pk is not None:
+            qs = qs.filter(extra_info_id__gt=last_pk)
+        ids = list(qs.values_list("extra_info_id", flat=True)[:batch_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        alive = set(extra_info_model.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        orphans = [pk for pk in ids if pk not in alive]
+        stats["orphans"] += len(orphans)
+        if orphans and not dry_run:
+            CurpIndex.objects.filter(extra_info_id__in=orphans).delete()
+        if progress:
+            progress(stats)
+
+    return stats
+
+
+def _resync_page(rows, stats, dry_run):
+    indexed = {
+        entry.extra_info_id: entry
+        for entry in CurpIndex.objects.filter(extra_info_id__in=[pk for pk, _, _ in rows])
+    }
+
+    create, update, delete = [], [], []
+    for pk, curp, user_id in rows:
+        curp = normalize_curp(curp)
+        entry = indexed.get(pk)
+        if not curp or not user_id:
+            if entry is not None:
+                delete.append(pk)
+        elif entry is None:
+            create.append(CurpIndex(extra_info_id=pk, curp=curp, user_id=user_id))
+        elif entry.curp != curp or entry.user_id != user_id:
+            entry.curp = curp
+            entry.user_id = user_id
+            update.append(entry)
+
+    stats["created"] += len(create)
+    stats["updated"] += len(update)
+    stats["deleted"] += len(delete)
+    if dry_run:
+        return
+    if create:
+        # ignore_conflicts: una señal pudo crear la entrada entre la lectura y aquí.
+        CurpIndex.objects.bulk_create(create, ignore_conflicts=True)
+    if update:
+        CurpIndex.objects.bulk_update(update, ["curp", "user"])
+    if delete:
+        CurpIndex.objects.filter(extra_info_id__in=delete).delete()
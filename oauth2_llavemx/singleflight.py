@@ -0,0 +1,126 @@
+"""
+Single-flight entre workers vía el cache compartido.
+
+La primera llamada con una llave toma el candado (cache.add), ejecuta la
+operación y publica su resultado (éxito o error) por un lapso corto; las
+llamadas concurrentes con la misma llave esperan ese resultado en lugar de
+repetir la operación; lo mismo una llamada que llega después, mientras el
+resultado siga publicado. Si quien tenía el candado lo suelta sin publicar
+nada (error que no se comparte), los que esperan compiten otra vez por el
+candado: la operación nunca corre sin él. Si el resultado no llega dentro
+de la espera, el que espera falla con FlightTimeout.
+
+El resultado se guarda como ("ok", valor) o ("error", tipo, mensaje): solo
+datos serializables, nunca la excepción. Mientras está publicado, cualquiera
+que presente la misma llave lo obtiene: result_ttl es la ventana en la que
+se puede reutilizar, así que debe ser de pocos segundos.
+"""
+
+import asyncio
+import time
+
+from oauth2_llavemx.cache import make_key
+
+DEFAULT_LOCK_TTL = 30
+DEFAULT_RESULT_TTL = 5
+
+_WAIT_INTERVAL = 0.05
+
+
+class FlightTimeout(Exception):
+    """El resultado de la operación en curso no llegó dentro de la espera."""
+
+
+class SingleFlight:
+
+    def __init__(self, cache, name, key, lock_ttl=DEFAULT_LOCK_TTL, result_ttl=DEFAULT_RESULT_TTL):
+        self.cache = cache
+        self.lock_key = make_key("flight", name, key)
+        self.result_key = make_key("flight", name, key, "result")
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+
+    def run(self, fn, describe_error, wait=None):
+        """
+        Ejecuta fn() una sola vez para la llave. describe_error(exc) regresa
+        (tipo, mensaje) para publicar un error o None para no compartirlo.
+        Regresa el outcome: ("ok", valor) o ("error", tipo, mensaje).
+        FlightTimeout si otra llamada tiene el candado y no publica nada en
+        `wait` segundos (lock_ttl por omisión).
+        """
+        deadline = time.monotonic() + (self.lock_ttl if wait is None else wait)
+        while True:
+            outcome = self.cache.get(self.result_key)
+            if outcome is not None:
+                return outcome
+            if self.cache.add(self.lock_key, 1, self.lock_ttl):
+                return self._lead(fn, describe_error)
+            outcome = self._wait(deadline)
+            if outcome is not None:
+                return outcome
+
+    def _lead(self, fn, describe_error):
+        try:
+            try:
+                outcome = ("ok", fn())
+            except Exception as e:
+                described = describe_error(e)
+                if described is not None:
+                    self.cache.set(self.result_key, ("error",) + tuple(described), self.result_ttl)
+                raise
+            self.cache.set(self.result_key, outcome, self.result_ttl)
+            return outcome
+        finally:
+            self.cache.delete(self.lock_key)
+
+    async def arun(self, fn, describe_error, wait=None):
+        """Versión coroutine de run(); fn es una función que regresa una coroutine."""
+        deadline = time.monotonic() + (self.lock_ttl if wait is None else wait)
+        while True:
+            outcome = await self.cache.aget(self.result_key)
+            if outcome is not None:
+                return outcome
+            if await self.cache.aadd(self.lock_key, 1, self.lock_ttl):
+                return await self._alead(fn, describe_error)
+            outcome = await self._await(deadline)
+            if outcome is not None:
+                return outcome
+
+    async def _alead(self, fn, describe_error):
+        try:
+            try:
+                outcome = ("ok", await fn())
+            except Exception as e:
+                described = describe_error(e)
+                if described is not None:
+                    await self.cache.aset(self.result_key, ("error",) + tuple(described), self.result_ttl)
+                raise
+            await self.cache.aset(self.result_key, outcome, self.result_ttl)
+            return outcome
+        finally:
+            await self.cache.adelete(self.lock_key)
+
+    def _wait(self, deadline):
+        """
+        Espera el resultado; None si el candado se soltó sin publicarlo.
+        FlightTimeout si se acaba la espera con el candado tomado.
+        """
+        while time.monotonic() < deadline:
+            outcome = self.cache.get(self.result_key)
+            if outcome is not None:
+                return outcome
+            if self.cache.get(self.lock_key) is None:
+                # El resultado se publica antes de soltar el candado.
+                return self.cache.get(self.result_key)
+            time.sleep(_WAIT_INTERVAL)
+        raise FlightTimeout(self.lock_key)
+
+    async def _await(self, deadline):
+        while time.monotonic() < deadline:
+            outcome = await self.cache.aget(self.result_key)
+            if outcome is not None:
+                return outcome
+            if await self.cache.aget(self.lock_key) is None:
+                return await self.cache.aget(self.result_key)
+            await asyncio.sleep(_WAIT_INTERVAL)
+        raise FlightTimeout(self.lock_key)
@@ -0,0 +1,186 @@
+"""
+Registro de sitios: varios sitios Open edX en un mismo proceso LMS, cada uno
+con su cliente LlaveMX.
+
+SOCIAL_AUTH_LLAVEMX_SITES = {
+    "campus.example.mx": {
+        "KEY": "...",
+        "SECRET": "...",
+        "WS_USER": "...",
+        "WS_PASSWORD": "...",
+        "ENVIRONMENT": "validation",
+        # Cualquier otro setting del backend, sin el prefijo SOCIAL_AUTH_LLAVEMX_:
+        "READ_TIMEOUT": 10,
+    },
+}
+
+El sitio se elige por el host del request (sin puerto). Un host sin entrada,
+o una llamada sin request (comandos, tareas), usa el sitio por defecto, que
+se arma solo con los settings globales.
+
+Cada Site resuelve una sola vez:
+- los endpoints de su ambiente: "production" (los de LlaveMXOAuth2) o
+  "validation" (val-llavemx.infotec.mx / val-api-llavemx.infotec.mx). Se
+  puede fijar cualquier URL suelta (AUTHORIZATION_URL, ACCESS_TOKEN_URL, ...);
+- el nombre de su pool de conexiones, separado del de los demás sitios.
+
+Los settings del backend no se memorizan: el override del sitio gana y, si
+no hay, se consulta la strategy en cada llamada. En Open edX la strategy lee
+ConfigurationModel (KEY/SECRET editados en el admin), que tiene su propio
+cache; memorizarlo aquí ocultaría esos cambios hasta reiniciar. El header
+Basic se arma con esos valores y solo se recalcula si cambian.
+
+El registro se vacía con la señal setting_changed (override_settings) y
+cuando cambia el objeto SOCIAL_AUTH_LLAVEMX_SITES.
+"""
+
+import base64
+import threading
+
+from django.conf import settings
+from django.core.exceptions import DisallowedHost, ImproperlyConfigured
+from django.http.request import split_domain_port
+
+DEFAULT_ENVIRONMENT = "production"
+
+URL_NAMES = ("AUTHORIZATION_URL", "ACCESS_TOKEN_URL", "USER_DATA_URL", "ROLES_URL", "LOGOUT_URL")
+
+# Ambiente -> URLs que sustituyen a las de la clase del backend.
+ENVIRONMENTS = {
+    "production": {},
+    "validation": {
+        "AUTHORIZATION_URL": "https://val-llavemx.infotec.mx/oauth.xhtml",
+        "ACCESS_TOKEN_URL": "https://val-api-llavemx.infotec.mx/ws/rest/oauth/obtenerToken",
+        "USER_DATA_URL": "https://val-api-llavemx.infotec.mx/ws/rest/oauth/datosUsuario",
+        "ROLES_URL": "https://val-api-llavemx.infotec.mx/ws/rest/oauth/getRolesUsuarioLogueado",
+        "LOGOUT_URL": "https://val-api-llavemx.infotec.mx/ws/rest/oauth/cerrarSesion",
+    },
+}
+
+# Campo de extra_data con el sitio del login (refresco y logout fuera del request).
+SITE_FIELD = "llavemx_site"
+
+MISSING = object()
+_NO_SITES = {}
+
+
+def basic_auth_header(user, password):
+    raw = f"{user}:{password}".encode("utf-8")
+    return f"Basic {base64.b64encode(raw).decode('utf-8')}"
+
+
+class Site:
+
+    def __init__(self, name=None, overrides=None):
+        self.name = name
+        self.overrides = dict(overrides or {})
+
+        self.environment = self.overrides.get(
+            "ENVIRONMENT",
+            getattr(settings, "SOCIAL_AUTH_LLAVEMX_ENVIRONMENT", DEFAULT_ENVIRONMENT),
+        )
+        if self.environment not in ENVIRONMENTS:
+            raise ImproperlyConfigured(
+                f"[LlaveMX] Ambiente desconocido para el sitio {name or 'default'}: {self.environment!r}"
+            )
+        self.urls = dict(ENVIRONMENTS[self.environment])
+        self.urls.update((key, self.overrides[key]) for key in URL_NAMES if key in self.overrides)
+
+        self._auth_header = (None, None)
+
+    def setting(self, name, lookup):
+        """
+        Valor del setting para este sitio: el override o lookup(name) (la
+        strategy, MISSING si no está). Sin memorizar: ver el docstring del módulo.
+        """
+        if name in self.overrides:
+            return self.overrides[name]
+        return lookup(name)
+
+    def auth_header(self, user, password):
+        """Header Basic de las credenciales WS; se recalcula solo si cambian."""
+        if not (user and password):
+            return None
+        credentials, header = self._auth_header
+        if credentials != (user, password):
+            header = basic_auth_header(user, password)
+            self._auth_header = ((user, password), header)
+        return header
+
+    def breaker_name(self, endpoint):
+        """Los hosts de validación no comparten breaker con los de producción."""
+        if self.environment == DEFAULT_ENVIRONMENT and not any(key in self.overrides for key in URL_NAMES):
+            return endpoint
+        return f"{self.name or 'default'}.{endpoint}"
+
+    def __repr__(self):
+        return f"<Site {self.name or 'default'} ({self.environment})>"
+
+
+class SiteRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sites = {}
+        self._source = MISSING
+        self._configured = {}
+
+    def clear(self):
+        with self._lock:
+            self._sites = {}
+            self._source = MISSING
+            self._configured = {}
+
+    def _sync(self):
+        source = getattr(settings, "SOCIAL_AUTH_LLAVEMX_SITES", None) or _NO_SITES
+        if source is not self._source:
+            with self._lock:
+                self._sites = {}
+                self._configured = {str(name).lower(): overrides for name, overrides in source.items()}
+                self._source = source
+        return self._configured
+
+    def names(self):
+        """Sitios configurados; None es el sitio por defecto."""
+        return [None] + list(self._sync())
+
+    def get(self, name=None):
+        configured = self._sync()
+        name = str(name).lower() if name else None
+        if name not in configured:
+            name = None
+        site = self._sites.get(name)
+        if site is None:
+            with self._lock:
+                site = self._sites.get(name)
+                if site is None:
+                    site = self._sites[name] = Site(name, configured.get(name))
+        return site
+
+    def for_request(self, request):
+        if request is None:
+            return self.get(None)
+        try:
+            host, _ = split_domain_port(request.get_host())
+        except (DisallowedHost, KeyError):
+            return self.get(None)
+        return self.get(host)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_site_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SiteRegistry()
+    return _registry
+
+
+def clear_on_setting_changed(setting, **kwargs):
+    # self.setting() cae en SOCIAL_AUTH_<NOMBRE>: cualquier SOCIAL_AUTH_* invalida.
+    if setting.startswith("SOCIAL_AUTH_"):
+        get_site_registry().clear()
@@ -0,0 +1,110 @@
+"""
+Parámetro "state" sin sesión (SOCIAL_AUTH_LLAVEMX_STATE_MODE = "signed").
+
+El state es "<nonce>.<ts>.<firma>":
+- nonce: 16 bytes aleatorios (secrets.token_urlsafe).
+- ts:    epoch de emisión en base36.
+- firma: HMAC-SHA256 (salted_hmac sobre SECRET_KEY) de nonce, ts y el secreto
+         CSRF del navegador (cookie csrftoken).
+
+Atar la firma al secreto CSRF da la misma garantía que guardar el state en la
+sesión: un state capturado no sirve desde otro navegador. La firma se compara
+en tiempo constante, el state vence a los SOCIAL_AUTH_LLAVEMX_STATE_TTL
+segundos y cada nonce se consume una sola vez (cache.add con TTL), así que un
+callback repetido se rechaza. Dentro de un mismo callback el backend valida
+una sola vez (validate_state recuerda el state ya validado).
+
+La única excepción a un solo uso es el callback duplicado (doble tap, recarga)
+del mismo navegador con el mismo code: el nonce guarda el hash del code y,
+con el single-flight del canje activo, ese duplicado pasa para reutilizar el
+resultado del primer canje (la llave del single-flight incluye el state). Sin
+single-flight no tendría nada que reutilizar y se rechaza como cualquier
+repetición.
+
+Si no hay cookie CSRF utilizable (CSRF_USE_SESSIONS o sin CsrfViewMiddleware)
+se regresa al state en sesión. Los state de sesión no llevan ".", de modo que
+validate_state distingue ambos formatos sin ajuste adicional.
+"""
+
+import secrets
+import time
+
+from django.conf import settings
+from django.middleware.csrf import get_token
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import base36_to_int, int_to_base36
+
+from oauth2_llavemx.cache import fingerprint, get_cache, make_key
+
+DEFAULT_STATE_TTL = 600
+# Tolerancia a relojes desfasados entre workers.
+CLOCK_SKEW = 30
+
+CSRF_MIDDLEWARE = "django.middleware.csrf.CsrfViewMiddleware"
+_SALT = "oauth2_llavemx.state"
+
+
+def browser_binding(request, create=False):
+    """
+    Secreto CSRF del navegador, o None si no se puede usar para atar el state.
+    Con create=True se genera (y CsrfViewMiddleware pone la cookie) si falta.
+    """
+    if request is None or settings.CSRF_USE_SESSIONS:
+        return None
+    if CSRF_MIDDLEWARE not in settings.MIDDLEWARE:
+        return None
+    if create and "CSRF_COOKIE" not in request.META:
+        get_token(request)
+    return request.META.get("CSRF_COOKIE") or None
+
+
+def _signature(nonce, ts, binding):
+    return salted_hmac(_SALT, f"{nonce}.{ts}.{binding}", algorithm="sha256").hexdigest()
+
+
+def is_signed(state):
+    return state.count(".") == 2
+
+
+def make_state(request):
+    """State firmado para este navegador, o None si hay que usar la sesión."""
+    binding = browser_binding(request, create=True)
+    if binding is None:
+        return None
+    nonce = secrets.token_urlsafe(16)
+    ts = int_to_base36(int(time.time()))
+    return f"{nonce}.{ts}.{_signature(nonce, ts, binding)}"
+
+
+def check_state(backend, state):
+    """
+    True si el state está bien firmado para este navegador, no ha vencido y
+    su nonce no se había usado (o se usó con este mismo code). Consume el nonce.
+    """
+    binding = browser_binding(getattr(backend.strategy, "request", None))
+    if binding is None:
+        return False
+
+    nonce, ts, signature = state.split(".")
+    if not constant_time_compare(signature, _signature(nonce, ts, binding)):
+        return False
+
+    try:
+        issued = base36_to_int(ts)
+    except ValueError:
+        return False
+    ttl = backend.setting("STATE_TTL", DEFAULT_STATE_TTL)
+    age = time.time() - issued
+    if age > ttl or age < -CLOCK_SKEW:
+        return False
+
+    # El nonce vive lo que le resta de vida al state; add() es atómico.
+    remaining = int(ttl - age) + CLOCK_SKEW
+    code = backend.data.get("code")
+    code_fp = fingerprint(code) if code else 1
+    cache = get_cache(backend)
+    key = make_key("state", nonce)
+    if cache.add(key, code_fp, remaining):
+        return True
+    # Callback duplicado: el mismo code ya está en canje (o se canjeó).
+    return bool(code) and backend.setting("CODE_SINGLE_FLIGHT", True) and cache.get(key) == code_fp
@@ -0,0 +1,254 @@
+"""
+Ciclo de vida del access token LlaveMX.
+
+- La vigencia se calcula con auth_time + expires_in de extra_data (el mismo
+  criterio que UserSocialAuth.access_token_expired()).
+- refresh_social() refresca con single-flight por cuenta: el candado vive en
+  el cache compartido (cache.add), así que solo un worker del clúster llama
+  al WS; los demás esperan y releen extra_data.
+- get_valid_access_token() refresca de forma proactiva dentro del margen.
+- refresh_expiring() refresca por lotes los tokens por vencer (comando
+  llavemx_refresh_tokens); las filas se leen por páginas de pk (iter_by_pk)
+  y se releen al tomar sus candados. Cada token nuevo se guarda fila por fila
+  y solo si la fila sigue con el token que se refrescó: un login guardado
+  durante el lote no se pisa.
+
+El refresco se escribe solo en la columna extra_data.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from social_core.exceptions import AuthException
+
+from oauth2_llavemx.cache import get_cache, make_key
+from oauth2_llavemx.fields import get_field_schema
+from oauth2_llavemx.sites import SITE_FIELD
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_MARGIN = 120
+DEFAULT_REFRESH_LOCK_TTL = 30
+DEFAULT_REFRESH_BATCH_SIZE = 200
+DEFAULT_REFRESH_WORKERS = 4
+
+_WAIT_INTERVAL = 0.05
+
+
+def expires_at(extra_data):
+    """Epoch en que vence el access token, o None si no se conoce."""
+    if not extra_data:
+        return None
+    expires_in = extra_data.get("expires_in")
+    auth_time = extra_data.get("auth_time")
+    if not isinstance(expires_in, (int, float)) or not auth_time:
+        return None
+    return auth_time + expires_in
+
+
+def needs_refresh(extra_data, margin=DEFAULT_REFRESH_MARGIN, now=None):
+    """True si el token vence dentro de `margin` segundos y hay refresh_token."""
+    expiry = expires_at(extra_data)
+    if expiry is None or not extra_data.get("refresh_token"):
+        return False
+    return expiry - (now if now is not None else time.time()) <= margin
+
+
+def iter_by_pk(qs, batch_size, after_pk=None):
+    """
+    Recorre qs en orden de pk por páginas de batch_size (pk__gt=último). No
+    depende de cursores del servidor: con MySQL, iterator() carga todo el
+    resultado en el driver.
+    """
+    qs = qs.order_by("pk")
+    while True:
+        page = list((qs if after_pk is None else qs.filter(pk__gt=after_pk))[:batch_size])
+        if not page:
+            return
+        yield from page
+        if len(page) < batch_size:
+            return
+        after_pk = page[-1].pk
+
+
+def _lock_key(social):
+    return make_key("refresh", social.pk)
+
+
+def _apply_refresh(backend, social):
+    """
+    Llama al WS y mezcla la respuesta en social.extra_data sin guardar
+    (social_django.set_extra_data() guarda la fila completa).
+    """
+    backend = backend.for_site(social.extra_data.get(SITE_FIELD))
+    response = backend.refresh_token(social.extra_data["refresh_token"])
+    data = backend.extra_data(None, social.uid, response, social.extra_data, {})
+    merged = get_field_schema(backend).merge_extra_data(social.extra_data, data)
+    if merged == social.extra_data:
+        return False
+    social.extra_data = merged
+    return True
+
+
+def refresh_social(backend, social, margin=DEFAULT_REFRESH_MARGIN, force=False):
+    """
+    Refresca el token de una cuenta si está por vencer.
+    Regresa True si social.extra_data quedó con un token nuevo.
+    """
+    if not force and not needs_refresh(social.extra_data, margin):
+        return False
+
+    cache = get_cache(backend)
+    key = _lock_key(social)
+    lock_ttl = backend.setting("REFRESH_LOCK_TTL", DEFAULT_REFRESH_LOCK_TTL)
+    before = social.extra_data.get("access_token")
+
+    if not cache.add(key, 1, lock_ttl):
+        # Otro worker está refrescando esta cuenta: esperamos su resultado.
+        deadline = time.monotonic() + lock_ttl
+        while cache.get(key) is not None and time.monotonic() < deadline:
+            time.sleep(_WAIT_INTERVAL)
+        social.refresh_from_db(fields=["extra_data"])
+        return social.extra_data.get("access_token") != before
+
+    try:
+        return _refresh_locked(backend, social, before, margin, force)
+    finally:
+        cache.delete(key)
+
+
+def _refresh_locked(backend, social, before, margin=DEFAULT_REFRESH_MARGIN, force=False):
+    """
+    Refresco con el candado de la cuenta ya tomado (refresh_social, revoke_all):
+    relee extra_data, refresca y guarda de inmediato el par de tokens nuevo.
+    """
+    # Puede que otro worker haya terminado justo antes de tomar el candado;
+    # con refresh tokens de un solo uso no debemos gastar el mismo dos veces.
+    social.refresh_from_db(fields=["extra_data"])
+    if social.extra_data.get("access_token") != before:
+        return True
+    if not force and not needs_refresh(social.extra_data, margin):
+        return False
+
+    if not _apply_refresh(backend, social):
+        return False
+    social.save(update_fields=["extra_data"])
+    return True
+
+
+def get_valid_access_token(backend, social, margin=None):
+    """Access token vigente de la cuenta, refrescándolo antes de que venza."""
+    if margin is None:
+        margin = backend.setting("REFRESH_MARGIN", DEFAULT_REFRESH_MARGIN)
+    refresh_social(backend, social, margin)
+    return social.extra_data.get("access_token")
+
+
+def refresh_expiring(
+    backend,
+    margin=DEFAULT_REFRESH_MARGIN,
+    batch_size=DEFAULT_REFRESH_BATCH_SIZE,
+    workers=DEFAULT_REFRESH_WORKERS,
+    limit=None,
+    dry_run=False,
+    progress=None,
+):
+    """
+    Refresca por lotes los tokens que vencen dentro de `margin` segundos.
+
+    Las llamadas al WS de un lote corren en paralelo (`workers`). Las
+    cuentas cuyo candado ya tiene otro worker se omiten (busy); las que otro
+    proceso refrescó o a las que un login les dio tokens nuevos después de
+    leer la página cuentan como unchanged.
+    """
+    from social_django.models import UserSocialAuth
+
+    stats = {"scanned": 0, "due": 0, "refreshed": 0, "unchanged": 0, "busy": 0, "failed": 0}
+    qs = (
+        UserSocialAuth.objects
+        .filter(provider=backend.name)
+        .only("pk", "uid", "extra_data")
+    )
+    now = time.time()
+    batch = []
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="llavemx-refresh") as pool:
+        for social in iter_by_pk(qs, batch_size):
+            stats["scanned"] += 1
+            if not needs_refresh(social.extra_data, margin, now):
+                continue
+            stats["due"] += 1
+            if not dry_run:
+                batch.append(social)
+            if len(batch) >= batch_size:
+                _refresh_batch(backend, pool, batch, margin, stats)
+                batch = []
+                if progress:
+                    progress(stats)
+            if limit and stats["due"] >= limit:
+                break
+
+        if batch:
+            _refresh_batch(backend, pool, batch, margin, stats)
+    if progress:
+        progress(stats)
+    return stats
+
+
+def _save_refreshed(model, social, before):
+    """
+    Guarda el extra_data refrescado solo si la fila, releída con
+    select_for_update, sigue con el access token `before`.
+    """
+    with transaction.atomic():
+        row = model.objects.select_for_update().only("pk", "extra_data").filter(pk=social.pk).first()
+        if row is None or (row.extra_data or {}).get("access_token") != before:
+            return False
+        row.extra_data = social.extra_data
+        row.save(update_fields=["extra_data"])
+    return True
+
+
+def _refresh_batch(backend, pool, batch, margin, stats):
+    from social_django.models import UserSocialAuth
+
+    cache = get_cache(backend)
+    lock_ttl = backend.setting("REFRESH_LOCK_TTL", DEFAULT_REFRESH_LOCK_TTL)
+    locked = [social for social in batch if cache.add(_lock_key(social), 1, lock_ttl)]
+    stats["busy"] += len(batch) - len(locked)
+
+    def refresh(social):
+        try:
+            return _apply_refresh(backend, social)
+        except AuthException as e:
+            logger.warning("[LlaveMX] No se pudo refrescar el token de uid=%s: %s", social.uid, e)
+            return None
+
+    try:
+        # La página se leyó antes de tomar los candados: se relee lo guardado
+        # para no gastar un refresh token que otro ya reemplazó.
+        current = dict(
+            UserSocialAuth.objects.filter(pk__in=[social.pk for social in locked]).values_list("pk", "extra_data")
+        )
+        due = []
+        for social in locked:
+            before = social.extra_data.get("access_token")
+            social.extra_data = current.get(social.pk) or {}
+            if social.extra_data.get("access_token") == before and needs_refresh(social.extra_data, margin):
+                due.append((social, before))
+            else:
+                stats["unchanged"] += 1
+
+        for (social, before), result in zip(due, pool.map(refresh, [social for social, _ in due])):
+            if result is None:
+                stats["failed"] += 1
+            elif result and _save_refreshed(UserSocialAuth, social, before):
+                stats["refreshed"] += 1
+            else:
+                stats["unchanged"] += 1
+    finally:
+        # Los candados se liberan después de escribir, para que quien espere
+        # relea el token nuevo.
+        cache.delete_many([_lock_key(social) for social in locked])
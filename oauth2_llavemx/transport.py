@@ -0,0 +1,556 @@
+"""
+Transporte HTTP compartido para los WS de LlaveMX.
+
+- Un pool de conexiones keep-alive por host (esquema, host, puerto).
+- Seguro para hilos: cada conexión la usa un solo hilo a la vez.
+- Timeouts separados de conexión y de lectura.
+- Los errores se exponen como HTTPError / URLError de urllib para que el
+  backend conserve su manejo de errores existente.
+- DNS en cache por SOCIAL_AUTH_LLAVEMX_DNS_TTL segundos. Se refresca al
+  tomar una conexión del pool con la entrada vencida (solo la consulta DNS,
+  sin abrir sockets); si las direcciones cambiaron, se descartan las
+  conexiones ociosas del host.
+- Las conexiones HTTPS reanudan la sesión TLS más reciente del host
+  (handshake abreviado) con un SSLContext compartido.
+- warm() abre conexiones por adelantado; prewarm_once() lo hace una sola vez
+  por proceso, en un hilo que termina al acabar, con el primer request que
+  atiende el worker (SOCIAL_AUTH_LLAVEMX_PREWARM_CONNECTIONS). Los procesos
+  que no atienden requests (comandos, Celery) no abren nada.
+- Respeta el proxy de salida del entorno como urlopen (HTTPS_PROXY,
+  HTTP_PROXY, NO_PROXY): HTTPS por túnel CONNECT, HTTP en forma absoluta.
+- Una conexión del pool que el servidor cerró se descarta antes de enviar.
+  Si falla ya enviada la solicitud, solo se reintenta si es idempotente: un
+  POST a /obtenerToken o /cerrarSesion nunca se envía dos veces.
+- read_timeout acota la respuesta completa, no cada recv: un servidor que
+  manda el body gota a gota no pasa del límite.
+"""
+
+import base64
+import http.client
+import io
+import logging
+import os
+import select
+import socket
+import ssl
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 15
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_DNS_TTL = 300
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_READ_CHUNK = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+# Errores típicos de una conexión keep-alive que el servidor ya cerró.
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class WSHTTPError(HTTPError):
+    """HTTPError que conserva el body completo (para métricas y diagnóstico)."""
+
+    def __init__(self, url, code, msg, hdrs, body):
+        super().__init__(url, code, msg, hdrs, io.BytesIO(body))
+        self.body = body
+
+
+def proxy_for(scheme, host):
+    """
+    Proxy de salida para el host según el entorno (el mismo criterio que
+    urlopen): (host, puerto, headers para el proxy) o None.
+    """
+    proxy = getproxies().get(scheme)
+    if not proxy or proxy_bypass(host):
+        return None
+    if "://" not in proxy:
+        proxy = f"http://{proxy}"
+    parts = urlsplit(proxy)
+    headers = {}
+    if parts.username:
+        raw = f"{unquote(parts.username)}:{unquote(parts.password or '')}".encode("utf-8")
+        headers["Proxy-Authorization"] = f"Basic {base64.b64encode(raw).decode('ascii')}"
+    return parts.hostname, parts.port or 80, headers
+
+
+class _PooledHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection que resuelve el host con el DNS en cache del transporte."""
+
+    # Hacia un proxy HTTP la solicitud lleva la URL completa (forma absoluta).
+    proxy_headers = None
+
+    def __init__(self, transport, host, port):
+        super().__init__(host, port, timeout=transport.connect_timeout)
+        self._transport = transport
+
+    def connect(self):
+        self.sock = self._transport._open_socket(self.host, self.port, self.timeout)
+
+
+class _PooledHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection con DNS en cache y reanudación de sesión TLS."""
+
+    proxy_headers = None
+
+    def __init__(self, transport, host, port):
+        super().__init__(host, port, timeout=transport.connect_timeout, context=transport.ssl_context)
+        self._transport = transport
+
+    def connect(self):
+        sock = self._transport._open_socket(self.host, self.port, self.timeout)
+        # Con proxy, self.host es el proxy y el destino TLS es el del túnel.
+        host, port = self._tunnel_host or self.host, self._tunnel_port or self.port
+        try:
+            if self._tunnel_host:
+                self.sock = sock
+                self._tunnel()
+            session = self._transport._tls_session(host, port)
+            self.sock = self._context.wrap_socket(sock, server_hostname=host, session=session)
+        except BaseException:
+            sock.close()
+            self.sock = None
+            raise
+        self._transport._count_handshake(self.sock.session_reused)
+
+
+def _is_dead(conn):
+    """
+    Una conexión ociosa es legible solo si el servidor la cerró (EOF) o envió
+    algo inesperado; en ambos casos ya no sirve.
+    """
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    if not readable:
+        return False
+    if isinstance(conn.sock, ssl.SSLSocket):
+        # TLS 1.3 envía los tickets de sesión después del handshake: el socket
+        # queda legible sin datos de aplicación y la conexión sigue viva.
+        try:
+            conn.sock.setblocking(False)
+            try:
+                conn.sock.recv(1)
+            finally:
+                conn.sock.setblocking(True)
+        except ssl.SSLWantReadError:
+            return False
+        except OSError:
+            return True
+    return True
+
+
+class LlaveMXTransport:
+    """Pool de conexiones HTTP(S) persistentes por host."""
+
+    def __init__(
+        self,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        dns_ttl=DEFAULT_DNS_TTL,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_maxsize = pool_maxsize
+        self.dns_ttl = dns_ttl
+        self.ssl_context = ssl.create_default_context()
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._dns = {}
+        self._tls_sessions = {}
+        self._handshakes = {"full": 0, "resumed": 0}
+        self._proxies = {}
+
+    # -------------------------------------------------------------
+    # DNS
+    # -------------------------------------------------------------
+    def _lookup(self, host, port):
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        return tuple((family, socktype, proto, sockaddr) for family, socktype, proto, _, sockaddr in infos)
+
+    def _resolve(self, host, port):
+        if self.dns_ttl <= 0:
+            return self._lookup(host, port)
+        with self._lock:
+            entry = self._dns.get((host, port))
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        addresses = self._lookup(host, port)
+        with self._lock:
+            self._dns[(host, port)] = (time.monotonic() + self.dns_ttl, addresses)
+        return addresses
+
+    def refresh_dns(self):
+        """
+        Vuelve a resolver los hosts conocidos. Si las direcciones de un host
+        cambiaron se cierran sus conexiones ociosas (apuntan a la IP anterior).
+        Regresa los hosts que cambiaron.
+        """
+        with self._lock:
+            known = dict(self._dns)
+
+        changed = []
+        for (host, port), (_, previous) in known.items():
+            try:
+                addresses = self._lookup(host, port)
+            except OSError as e:
+                logger.warning("[LlaveMX] No se pudo resolver %s: %s", host, e)
+                continue
+            with self._lock:
+                self._dns[(host, port)] = (time.monotonic() + self.dns_ttl, addresses)
+            if set(addresses) != set(previous):
+                changed.append(host)
+                self._drop_idle(lambda key: key[1:] == (host, port))
+        return changed
+
+    def _dns_changed(self, host, port):
+        """
+        Si la entrada DNS del host ya venció, lo vuelve a resolver y regresa
+        True cuando las direcciones cambiaron. Si la consulta falla se siguen
+        usando las anteriores hasta el siguiente vencimiento.
+        """
+        if self.dns_ttl <= 0:
+            return False
+        with self._lock:
+            entry = self._dns.get((host, port))
+        if entry is None or entry[0] > time.monotonic():
+            return False
+        previous = entry[1]
+        try:
+            addresses = self._lookup(host, port)
+        except OSError as e:
+            logger.warning("[LlaveMX] No se pudo resolver %s: %s", host, e)
+            addresses = previous
+        with self._lock:
+            self._dns[(host, port)] = (time.monotonic() + self.dns_ttl, addresses)
+        return set(addresses) != set(previous)
+
+    def _open_socket(self, host, port, timeout):
+        """Como socket.create_connection(), pero con las direcciones en cache."""
+        error = None
+        for family, socktype, proto, sockaddr in self._resolve(host, port):
+            sock = socket.socket(family, socktype, proto)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(sockaddr)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        # Ninguna dirección respondió: la siguiente conexión vuelve a resolver.
+        with self._lock:
+            self._dns.pop((host, port), None)
+        raise error or OSError(f"Sin direcciones para {host}")
+
+    # -------------------------------------------------------------
+    # TLS
+    # -------------------------------------------------------------
+    def _tls_session(self, host, port):
+        with self._lock:
+            return self._tls_sessions.get((host, port))
+
+    def _remember_tls_session(self, key, conn):
+        # Con TLS 1.3 el ticket llega después del handshake: se toma al
+        # devolver la conexión al pool, cuando ya se leyó una respuesta.
+        session = getattr(conn.sock, "session", None)
+        if session is not None and (session.has_ticket or conn.sock.version() != "TLSv1.3"):
+            with self._lock:
+                self._tls_sessions[key[1:]] = session
+
+    def _count_handshake(self, resumed):
+        with self._lock:
+            self._handshakes["resumed" if resumed else "full"] += 1
+
+    # -------------------------------------------------------------
+    # Pool
+    # -------------------------------------------------------------
+    def _proxy(self, scheme, host):
+        try:
+            return self._proxies[(scheme, host)]
+        except KeyError:
+            proxy = self._proxies[(scheme, host)] = proxy_for(scheme, host)
+            return proxy
+
+    def _new_connection(self, scheme, host, port):
+        proxy = self._proxy(scheme, host)
+        if proxy is None:
+            if scheme == "https":
+                return _PooledHTTPSConnection(self, host, port)
+            return _PooledHTTPConnection(self, host, port)
+
+        proxy_host, proxy_port, proxy_headers = proxy
+        if scheme == "https":
+            conn = _PooledHTTPSConnection(self, proxy_host, proxy_port)
+            conn.set_tunnel(host, port, proxy_headers)
+            return conn
+        conn = _PooledHTTPConnection(self, proxy_host, proxy_port)
+        conn.proxy_headers = proxy_headers
+        return conn
+
+    def _acquire(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            conn = pool.pop() if pool else None
+        if conn is None:
+            return self._new_connection(*key), False
+        if self._dns_changed(conn.host, conn.port):
+            # Las ociosas apuntan a la dirección anterior del host (o del proxy).
+            conn.close()
+            self._drop_idle(lambda k: k == key)
+            return self._new_connection(*key), False
+        return conn, True
+
+    def _release(self, key, conn):
+        if key[0] == "https":
+            self._remember_tls_session(key, conn)
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_maxsize:
+                pool.append(conn)
+                return
+        conn.close()
+
+    def _drop_idle(self, predicate):
+        with self._lock:
+            dropped = [conn for key in list(self._pools) if predicate(key) for conn in self._pools.pop(key)]
+        for conn in dropped:
+            conn.close()
+
+    def close(self):
+        """Cierra todas las conexiones ociosas del pool."""
+        self._drop_idle(lambda key: True)
+
+    def _forget(self):
+        """Tras un fork: las conexiones heredadas pertenecen al proceso padre."""
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._tls_sessions = {}
+
+    # -------------------------------------------------------------
+    # Pre-calentamiento
+    # -------------------------------------------------------------
+    def warm(self, url, connections):
+        """
+        Deja hasta `connections` conexiones abiertas (DNS + TCP + TLS) hacia
+        el host de `url`. Las ociosas que el servidor ya cerró se descartan.
+        Regresa cuántas conexiones quedaron listas.
+        """
+        key = _pool_key(url)
+        with self._lock:
+            pool = self._pools.get(key, [])
+            alive = [conn for conn in pool if not _is_dead(conn)]
+            dead = [conn for conn in pool if conn not in alive]
+            self._pools[key] = alive
+        for conn in dead:
+            conn.close()
+
+        missing = min(connections, self.pool_maxsize) - len(alive)
+        for _ in range(max(missing, 0)):
+            conn = self._new_connection(*key)
+            try:
+                conn.connect()
+            except OSError as e:
+                conn.close()
+                logger.warning("[LlaveMX] No se pudo pre-calentar %s: %s", key[1], e)
+                break
+            self._release(key, conn)
+
+        with self._lock:
+            return len(self._pools.get(key, []))
+
+    def stats(self):
+        """Conexiones ociosas listas por host, sesiones TLS y handshakes."""
+        with self._lock:
+            hosts = {f"{scheme}://{host}:{port}": len(pool) for (scheme, host, port), pool in self._pools.items()}
+            return {
+                "warm": sum(hosts.values()),
+                "hosts": hosts,
+                "tls_sessions": len(self._tls_sessions),
+                "handshakes": dict(self._handshakes),
+                "dns_entries": len(self._dns),
+            }
+
+    # -------------------------------------------------------------
+    # Request
+    # -------------------------------------------------------------
+    def request(self, method, url, headers=None, body=None, timeout=None, idempotent=None):
+        """
+        Ejecuta la solicitud y regresa el body de la respuesta en bytes.
+
+        Lanza HTTPError para respuestas >= 400 (con el body legible vía
+        e.read()) y URLError para errores de red. timeout acota los timeouts
+        de conexión y lectura de esta llamada (presupuesto del login).
+        idempotent (por defecto según el método) decide si una conexión
+        reutilizada que falla después de enviar se reintenta con otra.
+        """
+        connect_timeout, read_timeout = self.connect_timeout, self.read_timeout
+        if timeout is not None:
+            connect_timeout, read_timeout = min(connect_timeout, timeout), min(read_timeout, timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        parts = urlsplit(url)
+        key = _pool_key(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        while True:
+            conn, reused = self._acquire(key)
+            if reused and _is_dead(conn):
+                # El servidor ya cerró la conexión ociosa: se descarta sin enviar nada.
+                conn.close()
+                continue
+            try:
+                if conn.sock is None:
+                    conn.timeout = connect_timeout
+                    conn.connect()
+                sock = conn.sock
+                sock.settimeout(read_timeout)
+                deadline = time.monotonic() + read_timeout
+                if conn.proxy_headers is not None:
+                    conn.request(method, url, body=body, headers={**(headers or {}), **conn.proxy_headers})
+                else:
+                    conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = _read_body(sock, resp, deadline)
+            except _STALE_ERRORS as e:
+                conn.close()
+                if reused and idempotent:
+                    # Se cerró justo al enviar: solo se repite lo que es seguro repetir.
+                    continue
+                raise URLError(e)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise URLError(e)
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+        if resp.status >= 400:
+            raise WSHTTPError(url, resp.status, resp.reason, resp.headers, data)
+        return data
+
+
+def _read_body(sock, resp, deadline):
+    """Lee el body completo sin pasar de `deadline` (el timeout de cada recv es lo que resta)."""
+    chunks = []
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            resp.close()
+            raise socket.timeout("timed out")
+        sock.settimeout(remaining)
+        chunk = resp.read1(_READ_CHUNK)
+        if not chunk:
+            # Con Content-Length, read1() no marca la respuesta como terminada.
+            resp.read()
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _pool_key(url):
+    parts = urlsplit(url)
+    scheme = parts.scheme or "https"
+    port = parts.port or (443 if scheme == "https" else 80)
+    return (scheme, parts.hostname, port)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(
+    connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+    read_timeout=DEFAULT_READ_TIMEOUT,
+    pool_maxsize=DEFAULT_POOL_MAXSIZE,
+    dns_ttl=DEFAULT_DNS_TTL,
+    pool=None,
+):
+    """
+    Regresa el transporte compartido del proceso para esta configuración.
+    `pool` separa transportes con la misma configuración (un pool por sitio).
+    """
+    key = (connect_timeout, read_timeout, pool_maxsize, dns_ttl, pool)
+    transport = _transports.get(key)
+    if transport is None:
+        with _transports_lock:
+            transport = _transports.get(key)
+            if transport is None:
+                transport = LlaveMXTransport(connect_timeout, read_timeout, pool_maxsize, dns_ttl)
+                _transports[key] = transport
+    return transport
+
+
+# -------------------------------------------------------------
+# Pre-calentamiento en segundo plano
+# -------------------------------------------------------------
+_prewarm = {"target": None, "done": False}
+_prewarm_lock = threading.Lock()
+
+
+def set_prewarm(target):
+    """Registra target() para que prewarm_once() lo ejecute en este proceso."""
+    _prewarm["target"], _prewarm["done"] = target, False
+
+
+def _run_prewarm(target):
+    try:
+        target()
+    except Exception:
+        logger.exception("[LlaveMX] Falló el pre-calentamiento de conexiones")
+
+
+def prewarm_once():
+    """
+    Ejecuta el target registrado una sola vez por proceso, en un hilo daemon
+    que termina al acabar (no bloquea el request que lo dispara). Regresa el
+    hilo, o None si no hay target o ya se ejecutó.
+    """
+    if _prewarm["done"] or _prewarm["target"] is None:
+        return None
+    with _prewarm_lock:
+        if _prewarm["done"]:
+            return None
+        _prewarm["done"] = True
+    thread = threading.Thread(
+        target=_run_prewarm,
+        args=(_prewarm["target"],),
+        name="llavemx-prewarm",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _after_fork_in_child():
+    global _transports_lock, _prewarm_lock
+    _transports_lock = threading.Lock()
+    _prewarm_lock = threading.Lock()
+    for transport in _transports.values():
+        transport._forget()
+    # El hijo (gunicorn --preload) pre-calienta con su propio primer request.
+    _prewarm["done"] = False
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,27 @@
+"""
+Django mínimo para las pruebas: el mismo de los benchmarks (SQLite,
+social_django, oauth2_llavemx y el sustituto de custom_reg_form), con
+CsrfViewMiddleware para los state firmados.
+"""
+
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+
+def pytest_configure(config):
+    from benchmarks import harness
+
+    harness.setup_django(MIDDLEWARE=["django.middleware.csrf.CsrfViewMiddleware"])
+
+
+@pytest.fixture
+def clean_proxy_env(monkeypatch):
+    """Sin proxy del entorno: cada prueba fija el suyo si lo necesita."""
+    for name in ("http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY", "no_proxy", "NO_PROXY"):
+        monkeypatch.delenv(name, raising=False)
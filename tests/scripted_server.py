@@ -0,0 +1,124 @@
+"""
+Servidor de sockets local para las pruebas de transporte: cada conexión se
+atiende con el siguiente handler del guion y se registran las solicitudes.
+"""
+
+import socket
+import threading
+import time
+
+OK = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\n{}"
+
+
+class ScriptedServer:
+    """Atiende cada conexión con el siguiente handler de `script`; registra las solicitudes."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = []
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while self.script:
+            conn, _ = self.sock.accept()
+            handler = self.script.pop(0)
+            threading.Thread(target=handler, args=(self, conn), daemon=True).start()
+
+    def read_request(self, conn):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return None
+            data += chunk
+        head, _, body = data.partition(b"\r\n\r\n")
+        length = next(
+            (int(line.split(b":")[1]) for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")),
+            0,
+        )
+        while len(body) < length:
+            body += conn.recv(4096)
+        line = head.split(b"\r\n", 1)[0].decode()
+        self.requests.append(line)
+        return line
+
+    def close(self):
+        self.sock.close()
+
+
+def answer_then_reset(server, conn):
+    """Responde una vez y, en la siguiente solicitud, la procesa y corta sin responder."""
+    server.read_request(conn)
+    conn.sendall(OK)
+    server.read_request(conn)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b"\x01\x00\x00\x00\x00\x00\x00\x00")
+    conn.close()
+
+
+def answer_then_close(server, conn):
+    server.read_request(conn)
+    conn.sendall(OK)
+    conn.close()
+
+
+def answer(server, conn):
+    while server.read_request(conn):
+        conn.sendall(OK)
+    conn.close()
+
+
+def drip(server, conn):
+    server.read_request(conn)
+    conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n")
+    try:
+        for _ in range(100):
+            conn.sendall(b"x")
+            time.sleep(0.05)
+    except OSError:
+        pass
+    conn.close()
+
+
+def refuse_tunnel(server, conn):
+    server.read_request(conn)
+    conn.sendall(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n")
+    conn.close()
+
+
+def endless(server, conn):
+    """Respuesta sin Content-Length que nunca termina de llegar."""
+    server.read_request(conn)
+    conn.sendall(b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n")
+    try:
+        while True:
+            conn.sendall(b"x" * 65536)
+    except OSError:
+        pass
+    conn.close()
+
+
+def _response(status, body):
+    reason = {200: "OK", 401: "Unauthorized", 503: "Service Unavailable"}.get(status, "Error")
+    return f"HTTP/1.1 {status} {reason}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+
+
+def reply(status, body):
+    """Handler que responde `status` con `body` a cada solicitud."""
+    return replies(*[(status, body)] * 1000)
+
+
+def replies(*responses):
+    """Handler que responde cada solicitud con el siguiente (status, body) de la lista."""
+    pending = [_response(status, body) for status, body in responses]
+
+    def handler(server, conn):
+        while pending and server.read_request(conn):
+            conn.sendall(pending.pop(0))
+        conn.close()
+
+    return handler
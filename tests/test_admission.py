@@ -0,0 +1,83 @@
+"""
+Control de admisión compartido: un pico de llamadas se reparte en turnos a
+la tasa configurada y lo que no cabe en la espera máxima se rechaza.
+"""
+
+import asyncio
+
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+from social_core.exceptions import AuthUnknownError
+from social_django.utils import load_strategy
+
+from oauth2_llavemx.admission import AdmissionController, AdmissionRejected
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+NOW = 1_000_000.0
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_burst_is_spread_at_the_configured_rate():
+    admission = AdmissionController(cache, "token", rate=4, max_wait=2, window=0.5)
+
+    delays = [admission.reserve(now=NOW) for _ in range(8)]
+
+    assert delays == pytest.approx([0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75])
+
+
+def test_calls_beyond_max_wait_are_rejected():
+    admission = AdmissionController(cache, "token", rate=4, max_wait=1, window=0.5)
+    for _ in range(5):
+        admission.reserve(now=NOW)
+
+    with pytest.raises(AdmissionRejected):
+        admission.reserve(now=NOW)
+
+
+def test_endpoints_have_separate_quotas():
+    token = AdmissionController(cache, "token", rate=1, max_wait=0)
+    token.reserve(now=NOW)
+
+    assert AdmissionController(cache, "user_data", rate=1, max_wait=0).reserve(now=NOW) == 0
+    with pytest.raises(AdmissionRejected):
+        token.reserve(now=NOW)
+
+
+def test_async_reserve_shares_the_quota():
+    admission = AdmissionController(cache, "token", rate=2, max_wait=0.5, window=0.5)
+    admission.reserve(now=NOW)
+
+    assert asyncio.run(admission.areserve(now=NOW)) == pytest.approx(0.5)
+    with pytest.raises(AdmissionRejected):
+        asyncio.run(admission.areserve(now=NOW))
+
+
+class OfflineBackend(LlaveMXOAuth2):
+    calls = 0
+
+    def _transport(self):
+        class Transport:
+            def request(self, *args, **kwargs):
+                OfflineBackend.calls += 1
+                return b"{}"
+
+        return Transport()
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_ADMISSION_RATES={"user_data": 1}, SOCIAL_AUTH_LLAVEMX_ADMISSION_MAX_WAIT=0)
+def test_rejected_call_fails_the_login_without_network():
+    OfflineBackend.calls = 0
+    backend = OfflineBackend(strategy=load_strategy())
+    backend._ws_request("user_data", "GET", "https://llavemx.example/datosUsuario", {})
+
+    with pytest.raises(AuthUnknownError, match="muchos inicios de sesión"):
+        with backend._ws_errors("user_data"):
+            backend._ws_request("user_data", "GET", "https://llavemx.example/datosUsuario", {})
+    assert OfflineBackend.calls == 1
@@ -0,0 +1,108 @@
+"""
+associate_by_curp: CurpIndex solo aporta candidatos; la decisión sale de la
+CURP vigente en ExtraInfo, aunque el índice esté desactualizado.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from custom_reg_form.models import ExtraInfo
+from django.contrib.auth import get_user_model
+
+from oauth2_llavemx.models import GENERIC_CURP, CurpIndex
+from oauth2_llavemx.pipeline import associate_by_curp
+
+CURP = "PRUE800101HDFXXX01"
+OTHER_CURP = "OTRA900202MDFXXX02"
+
+BACKEND = SimpleNamespace(name="llavemx")
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    yield
+    CurpIndex.objects.all().delete()
+    ExtraInfo.objects.all().delete()
+    User.objects.all().delete()
+
+
+def _user(username, curp, is_active=True):
+    user = User.objects.create(username=username, is_active=is_active)
+    ExtraInfo.objects.create(user=user, curp=curp)
+    return user
+
+
+def _associate(curp=CURP, user=None):
+    return associate_by_curp(BACKEND, {"curp": curp}, user=user)["user"]
+
+
+def test_unique_active_user_is_associated():
+    user = _user("ana", CURP)
+    _user("otro", OTHER_CURP)
+
+    assert _associate(" prue800101hdfxxx01 ") == user
+
+
+def test_ambiguous_active_users_are_not_associated():
+    _user("ana", CURP)
+    _user("ana2", CURP.lower())
+
+    assert _associate() is None
+
+
+def test_single_inactive_user_is_associated():
+    user = _user("ana", CURP, is_active=False)
+
+    assert _associate() == user
+
+
+def test_active_user_wins_over_inactive_duplicate():
+    _user("vieja", CURP, is_active=False)
+    user = _user("ana", CURP)
+
+    assert _associate() == user
+
+
+def test_several_inactive_users_are_not_associated():
+    _user("vieja", CURP, is_active=False)
+    _user("vieja2", CURP, is_active=False)
+
+    assert _associate() is None
+
+
+def test_generic_curp_is_never_associated():
+    _user("extranjero", GENERIC_CURP)
+
+    assert _associate(GENERIC_CURP) is None
+
+
+def test_existing_user_is_kept():
+    user = _user("ana", OTHER_CURP)
+
+    assert _associate(user=user) == user
+
+
+def test_stale_index_entry_does_not_associate():
+    # QuerySet.update() no dispara señales: el índice sigue con la CURP vieja.
+    user = _user("ana", CURP)
+    ExtraInfo.objects.filter(user=user).update(curp=OTHER_CURP)
+    assert CurpIndex.objects.filter(curp=CURP, user=user).exists()
+
+    assert _associate() is None
+
+
+def test_duplicate_missing_from_index_is_still_ambiguous():
+    _user("ana", CURP)
+    intruder = User.objects.create(username="nuevo")
+    ExtraInfo.objects.bulk_create([ExtraInfo(user=intruder, curp=CURP)])
+    assert CurpIndex.objects.filter(curp=CURP).count() == 1
+
+    assert _associate() is None
+
+
+def test_index_entry_for_deleted_extra_info_is_ignored():
+    user = _user("ana", CURP)
+    ExtraInfo.objects.filter(user=user)._raw_delete(ExtraInfo.objects.db)
+
+    assert _associate() is None
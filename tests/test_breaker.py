@@ -0,0 +1,124 @@
+"""
+Circuit breaker compartido y reintentos acotados de los WS: las fallas de
+red o 5xx abren el breaker, un 4xx no; solo lo idempotente se reintenta.
+"""
+
+from urllib.error import HTTPError
+
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+from scripted_server import ScriptedServer, reply, replies
+from social_core.exceptions import AuthFailed, AuthUnknownError
+from social_django.utils import load_strategy
+
+from oauth2_llavemx import breaker as breaker_module
+from oauth2_llavemx.breaker import HALF_OPEN, CircuitBreaker, CircuitOpenError
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+pytestmark = pytest.mark.usefixtures("clean_proxy_env")
+
+UNAVAILABLE = (503, b"<html>Service Unavailable</html>")
+OK = (200, b"{}")
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _breaker():
+    return CircuitBreaker(cache, "user_data", failure_threshold=2, failure_window=30, reset_timeout=30)
+
+
+def test_breaker_opens_at_threshold():
+    breaker = _breaker()
+    breaker.record_failure(breaker.allow())
+    assert breaker.allow()
+
+    breaker.record_failure(breaker.allow())
+
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_half_open_allows_a_single_probe(monkeypatch):
+    breaker = _breaker()
+    for _ in range(2):
+        breaker.record_failure(breaker.allow())
+    now = breaker_module.time.time()
+    monkeypatch.setattr(breaker_module.time, "time", lambda: now + 31)
+
+    state = breaker.allow()
+    assert state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success(state)
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(monkeypatch):
+    breaker = _breaker()
+    for _ in range(2):
+        breaker.record_failure(breaker.allow())
+    now = breaker_module.time.time()
+    monkeypatch.setattr(breaker_module.time, "time", lambda: now + 31)
+
+    breaker.record_failure(breaker.allow())
+
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def _call(server, method="GET", idempotent=True):
+    backend = LlaveMXOAuth2(strategy=load_strategy())
+    with backend._ws_errors("user_data"):
+        return backend._ws_request("user_data", method, f"{server.url}/datosUsuario", {}, idempotent=idempotent)
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_RETRY_BACKOFF=0)
+def test_idempotent_call_is_retried_after_5xx():
+    server = ScriptedServer(replies(UNAVAILABLE, UNAVAILABLE, OK))
+
+    assert _call(server) == {}
+    assert len(server.requests) == 3
+    server.close()
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_RETRY_BACKOFF=0)
+def test_token_exchange_is_never_retried():
+    server = ScriptedServer(replies(UNAVAILABLE, OK))
+
+    with pytest.raises(AuthFailed):
+        _call(server, method="POST", idempotent=False)
+    assert len(server.requests) == 1
+    server.close()
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_BREAKER_FAILURE_THRESHOLD=2, SOCIAL_AUTH_LLAVEMX_MAX_RETRIES=0)
+def test_open_breaker_fails_fast_without_network():
+    server = ScriptedServer(reply(*UNAVAILABLE))
+    for _ in range(2):
+        with pytest.raises(AuthFailed):
+            _call(server)
+
+    with pytest.raises(AuthUnknownError, match="no está disponible"):
+        _call(server)
+    assert len(server.requests) == 2
+    server.close()
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_BREAKER_FAILURE_THRESHOLD=2, SOCIAL_AUTH_LLAVEMX_MAX_RETRIES=0)
+def test_client_errors_do_not_open_the_breaker():
+    server = ScriptedServer(reply(401, b'{"error": "invalid_token"}'))
+    backend = LlaveMXOAuth2(strategy=load_strategy())
+
+    for _ in range(3):
+        with pytest.raises(HTTPError):
+            backend._ws_request("user_data", "GET", f"{server.url}/datosUsuario", {}, idempotent=True)
+
+    assert len(server.requests) == 3
+    server.close()
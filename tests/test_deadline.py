@@ -0,0 +1,98 @@
+"""
+Presupuesto del login: cada llamada recibe solo lo que resta, el backoff no
+lo excede y un corte por presupuesto no cuenta como falla de LlaveMX.
+"""
+
+import time
+from urllib.error import HTTPError
+
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+from scripted_server import ScriptedServer, drip, reply
+from social_core.exceptions import AuthUnknownError
+from social_django.utils import load_strategy
+
+from oauth2_llavemx.deadline import Deadline, DeadlineExceeded
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+pytestmark = pytest.mark.usefixtures("clean_proxy_env")
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_cap_takes_the_smaller_budget():
+    deadline = Deadline(10)
+
+    assert deadline.cap(2, "token") == 2
+    assert 9 < deadline.cap(None, "token") <= 10
+
+
+def test_cap_fails_once_the_budget_is_spent():
+    deadline = Deadline(0)
+
+    with pytest.raises(DeadlineExceeded):
+        deadline.cap(5, "user_data")
+
+
+def _backend(seconds):
+    backend = LlaveMXOAuth2(strategy=load_strategy())
+    backend._deadline = Deadline(seconds)
+    return backend
+
+
+def test_slow_response_is_cut_at_the_login_budget():
+    server = ScriptedServer(drip)
+    backend = _backend(0.3)
+
+    started = time.monotonic()
+    with pytest.raises(AuthUnknownError, match="tardó demasiado"):
+        with backend._ws_errors("user_data"):
+            backend._ws_request("user_data", "GET", f"{server.url}/datosUsuario", {}, idempotent=True)
+
+    assert time.monotonic() - started < 1
+    server.close()
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_BREAKER_FAILURE_THRESHOLD=1)
+def test_budget_timeout_does_not_open_the_breaker():
+    server = ScriptedServer(drip)
+    with pytest.raises(DeadlineExceeded):
+        _backend(0.2)._ws_request("user_data", "GET", f"{server.url}/datosUsuario", {})
+    server.close()
+
+    assert _backend(5)._breaker("user_data").allow()
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_RETRY_BACKOFF=10)
+def test_retry_backoff_never_outlives_the_budget():
+    server = ScriptedServer(reply(503, b"{}"))
+
+    started = time.monotonic()
+    with pytest.raises(HTTPError):
+        _backend(1)._ws_request("user_data", "GET", f"{server.url}/datosUsuario", {}, idempotent=True)
+
+    assert time.monotonic() - started < 1
+    server.close()
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_LOGIN_TIMEOUT=5)
+def test_budget_only_lives_inside_auth_complete(monkeypatch):
+    backend = LlaveMXOAuth2(strategy=load_strategy())
+    seen = []
+
+    def validate_state():
+        seen.append(backend._remaining())
+        raise AuthUnknownError(backend, "detener")
+
+    monkeypatch.setattr(backend, "validate_state", validate_state)
+    with pytest.raises(AuthUnknownError):
+        backend.auth_complete()
+
+    assert 4 < seen[0] <= 5
+    assert backend._remaining() is None
@@ -0,0 +1,153 @@
+"""
+Paridad del mapeo declarado en fields.py con el get_user_details() y el
+EXTRA_DATA escritos a mano que reemplazó (copiados abajo tal cual).
+"""
+
+import pytest
+from django.test import RequestFactory, override_settings
+from social_django.utils import load_strategy
+
+from benchmarks.llavemx_stub import synthetic_user
+from oauth2_llavemx.details import SESSION_KEY, SESSION_REF_KEY, load_details, store_details
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+
+def baseline_user_details(response):
+    curp = (response.get("curp") or "").strip()
+    login = (response.get("login") or "").strip()
+    username = curp if curp else login
+
+    email = (response.get("correo") or "").strip()
+    if not email and login:
+        email = f"{login}@llavemx.temp"
+
+    nombres = (response.get("nombre") or "").strip()
+    primer_ap = (response.get("primerApellido") or "").strip()
+    segundo_ap = (response.get("segundoApellido") or "").strip()
+
+    full_name = " ".join(filter(None, [nombres, primer_ap, segundo_ap]))
+    last_name = " ".join(filter(None, [primer_ap, segundo_ap]))
+
+    return {
+        "id": response.get("idUsuario", ""),
+        "username": username,
+        "email": email,
+        "name": full_name,
+        "first_name": nombres,
+        "last_name": last_name,
+
+        "nombres": nombres,
+        "primer_apellido": primer_ap,
+        "segundo_apellido": segundo_ap,
+        "curp": curp,
+        "telefono": response.get("telVigente") or response.get("telefono") or "",
+        "fechaNacimiento": response.get("fechaNacimiento") or "",
+        "sexo": response.get("sexo") or "",
+        "correoVerificado": bool(response.get("correoVerificado", False)),
+        "telefonoVerificado": bool(response.get("telefonoVerificado", False)),
+        "estado": response.get("estadoNacimiento") or "",
+        "municipio": (response.get("domicilio") or {}).get("alcaldiaMunicipio", ""),
+
+        "pais": "",
+        "dni": "",
+        "ocupacion": "",
+        "maximo_nivel": "",
+        "eres_docente": False,
+        "cct": "",
+        "funcion": "",
+        "nivel_Educativo": "",
+        "asignatura": "",
+        "cuentanos": "",
+    }
+
+
+BASELINE_PROFILE_EXTRA_DATA = [
+    ("id", "id"),
+    ("curp", "curp"),
+    ("telefono", "telefono"),
+    ("fechaNacimiento", "fechaNacimiento"),
+    ("sexo", "sexo"),
+    ("correoVerificado", "correoVerificado"),
+    ("telefonoVerificado", "telefonoVerificado"),
+]
+
+
+def baseline_extra_data(response, details):
+    # Mismo criterio que social_core BaseAuth.extra_data().
+    return {alias: response.get(name, details.get(name, details.get(alias))) for name, alias in BASELINE_PROFILE_EXTRA_DATA}
+
+
+RESPONSES = [
+    synthetic_user(7, "full"),
+    synthetic_user(7, "minimal"),
+    synthetic_user(7, "no_curp"),
+    {},
+    {
+        "idUsuario": None,
+        "curp": "  PRUE800101HDFXXX01 ",
+        "login": " ana ",
+        "correo": "",
+        "nombre": " Ana ",
+        "primerApellido": None,
+        "segundoApellido": " López ",
+        "telefono": "5551234567",
+        "fechaNacimiento": " 01/01/1990 ",
+        "sexo": " M ",
+        "correoVerificado": 1,
+        "telefonoVerificado": None,
+        "estadoNacimiento": " CDMX ",
+        "domicilio": {"alcaldiaMunicipio": " Coyoacán "},
+    },
+    {"idUsuario": 5, "login": "solo-login", "telVigente": "", "telefono": "555", "domicilio": None},
+    {"idUsuario": 6, "domicilio": {"alcaldiaMunicipio": None}, "fechaNacimiento": None, "estadoNacimiento": ""},
+]
+
+
+@pytest.fixture
+def backend():
+    return LlaveMXOAuth2(strategy=load_strategy())
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_user_details_match_baseline(backend, response):
+    assert backend.get_user_details(dict(response)) == baseline_user_details(response)
+
+
+@pytest.mark.parametrize("response", RESPONSES)
+def test_profile_extra_data_match_baseline(backend, response):
+    details = backend.get_user_details(response)
+    data = backend.extra_data(None, "uid", response, details, {})
+
+    profile = {alias: data[alias] for _, alias in BASELINE_PROFILE_EXTRA_DATA}
+    assert profile == baseline_extra_data(response, details)
+
+
+def test_roles_only_present_when_fetched(backend):
+    assert "roles" not in backend.get_user_details(synthetic_user(7))
+    assert backend.get_user_details({**synthetic_user(7), "roles": ["ADMIN"]})["roles"] == ["ADMIN"]
+
+
+def test_session_keeps_full_details(backend):
+    request = RequestFactory().get("/")
+    request.session = {}
+    backend = LlaveMXOAuth2(strategy=load_strategy(request))
+    details = backend.get_user_details(synthetic_user(7, "minimal"))
+
+    store_details(backend, details)
+
+    assert request.session[SESSION_KEY] == details
+    assert load_details(request.session) == details
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_DETAILS_STORAGE="cache")
+def test_cache_mode_round_trips_details():
+    request = RequestFactory().get("/")
+    request.session = {}
+    backend = LlaveMXOAuth2(strategy=load_strategy(request))
+    details = backend.get_user_details(synthetic_user(7, "minimal"))
+
+    store_details(backend, details)
+
+    assert SESSION_KEY not in request.session
+    assert request.session[SESSION_REF_KEY]
+    assert load_details(request.session) == details
@@ -0,0 +1,95 @@
+"""
+Las etiquetas de error de las métricas salen de un conjunto fijo: el texto
+que manda LlaveMX no crea series nuevas.
+"""
+
+from urllib.error import HTTPError, URLError
+
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+from scripted_server import ScriptedServer, drip, reply
+from social_django.utils import load_strategy
+
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+from oauth2_llavemx.metrics import ERROR_LABELS, NullSink, StatsdSink
+
+pytestmark = pytest.mark.usefixtures("clean_proxy_env")
+
+
+class RecordingSink(NullSink):
+    enabled = True
+
+    def __init__(self):
+        self.errors = []
+
+    def count_error(self, endpoint, error):
+        self.errors.append((endpoint, error))
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    cache.clear()
+    sink = RecordingSink()
+    monkeypatch.setattr("oauth2_llavemx.llavemx_oauth.get_metrics_sink", lambda: sink)
+    yield sink
+    cache.clear()
+
+
+def _call(server):
+    backend = LlaveMXOAuth2(strategy=load_strategy())
+    return backend._ws_request("user_data", "GET", f"{server.url}/datosUsuario", {})
+
+
+def test_error_code_in_body_is_not_a_label(sink):
+    server = ScriptedServer(reply(200, b'{"error": "<html>sesion 91ac7e expirada"}'))
+
+    _call(server)
+
+    assert sink.errors == [("user_data", "other")]
+    server.close()
+
+
+def test_invalid_token_is_recognized(sink):
+    server = ScriptedServer(reply(401, b'{"error": "invalid_token"}'))
+
+    with pytest.raises(HTTPError):
+        _call(server)
+
+    assert sink.errors == [("user_data", "invalid_token")]
+    server.close()
+
+
+def test_http_errors_are_grouped_by_class(sink):
+    for status, body in ((503, b"<html>Service Unavailable</html>"), (404, b'{"error": "no existe"}')):
+        server = ScriptedServer(reply(status, body))
+        with pytest.raises(HTTPError):
+            _call(server)
+        server.close()
+
+    assert sink.errors == [("user_data", "http_5xx"), ("user_data", "http_4xx")]
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_READ_TIMEOUT=0.2)
+def test_timeout_and_network_errors(sink):
+    server = ScriptedServer(drip)
+    with pytest.raises(URLError):
+        _call(server)
+    server.close()
+
+    with pytest.raises(URLError):
+        _call(server)
+
+    assert sink.errors == [("user_data", "timeout"), ("user_data", "network")]
+
+
+def test_statsd_never_puts_free_text_in_the_metric_name():
+    sent = []
+    statsd = StatsdSink("127.0.0.1")
+    statsd._send = sent.append
+
+    statsd.count_error("user_data", "invalid.token|c\nllavemx.otro")
+    statsd.count_error("user_data", "timeout")
+
+    assert sent == ["ws.user_data.error.other:1|c", "ws.user_data.error.timeout:1|c"]
+    assert {"invalid_token", "http_4xx", "http_5xx", "timeout", "network", "other"} == ERROR_LABELS
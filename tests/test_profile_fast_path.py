@@ -0,0 +1,114 @@
+"""
+Camino rápido del perfil (PROFILE_FAST_PATH): la huella solo se guarda cuando
+la sincronización del usuario terminó, y un perfil sin cambios solo escribe
+los tokens.
+"""
+
+import pytest
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from social_django.models import UserSocialAuth
+from social_django.utils import load_strategy
+
+from oauth2_llavemx import pipeline
+from oauth2_llavemx.apps import OAuth2LlaveMXConfig
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+User = get_user_model()
+
+PROFILE = {
+    "idUsuario": 4242,
+    "curp": "PRUE800101HDFXXX01",
+    "nombre": "Ana",
+    "primerApellido": "Prueba",
+    "correo": "ana@example.mx",
+}
+
+
+@pytest.fixture
+def social():
+    user = User.objects.create(username="ana", email="ana@example.mx")
+    social = UserSocialAuth.objects.create(user=user, provider="llavemx", uid="4242", extra_data={})
+    yield social
+    UserSocialAuth.objects.all().delete()
+    User.objects.all().delete()
+
+
+def _login(social, profile, token="token-1"):
+    """Corre load_extra_data -> user_details -> save_profile_fp como el pipeline."""
+    backend = LlaveMXOAuth2(strategy=load_strategy())
+    details = backend.get_user_details(profile)
+    response = {"access_token": token, "refresh_token": "refresh", "expires_in": 900}
+    kwargs = {"backend": backend, "strategy": backend.strategy, "details": details, "response": response,
+              "uid": social.uid, "user": social.user, "social": social}
+    for step in (pipeline.load_extra_data, pipeline.user_details, pipeline.save_profile_fp):
+        kwargs.update(step(**kwargs) or {})
+    social.refresh_from_db()
+    social.user.refresh_from_db()
+    return kwargs
+
+
+def test_changed_profile_syncs_user_and_saves_fingerprint(social):
+    result = _login(social, PROFILE)
+
+    assert result[pipeline.PROFILE_UNCHANGED] is False
+    assert social.user.first_name == "Ana"
+    assert social.extra_data[pipeline.PROFILE_FP_KEY] == result[pipeline.PROFILE_FP_PENDING]
+
+
+def test_unchanged_profile_only_writes_tokens(social):
+    _login(social, PROFILE)
+    User.objects.filter(pk=social.user.pk).update(first_name="Editado localmente")
+
+    result = _login(social, PROFILE, token="token-2")
+
+    assert result[pipeline.PROFILE_UNCHANGED] is True
+    assert social.extra_data["access_token"] == "token-2"
+    # Con el camino rápido no se corrige la edición local (por eso es opt-in).
+    assert social.user.first_name == "Editado localmente"
+
+
+def test_failed_sync_does_not_store_fingerprint(social, monkeypatch):
+    def broken_user_details(*args, **kwargs):
+        raise RuntimeError("falló la sincronización")
+
+    monkeypatch.setattr("social_core.pipeline.user.user_details", broken_user_details)
+    with pytest.raises(RuntimeError):
+        _login(social, PROFILE)
+    social.refresh_from_db()
+    assert pipeline.PROFILE_FP_KEY not in social.extra_data
+
+    monkeypatch.undo()
+    result = _login(social, PROFILE, token="token-2")
+
+    assert result[pipeline.PROFILE_UNCHANGED] is False
+    assert social.user.first_name == "Ana"
+
+
+def _swapped(pipeline_steps, **overrides):
+    with override_settings(SOCIAL_AUTH_PIPELINE=list(pipeline_steps), **overrides):
+        OAuth2LlaveMXConfig._swap_profile_sync_steps(None)
+        return list(settings.SOCIAL_AUTH_PIPELINE)
+
+
+STEPS = [
+    "social_core.pipeline.social_auth.load_extra_data",
+    "social_core.pipeline.user.user_details",
+    "common.djangoapps.third_party_auth.pipeline.user_details_force_sync",
+    "common.djangoapps.third_party_auth.pipeline.set_id_verification_status",
+]
+
+
+def test_fast_path_is_opt_in():
+    assert _swapped(STEPS) == STEPS
+
+
+def test_fast_path_swaps_steps_and_saves_fingerprint_last():
+    assert _swapped(STEPS, SOCIAL_AUTH_LLAVEMX_PROFILE_FAST_PATH=True) == [
+        "oauth2_llavemx.pipeline.load_extra_data",
+        "oauth2_llavemx.pipeline.user_details",
+        "oauth2_llavemx.pipeline.user_details_force_sync",
+        "oauth2_llavemx.pipeline.save_profile_fp",
+        "common.djangoapps.third_party_auth.pipeline.set_id_verification_status",
+    ]
@@ -0,0 +1,130 @@
+"""
+revoke_all(): el refresco previo al logout se guarda antes de /cerrarSesion
+y la limpieza de tokens no pisa lo que un login escribió durante el lote.
+"""
+
+import io
+import time
+from urllib.error import HTTPError
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
+from social_django.models import UserSocialAuth
+from social_django.utils import load_strategy
+
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+from oauth2_llavemx.revocation import RevocationQueue, revoke_all
+
+User = get_user_model()
+
+
+class OfflineBackend(LlaveMXOAuth2):
+    """Sin red: refresco y /cerrarSesion responden según los atributos de la clase."""
+
+    refreshes = 0
+    logouts = []
+    logout_status = 200
+    on_logout = None
+
+    def _ws_request(self, endpoint, method, url, headers, body=None, idempotent=False):
+        if endpoint == "refresh":
+            OfflineBackend.refreshes += 1
+            n = OfflineBackend.refreshes
+            return {"accessToken": f"access-{n}", "refreshToken": f"refresh-{n}", "expiresIn": 900}
+        OfflineBackend.logouts.append(headers["Authorization"])
+        if OfflineBackend.on_logout:
+            OfflineBackend.on_logout()
+        if OfflineBackend.logout_status != 200:
+            raise HTTPError(url, OfflineBackend.logout_status, "error", {}, io.BytesIO(b"{}"))
+        return {}
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    cache.clear()
+    OfflineBackend.refreshes = 0
+    OfflineBackend.logouts = []
+    OfflineBackend.logout_status = 200
+    OfflineBackend.on_logout = None
+    yield
+    UserSocialAuth.objects.all().delete()
+    User.objects.all().delete()
+    cache.clear()
+
+
+def _social(expired=False):
+    user = User.objects.create(username="ana")
+    auth_time = int(time.time()) - (1000 if expired else 0)
+    return UserSocialAuth.objects.create(
+        user=user,
+        provider="llavemx",
+        uid="4242",
+        extra_data={
+            "access_token": "access-0",
+            "refresh_token": "refresh-0",
+            "expires_in": 900,
+            "auth_time": auth_time,
+            "nombre": "Ana",
+        },
+    )
+
+
+def _revoke_all():
+    backend = OfflineBackend(strategy=load_strategy())
+    return revoke_all(backend, workers=1, rate=0, batch_size=10)
+
+
+def test_revoked_tokens_are_cleared():
+    social = _social()
+
+    stats = _revoke_all()
+
+    social.refresh_from_db()
+    assert stats["revoked"] == 1
+    assert "access_token" not in social.extra_data
+    assert "refresh_token" not in social.extra_data
+    assert social.extra_data["nombre"] == "Ana"
+
+
+@override_settings(SOCIAL_AUTH_LLAVEMX_REVOKE_MAX_RETRIES=0)
+def test_refreshed_pair_is_kept_when_logout_fails():
+    OfflineBackend.logout_status = 503
+    social = _social(expired=True)
+
+    stats = _revoke_all()
+
+    social.refresh_from_db()
+    assert stats["failed"] == 1
+    assert OfflineBackend.refreshes == 1
+    assert social.extra_data["access_token"] == "access-1"
+    assert social.extra_data["refresh_token"] == "refresh-1"
+
+
+def test_login_during_batch_is_not_overwritten():
+    social = _social()
+
+    def new_login():
+        UserSocialAuth.objects.filter(pk=social.pk).update(
+            extra_data={"access_token": "nuevo", "refresh_token": "nuevo-r", "nombre": "Ana María"}
+        )
+
+    OfflineBackend.on_logout = new_login
+
+    stats = _revoke_all()
+
+    social.refresh_from_db()
+    assert stats["revoked"] == 1
+    assert social.extra_data == {"access_token": "nuevo", "refresh_token": "nuevo-r", "nombre": "Ana María"}
+
+
+def test_background_jobs_close_old_connections(monkeypatch):
+    events = []
+    monkeypatch.setattr("oauth2_llavemx.revocation.close_old_connections", lambda: events.append("close"))
+    revocations = RevocationQueue(workers=1, max_retries=0)
+
+    revocations.submit(lambda token: events.append(token), "access-0")
+    revocations._queue.join()
+
+    assert events == ["close", "access-0", "close"]
@@ -0,0 +1,73 @@
+"""
+Roles (FETCH_ROLES): se piden después de /datosUsuario y solo si el cache
+por idUsuario no los tiene, en el camino síncrono y en el asyncio.
+"""
+
+import asyncio
+
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+from social_django.utils import load_strategy
+
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+PROFILE = {"idUsuario": 4242, "curp": "PRUE800101HDFXXX01", "correo": "ana@example.mx"}
+ROLES = [{"rol": "alumno"}]
+
+
+class OfflineBackend(LlaveMXOAuth2):
+    """Sin red: registra el orden de las llamadas a los WS."""
+
+    calls = []
+
+    def _ws_request(self, endpoint, method, url, headers, body=None, idempotent=False):
+        OfflineBackend.calls.append(endpoint)
+        return dict(PROFILE) if endpoint == "user_data" else list(ROLES)
+
+    async def _aws_request(self, endpoint, method, url, headers, body=None, idempotent=False):
+        return self._ws_request(endpoint, method, url, headers, body, idempotent)
+
+
+@pytest.fixture(autouse=True)
+def roles_enabled():
+    cache.clear()
+    OfflineBackend.calls = []
+    with override_settings(SOCIAL_AUTH_LLAVEMX_FETCH_ROLES=True, SOCIAL_AUTH_LLAVEMX_PROFILE_CACHE_TTL=0):
+        yield
+    cache.clear()
+
+
+def _user_data(token):
+    return OfflineBackend(strategy=load_strategy()).user_data(token)
+
+
+def _auser_data(token):
+    return asyncio.run(OfflineBackend(strategy=load_strategy()).auser_data(token))
+
+
+@pytest.mark.parametrize("fetch", [_user_data, _auser_data])
+def test_first_login_fetches_roles_after_profile(fetch):
+    data = fetch("token-1")
+
+    assert data["roles"] == ROLES
+    assert OfflineBackend.calls == ["user_data", "roles"]
+
+
+@pytest.mark.parametrize("fetch", [_user_data, _auser_data])
+def test_returning_user_reads_roles_from_cache(fetch):
+    fetch("token-1")
+    OfflineBackend.calls = []
+
+    data = fetch("token-2")
+
+    assert data["roles"] == ROLES
+    assert OfflineBackend.calls == ["user_data"]
+
+
+def test_roles_disabled_skips_the_endpoint():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_FETCH_ROLES=False):
+        data = _user_data("token-1")
+
+    assert "roles" not in data
+    assert OfflineBackend.calls == ["user_data"]
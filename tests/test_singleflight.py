@@ -0,0 +1,63 @@
+"""
+SingleFlight: quien espera nunca ejecuta la operación sin el candado.
+"""
+
+import threading
+
+import pytest
+from django.core.cache import cache
+
+from oauth2_llavemx.singleflight import FlightTimeout, SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _flight():
+    return SingleFlight(cache, "test", "llave", lock_ttl=5)
+
+
+def _never_shared(error):
+    return None
+
+
+def test_waiter_times_out_without_running():
+    calls = []
+    cache.add(_flight().lock_key, 1, 5)
+
+    with pytest.raises(FlightTimeout):
+        _flight().run(lambda: calls.append(1), _never_shared, wait=0.2)
+    assert calls == []
+
+
+def test_waiter_takes_the_lock_when_leader_publishes_nothing():
+    leader_started = threading.Event()
+    release_leader = threading.Event()
+    held = []
+
+    def failing():
+        leader_started.set()
+        release_leader.wait(2)
+        raise RuntimeError("error transitorio")
+
+    def leader():
+        with pytest.raises(RuntimeError):
+            _flight().run(failing, _never_shared)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    leader_started.wait(2)
+    threading.Timer(0.1, release_leader.set).start()
+
+    def retry():
+        held.append(cache.get(_flight().lock_key))
+        return "token"
+
+    assert _flight().run(retry, _never_shared, wait=2) == ("ok", "token")
+    thread.join()
+    assert held == [1]
+
@@ -0,0 +1,80 @@
+"""
+Registro multi-sitio: cada host con su cliente (credenciales, ambiente,
+ajustes y pool); los hosts sin entrada usan los settings globales.
+"""
+
+import pytest
+from django.test import override_settings
+from social_django.utils import load_strategy
+
+from benchmarks import harness
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+from oauth2_llavemx.sites import ENVIRONMENTS, SITE_FIELD, basic_auth_header
+
+SITES = {
+    "campus.example.mx": {"KEY": "key-campus", "WS_USER": "ws-campus", "WS_PASSWORD": "pw", "READ_TIMEOUT": 7},
+    "Pruebas.Example.mx": {"KEY": "key-pruebas", "ENVIRONMENT": "validation"},
+}
+
+
+@pytest.fixture(autouse=True)
+def sites():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_SITES=SITES):
+        yield
+
+
+def _backend(host):
+    request = harness.make_request("/auth/complete/llavemx/")
+    request.META["HTTP_HOST"] = host
+    return LlaveMXOAuth2(strategy=load_strategy(request))
+
+
+def test_site_overrides_win_over_global_settings():
+    backend = _backend("campus.example.mx:8000")
+
+    assert backend.site.name == "campus.example.mx"
+    assert backend.setting("KEY") == "key-campus"
+    assert backend.setting("SECRET") == "bench-secret"
+    assert backend.setting("READ_TIMEOUT", 15) == 7
+    assert backend._basic_auth() == basic_auth_header("ws-campus", "pw")
+
+
+def test_unknown_host_uses_global_settings():
+    backend = _backend("otro.example.mx")
+
+    assert backend.site.name is None
+    assert backend.setting("KEY") == "bench-client"
+    assert backend._url("ACCESS_TOKEN_URL") == LlaveMXOAuth2.ACCESS_TOKEN_URL
+
+
+def test_validation_site_uses_its_endpoints_and_breaker():
+    backend = _backend("pruebas.example.mx")
+
+    assert backend._url("ACCESS_TOKEN_URL") == ENVIRONMENTS["validation"]["ACCESS_TOKEN_URL"]
+    assert backend._breaker("token").name == "pruebas.example.mx.token"
+    assert _backend("campus.example.mx")._breaker("token").name == "token"
+
+
+def test_each_site_has_its_own_pool():
+    campus = _backend("campus.example.mx")
+
+    assert campus._transport() is _backend("campus.example.mx")._transport()
+    assert campus._transport() is not _backend("otro.example.mx")._transport()
+
+
+def test_global_settings_are_not_memoized():
+    backend = _backend("otro.example.mx")
+
+    with override_settings(SOCIAL_AUTH_LLAVEMX_KEY="editada-en-admin"):
+        assert backend.setting("KEY") == "editada-en-admin"
+    assert backend.setting("KEY") == "bench-client"
+
+
+def test_login_site_is_stored_for_work_outside_the_request():
+    backend = _backend("campus.example.mx")
+
+    data = backend.extra_data(None, "4242", {"access_token": "a"}, {}, {})
+
+    assert data[SITE_FIELD] == "campus.example.mx"
+    offline = LlaveMXOAuth2(strategy=load_strategy()).for_site(data[SITE_FIELD])
+    assert offline.setting("KEY") == "key-campus"
@@ -0,0 +1,162 @@
+"""
+Ida y vuelta completa del state firmado: auth_url() en un request y
+auth_complete() en el callback del mismo navegador.
+
+auth_complete() valida el state y BaseOAuth2.auth_complete() lo vuelve a
+validar; el nonce de un solo uso no debe hacer fallar el segundo llamado.
+También el single-flight del canje: solo lo comparte el mismo navegador y
+nunca con un error transitorio.
+"""
+
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from django.core.cache import cache
+from django.middleware.csrf import CsrfViewMiddleware
+from django.test import override_settings
+from social_core.exceptions import AuthFailed, AuthUnknownError
+from social_django.utils import load_strategy
+
+from benchmarks import harness
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+
+PROFILE = {
+    "idUsuario": 4242,
+    "curp": "PRUE800101HDFXXX01",
+    "nombre": "Ana",
+    "primerApellido": "Prueba",
+    "correo": "ana@example.mx",
+}
+
+
+class OfflineBackend(LlaveMXOAuth2):
+    """Sin red: el canje y /datosUsuario regresan respuestas fijas."""
+
+    exchanges = 0
+    failures = 0
+
+    def _ws_request(self, endpoint, method, url, headers, body=None, idempotent=False):
+        if endpoint == "token":
+            OfflineBackend.exchanges += 1
+            if OfflineBackend.failures:
+                OfflineBackend.failures -= 1
+                raise AuthUnknownError(self, "Error de conexión con LlaveMX")
+            return {"accessToken": "token-4242", "refreshToken": "refresh-4242", "expiresIn": 900}
+        return dict(PROFILE)
+
+
+def _backend(request):
+    return OfflineBackend(strategy=load_strategy(request), redirect_uri="https://lms.example.mx/auth/complete/llavemx/")
+
+
+def _start_login():
+    request = harness.make_request("/auth/login/llavemx/")
+    state = parse_qs(urlsplit(_backend(request).auth_url()).query)["state"][0]
+    return state, request.META["CSRF_COOKIE"], request
+
+
+def _callback(state, csrf_cookie, code="code-4242"):
+    request = harness.make_request(
+        "/auth/complete/llavemx/",
+        {"code": code, "state": state},
+        cookies={"csrftoken": csrf_cookie},
+    )
+    CsrfViewMiddleware(lambda r: None).process_request(request)
+    backend = _backend(request)
+    backend.data = request.GET
+    return backend
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear()
+    OfflineBackend.exchanges = 0
+    OfflineBackend.failures = 0
+    yield
+    cache.clear()
+
+
+@pytest.mark.parametrize("single_flight", [True, False])
+def test_signed_state_round_trip(single_flight):
+    with override_settings(
+        SOCIAL_AUTH_LLAVEMX_STATE_MODE="signed",
+        SOCIAL_AUTH_LLAVEMX_CODE_SINGLE_FLIGHT=single_flight,
+    ):
+        state, csrf_cookie, login_request = _start_login()
+        assert state.count(".") == 2
+        assert not login_request.session.modified
+
+        user = _callback(state, csrf_cookie).auth_complete()
+
+        assert user is not None
+        assert user.social_auth.get(provider="llavemx").uid == "4242"
+        assert OfflineBackend.exchanges == 1
+
+
+def test_signed_state_is_single_use():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_STATE_MODE="signed", SOCIAL_AUTH_LLAVEMX_CODE_SINGLE_FLIGHT=False):
+        state, csrf_cookie, _ = _start_login()
+        _callback(state, csrf_cookie).auth_complete()
+
+        with pytest.raises(AuthFailed):
+            _callback(state, csrf_cookie).auth_complete()
+
+
+def test_signed_state_rejects_other_browser():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_STATE_MODE="signed"):
+        state, _, _ = _start_login()
+        _, other_cookie, _ = _start_login()
+
+        with pytest.raises(AuthFailed):
+            _callback(state, other_cookie).auth_complete()
+        assert OfflineBackend.exchanges == 0
+
+
+
+def test_code_flight_is_not_shared_across_browsers():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_STATE_MODE="signed"):
+        state, csrf_cookie, _ = _start_login()
+        other_state, other_cookie, _ = _start_login()
+
+        _callback(state, csrf_cookie).auth_complete()
+        _callback(other_state, other_cookie).auth_complete()
+
+        assert OfflineBackend.exchanges == 2
+
+
+def test_code_flight_does_not_publish_unknown_errors():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_STATE_MODE="signed"):
+        state, csrf_cookie, _ = _start_login()
+        OfflineBackend.failures = 1
+
+        with pytest.raises(AuthUnknownError):
+            _callback(state, csrf_cookie).auth_complete()
+
+        assert _callback(state, csrf_cookie).auth_complete() is not None
+        assert OfflineBackend.exchanges == 2
+
+
+def test_code_flight_result_is_reused_only_briefly():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_STATE_MODE="signed", SOCIAL_AUTH_LLAVEMX_CODE_RESULT_TTL=1):
+        state, csrf_cookie, _ = _start_login()
+        _callback(state, csrf_cookie).auth_complete()
+        _callback(state, csrf_cookie).auth_complete()
+        assert OfflineBackend.exchanges == 1
+
+        # Pasada la ventana, la URL repetida vuelve a canjear (y LlaveMX rechaza el code usado).
+        time.sleep(1.1)
+        _callback(state, csrf_cookie).auth_complete()
+        assert OfflineBackend.exchanges == 2
+
+
+def test_code_flight_waiter_fails_instead_of_exchanging():
+    with override_settings(SOCIAL_AUTH_LLAVEMX_STATE_MODE="signed", SOCIAL_AUTH_LLAVEMX_LOGIN_TIMEOUT=0.3):
+        state, csrf_cookie, _ = _start_login()
+        backend = _callback(state, csrf_cookie)
+        # Otro worker tiene el candado del canje y nunca publica resultado.
+        cache.add(backend._code_flight().lock_key, 1, 30)
+
+        with pytest.raises(AuthUnknownError):
+            backend.auth_complete()
+        assert OfflineBackend.exchanges == 0
@@ -0,0 +1,133 @@
+"""
+Refresco del access token con el refresh_token guardado: en línea con
+single-flight por cuenta y por lotes sin pisar un login concurrente.
+"""
+
+import threading
+import time
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from social_django.models import UserSocialAuth
+from social_django.utils import load_strategy
+
+from oauth2_llavemx.llavemx_oauth import LlaveMXOAuth2
+from oauth2_llavemx.tokens import _lock_key, get_valid_access_token, needs_refresh, refresh_expiring
+
+User = get_user_model()
+
+
+class OfflineBackend(LlaveMXOAuth2):
+    """Sin red: cada refresco regresa un par nuevo numerado."""
+
+    refreshes = 0
+    on_refresh = None
+
+    def _ws_request(self, endpoint, method, url, headers, body=None, idempotent=False):
+        OfflineBackend.refreshes += 1
+        if OfflineBackend.on_refresh:
+            OfflineBackend.on_refresh()
+        n = OfflineBackend.refreshes
+        return {"accessToken": f"access-{n}", "refreshToken": f"refresh-{n}", "expiresIn": 900}
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    cache.clear()
+    OfflineBackend.refreshes = 0
+    OfflineBackend.on_refresh = None
+    yield
+    UserSocialAuth.objects.all().delete()
+    User.objects.all().delete()
+    cache.clear()
+
+
+def _backend():
+    return OfflineBackend(strategy=load_strategy())
+
+
+def _social(uid="4242", expires_in=900, age=0):
+    user = User.objects.create(username=f"user-{uid}")
+    return UserSocialAuth.objects.create(
+        user=user,
+        provider="llavemx",
+        uid=uid,
+        extra_data={
+            "access_token": "access-0",
+            "refresh_token": "refresh-0",
+            "expires_in": expires_in,
+            "auth_time": int(time.time()) - age,
+        },
+    )
+
+
+def test_needs_refresh_within_margin():
+    now = 1_000_000
+    data = {"refresh_token": "r", "expires_in": 900, "auth_time": now - 800}
+
+    assert needs_refresh(data, margin=120, now=now)
+    assert not needs_refresh(data, margin=60, now=now)
+    assert not needs_refresh({**data, "refresh_token": None}, margin=120, now=now)
+    assert not needs_refresh({"refresh_token": "r"}, margin=120, now=now)
+
+
+def test_fresh_token_is_returned_without_refreshing():
+    social = _social()
+
+    assert get_valid_access_token(_backend(), social) == "access-0"
+    assert OfflineBackend.refreshes == 0
+
+
+def test_expiring_token_is_refreshed_and_saved():
+    social = _social(age=850)
+
+    assert get_valid_access_token(_backend(), social) == "access-1"
+
+    social.refresh_from_db()
+    assert social.extra_data["access_token"] == "access-1"
+    assert social.extra_data["refresh_token"] == "refresh-1"
+    assert OfflineBackend.refreshes == 1
+
+
+def test_waiter_reads_the_token_refreshed_by_another_worker():
+    social = _social(age=850)
+    cache.add(_lock_key(social), 1, 30)
+    # Otro worker ya guardó el par nuevo y suelta su candado poco después.
+    UserSocialAuth.objects.filter(pk=social.pk).update(
+        extra_data={**social.extra_data, "access_token": "access-otro", "refresh_token": "refresh-otro"}
+    )
+    threading.Timer(0.1, cache.delete, [_lock_key(social)]).start()
+
+    assert get_valid_access_token(_backend(), social) == "access-otro"
+    assert OfflineBackend.refreshes == 0
+
+
+def test_batch_refreshes_only_expiring_tokens():
+    due = _social("1", age=850)
+    fresh = _social("2")
+
+    stats = refresh_expiring(_backend(), margin=120, workers=1)
+
+    due.refresh_from_db()
+    fresh.refresh_from_db()
+    assert stats["due"] == 1 and stats["refreshed"] == 1
+    assert due.extra_data["access_token"] == "access-1"
+    assert fresh.extra_data["access_token"] == "access-0"
+
+
+def test_batch_does_not_overwrite_a_login_during_the_refresh():
+    social = _social(age=850)
+
+    def new_login():
+        UserSocialAuth.objects.filter(pk=social.pk).update(
+            extra_data={"access_token": "login", "refresh_token": "login-r", "expires_in": 900}
+        )
+
+    OfflineBackend.on_refresh = new_login
+
+    stats = refresh_expiring(_backend(), margin=120, workers=1)
+
+    social.refresh_from_db()
+    assert stats["refreshed"] == 0 and stats["unchanged"] == 1
+    assert social.extra_data == {"access_token": "login", "refresh_token": "login-r", "expires_in": 900}